@@ -0,0 +1,75 @@
+"""
+    SCS aggregation benchmark
+    Python 3
+    Usage: python3 bench_aggregation.py [--records 10000000]
+    coding: utf-8
+
+    Compares the original list-of-strings calculate() and DTE record count against the
+    streaming engine in server/aggregation.py and the mapped files of server/datafile.py,
+    with and without NumPy. Every run happens in a fresh child process so the reported
+    peak memory belongs to that run alone.
+"""
+import argparse, os, sys, tempfile
+from benchutil import SERVER_DIR, write_samples, measure_in_child
+
+sys.path.insert(0, SERVER_DIR)
+import aggregation, datafile
+
+
+# the calculate() the server shipped with: whole file as strings, one loop per statistic
+def legacy_summary(fileName):
+    with open(fileName) as f:
+        nums = f.read().splitlines()
+    sum_data = 0
+    for a in range(0, len(nums)):
+        sum_data += int(nums[a])
+        avg_data = sum_data / len(nums)
+    max_data = max(int(n) for n in nums)
+    min_data = min(int(n) for n in nums)
+    return sum_data
+
+
+# DTE's record count as the server shipped with it
+def legacy_count(fileName):
+    with open(fileName, "r") as f:
+        return len(f.read().splitlines())
+
+
+def engine_summary(fileName, use_numpy):
+    return aggregation.summarize_file(fileName, use_numpy).total
+
+
+def engine_percentile(fileName, use_numpy):
+    return aggregation.percentile_file(fileName, 99, use_numpy)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=10000000)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".txt")
+    os.close(fd)
+    write_samples(path, args.records)
+    print(f"{args.records} records, {os.path.getsize(path) / 2**20:.1f} MB")
+
+    runs = [("legacy SUM/AVERAGE/MIN/MAX", legacy_summary, ()),
+            ("legacy DTE count", legacy_count, ()),
+            ("mapped DTE count", datafile.count_samples, ())]
+    engines = [False, True] if aggregation.numpy is not None else [False]
+    for use_numpy in engines:
+        name = "numpy" if use_numpy else "python"
+        runs.append((f"{name} SUM..STDDEV", engine_summary, (use_numpy,)))
+        runs.append((f"{name} P99", engine_percentile, (use_numpy,)))
+
+    print(f"{'run':<30}{'seconds':>9}{'Mrec/s':>9}{'peak MB':>9}")
+    try:
+        for name, func, extra in runs:
+            result, elapsed, peak = measure_in_child(func, path, *extra)
+            print(f"{name:<30}{elapsed:>9.2f}{args.records / elapsed / 1e6:>9.2f}{peak:>9.1f}")
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+    Compression matrix: codec and level against upload throughput and CPU
+    Python 3
+    Usage: python3 bench_compression.py [--samples 500000] [--formats text binary] [--bandwidth 0 100 10]
+    coding: utf-8
+
+    EDG files (text and binary) are uploaded with UED through client/batchclient.py,
+    once without compression and once per codec and level. The upload goes through
+    a proxy process that paces both directions to --bandwidth megabits per second,
+    0 meaning loopback speed, to stand in for the links edge devices actually have.
+
+    Reported per cell: effective throughput in MB of file per second, bytes on the
+    wire as a share of the file, and the CPU seconds the client spent compressing
+    and the server spent decompressing. Level is zlib's 1-9, lzma's preset 0-9,
+    zstd's 1-22 or lz4's 0-16; zstd and lz4 are only measured when installed.
+"""
+import argparse, asyncio, multiprocessing, os, shutil, sys, tempfile, time
+from benchutil import CLIENT_DIR, ServerProcess, cpu_seconds, free_port, server_stats
+
+sys.path.insert(0, CLIENT_DIR)
+import batchclient
+import datagen
+
+LEVELS = {"zlib": [1, 6, 9], "lzma": [0, 6], "zstd": [1, 3, 19], "lz4": [0, 9]}
+
+
+async def pace(reader, writer, rate):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+            if rate:
+                await asyncio.sleep(len(data) / rate)
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+# forward listen_port to target_port, rate bytes per second each way, 0 for no limit
+def proxy(listen_port, target_port, rate):
+    async def handle(reader, writer):
+        upstream_reader, upstream_writer = await asyncio.open_connection("127.0.0.1", target_port)
+        await asyncio.gather(pace(reader, upstream_writer, rate), pace(upstream_reader, writer, rate))
+
+    async def serve():
+        server = await asyncio.start_server(handle, "127.0.0.1", listen_port)
+        async with server:
+            await server.serve_forever()
+    asyncio.run(serve())
+
+
+async def upload(port, directory, codec, level):
+    client = batchclient.DeviceClient("127.0.0.1", port, "a", "b", 9000, directory,
+                                      compress=[codec] if codec else [], level=level)
+    if not await client.connect():
+        raise RuntimeError("login failed")
+    if codec and client.codec != codec:
+        raise RuntimeError(f"the server did not agree to {codec}")
+    future = await client.submit("UED 1")
+    reply = await future
+    await client.close()
+    if not reply.startswith("successfully"):
+        raise RuntimeError(reply)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=500000)
+    parser.add_argument("--formats", nargs="+", default=["text", "binary"])
+    parser.add_argument("--bandwidth", type=float, nargs="+", default=[0, 100, 10], help="Mbit/s, 0 for no limit")
+    args = parser.parse_args()
+
+    cells = [(None, None)] + [(codec, level) for codec in batchclient.available_codecs() for level in LEVELS[codec]]
+    scratch = tempfile.mkdtemp(prefix="bench-compression-")
+    context = multiprocessing.get_context("fork")
+    print(f"{'format':<8}{'Mbit/s':>7}{'codec':>7}{'level':>6}{'MB/s':>9}{'wire %':>8}{'client cpu s':>14}{'server cpu s':>14}")
+    try:
+        with ServerProcess("--log-level", "WARNING", "--stats-cache-size", 0) as server:
+            for fmt in args.formats:
+                fileName = os.path.join(scratch, f"a-1{datagen.FORMATS[fmt]}")
+                for other in datagen.FORMATS.values():
+                    if os.path.exists(os.path.join(scratch, f"a-1{other}")):
+                        os.remove(os.path.join(scratch, f"a-1{other}"))
+                datagen.generate(fileName, args.samples, fmt)
+                size = os.path.getsize(fileName)
+                for mbit in args.bandwidth:
+                    port = free_port()
+                    relay = context.Process(target=proxy, args=(port, server.port, mbit * 1e6 / 8), daemon=True)
+                    relay.start()
+                    time.sleep(0.3)
+                    try:
+                        for codec, level in cells:
+                            wire = server_stats(server.port, "c", "d")["bytes_in"]
+                            server_cpu = cpu_seconds(server.process.pid)
+                            client_cpu = time.process_time()
+                            start = time.perf_counter()
+                            asyncio.run(upload(port, scratch, codec, level))
+                            elapsed = time.perf_counter() - start
+                            client_cpu = time.process_time() - client_cpu
+                            server_cpu = cpu_seconds(server.process.pid) - server_cpu
+                            wire = server_stats(server.port, "c", "d")["bytes_in"] - wire
+                            print(f"{fmt:<8}{mbit:>7g}{codec or 'none':>7}{'' if level is None else level:>6}"
+                                  f"{size / elapsed / 1e6:>9.1f}{100 * wire / size:>8.1f}"
+                                  f"{client_cpu:>14.3f}{server_cpu:>14.3f}")
+                    finally:
+                        relay.terminate()
+                        relay.join()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+    Connection scaling benchmark: thread-per-connection vs asyncio server
+    Python 3
+    Usage: python3 bench_connections.py [--sizes 1000 5000 10000] [--modes thread async]
+    coding: utf-8
+
+    For every mode and fleet size a fresh server is started, the simulated edge devices
+    log in and stay connected, then every device sends one message at the same time.
+    Reported: time to log the whole fleet in, round-trip latency with the fleet idle on
+    the server, and the server's thread count and resident memory.
+"""
+import argparse, asyncio, time
+from benchutil import ServerProcess, raise_fd_limit, percentile, async_login, encode_frame, read_frame
+
+
+async def login_device(port, udp_port, gate):
+    async with gate:
+        return await async_login(port, "a", "b", udp_port)
+
+
+async def ping(reader, writer):
+    start = time.perf_counter()
+    writer.write(encode_frame("ping"))
+    await read_frame(reader)
+    return time.perf_counter() - start
+
+
+async def run_fleet(server, size, connect_concurrency):
+    gate = asyncio.Semaphore(connect_concurrency)
+    start = time.perf_counter()
+    devices = await asyncio.gather(*(login_device(server.port, 20000 + i, gate) for i in range(size)))
+    login_time = time.perf_counter() - start
+    threads, rss = server.threads(), server.rss_kb()
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(ping(r, w) for r, w in devices))
+    ping_time = time.perf_counter() - start
+    for _, writer in devices:
+        writer.close()
+    return {
+        "login_s": login_time,
+        "logins_per_s": size / login_time,
+        "ping_p50_ms": percentile(latencies, 50) * 1000,
+        "ping_p99_ms": percentile(latencies, 99) * 1000,
+        "ping_all_s": ping_time,
+        "threads": threads,
+        "rss_mb": (rss or 0) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 10000])
+    parser.add_argument("--modes", nargs="+", default=["thread", "async"])
+    parser.add_argument("--connect-concurrency", type=int, default=256)
+    args = parser.parse_args()
+
+    limit = raise_fd_limit()
+    print(f"file descriptor limit: {limit}")
+    print(f"{'mode':<8}{'devices':>8}{'login s':>10}{'logins/s':>10}{'p50 ms':>9}"
+          f"{'p99 ms':>9}{'threads':>9}{'rss MB':>9}")
+    for mode in args.modes:
+        for size in args.sizes:
+            with ServerProcess("--mode", mode) as server:
+                r = asyncio.run(run_fleet(server, size, args.connect_concurrency))
+            print(f"{mode:<8}{size:>8}{r['login_s']:>10.2f}{r['logins_per_s']:>10.0f}"
+                  f"{r['ping_p50_ms']:>9.1f}{r['ping_p99_ms']:>9.1f}{r['threads']:>9}{r['rss_mb']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+    Text vs binary data file benchmark
+    Python 3
+    Usage: python3 bench_formats.py [--records 10000000] [--repeat 3]
+    coding: utf-8
+
+    For the same samples written as text (one per line) and as binary (packed int64)
+    it measures:
+        generation   the original per-line EDG loop against datagen's bulk writes
+        upload       UED of each file to a server, file size and MB/s
+        aggregation  summarize_file/percentile_file in process, and an SCS round trip
+"""
+import argparse, os, sys, tempfile, time
+from benchutil import SERVER_DIR, CLIENT_DIR, ServerProcess, login, send_frame, recv_frame, upload, measure_in_child
+
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, CLIENT_DIR)
+import aggregation, datagen
+
+FORMAT_ARG = {"text": "txt", "binary": "bin"}
+
+
+# the EDG loop the client shipped with: one write() per sample
+def legacy_generate(fileName, count):
+    f = open(fileName, 'w')
+    i = 0
+    while i < count:
+        f.write(str(i) + "\n")
+        i += 1
+    f.close()
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for attempt in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=10000000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    scratch = tempfile.mkdtemp(prefix="bench-formats-")
+    paths = {fmt: os.path.join(scratch, "samples" + suffix) for fmt, suffix in datagen.FORMATS.items()}
+    records = args.records
+
+    try:
+        print(f"generation of {records} samples")
+        print(f"{'run':<24}{'seconds':>9}{'Mrec/s':>9}{'MB':>9}")
+        runs = [("legacy loop text", legacy_generate, paths["text"]),
+                ("bulk text", datagen.generate_text, paths["text"]),
+                ("bulk binary", datagen.generate_binary, paths["binary"])]
+        for name, func, path in runs:
+            elapsed = best_of(args.repeat, func, path, records)
+            size = os.path.getsize(path) / 2**20
+            print(f"{name:<24}{elapsed:>9.2f}{records / elapsed / 1e6:>9.2f}{size:>9.1f}")
+
+        print("\naggregation in process (fresh child per run)")
+        print(f"{'run':<24}{'seconds':>9}{'Mrec/s':>9}{'peak MB':>9}")
+        engines = [False, True] if aggregation.numpy is not None else [False]
+        for fmt, path in paths.items():
+            for use_numpy in engines:
+                engine = "numpy" if use_numpy else "python"
+                for operation, func, extra in [("SUM..", aggregation.summarize_file, (use_numpy,)),
+                                               ("P99", aggregation.percentile_file, (99, use_numpy))]:
+                    _, elapsed, peak = measure_in_child(func, path, *extra)
+                    name = f"{fmt} {engine} {operation}"
+                    print(f"{name:<24}{elapsed:>9.2f}{records / elapsed / 1e6:>9.2f}{peak:>9.1f}")
+
+        print("\nserver round trips")
+        print(f"{'run':<24}{'seconds':>9}{'MB/s':>9}{'Mrec/s':>9}")
+        with ServerProcess() as server:
+            sock = login(server.port, "a", "b")
+            for fileId, (fmt, path) in enumerate(paths.items(), 1):
+                size = os.path.getsize(path) / 2**20
+                elapsed = best_of(args.repeat, upload, sock, fileId, path, FORMAT_ARG[fmt])
+                print(f"{'UED ' + fmt:<24}{elapsed:>9.3f}{size / elapsed:>9.1f}{records / elapsed / 1e6:>9.2f}")
+                # every repeat asks for a percentile, which the summary cache cannot answer
+                elapsed = best_of(args.repeat, lambda: (send_frame(sock, f"SCS {fileId} P50"), recv_frame(sock)))
+                print(f"{'SCS P50 ' + fmt:<24}{elapsed:>9.3f}{'':>9}{records / elapsed / 1e6:>9.2f}")
+            sock.close()
+    finally:
+        for path in paths.values():
+            if os.path.exists(path):
+                os.remove(path)
+        os.rmdir(scratch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+    Light command latency while other clients run heavy SCS requests
+    Python 3
+    Usage: python3 bench_heavy.py [--samples 2000000] [--heavy 8] [--seconds 10] [--modes thread async]
+    coding: utf-8
+
+    A file of --samples text samples is uploaded and the summary cache turned off,
+    then --heavy connections loop SCS P50 on it (every request parses the whole
+    file) while one more connection loops AED and times each reply.
+
+    With --heavy-processes 0 the parsing runs on the server's threads and holds the
+    GIL, so AED waits behind it. With the process pool the server process only
+    waits for results and AED stays quick; SCS requests beyond the pool and its
+    queue get "busy, retry", which are counted.
+"""
+import argparse, asyncio, os, time
+from benchutil import ServerProcess, async_login, encode_frame, read_frame, login, upload, server_stats, \
+    percentile, write_samples
+
+
+async def heavy_loop(port, deadline, udp_port, counts):
+    reader, writer = await async_login(port, "a", "b", udp_port)
+    while time.monotonic() < deadline:
+        writer.write(encode_frame("SCS 1 P50"))
+        reply = await read_frame(reader)
+        key = "busy" if reply.startswith("busy") else "ok" if reply.startswith("result") else "other"
+        counts[key] = counts.get(key, 0) + 1
+        if key == "busy":
+            await asyncio.sleep(0.01)
+    writer.close()
+
+
+async def light_loop(port, deadline, latencies):
+    reader, writer = await async_login(port, "c", "d", 8999)
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        writer.write(encode_frame("AED"))
+        await read_frame(reader)
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.01)
+    writer.close()
+
+
+async def load(port, heavy, seconds):
+    deadline = time.monotonic() + seconds
+    counts, latencies = {}, []
+    await asyncio.gather(light_loop(port, deadline, latencies),
+                         *(heavy_loop(port, deadline, 20000 + i, counts) for i in range(heavy)))
+    return counts, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=2000000)
+    parser.add_argument("--heavy", type=int, default=8, help="connections looping SCS P50")
+    parser.add_argument("--seconds", type=int, default=10)
+    parser.add_argument("--modes", nargs="+", default=["thread", "async"])
+    args = parser.parse_args()
+
+    print(f"{'mode':<8}{'pool':>6}{'SCS ok/s':>10}{'busy':>7}{'AED p50 ms':>12}{'AED p99 ms':>12}{'AED max ms':>12}")
+    for mode in args.modes:
+        for processes in [0, max(1, os.cpu_count() or 1)]:
+            with ServerProcess("--mode", mode, "--heavy-processes", processes, "--stats-cache-size", 0,
+                               "--log-level", "WARNING") as server:
+                path = server.path("bench-1.txt")
+                write_samples(path, args.samples)
+                sock = login(server.port, "a", "b")
+                reply = upload(sock, 1, path, "txt")
+                sock.close()
+                if "successfully" not in reply:
+                    raise RuntimeError(reply)
+                counts, latencies = asyncio.run(load(server.port, args.heavy, args.seconds))
+                stats = server_stats(server.port, "c", "d")
+            print(f"{mode:<8}{processes:>6}{counts.get('ok', 0) / args.seconds:>10.1f}{stats['heavy_busy']:>7}"
+                  f"{percentile(latencies, 50) * 1000:>12.1f}{percentile(latencies, 99) * 1000:>12.1f}"
+                  f"{max(latencies) * 1000:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+    Brute-force login storm against the lockout
+    Python 3
+    Usage: python3 bench_lockout.py [--attackers 50] [--seconds 10] [--modes thread async]
+    coding: utf-8
+
+    Attackers hammer one account, whose password is a PBKDF2 hash, with wrong
+    passwords from 127.0.0.1, reconnecting as soon as they are told "block". Every
+    second the server's CPU time is sampled from /proc.
+
+    With the lockout on, the account is blocked after the allowed attempts and every
+    later attempt is turned away without hashing, so the number of credential checks
+    stays at about the number of allowed attempts and CPU does not climb with the
+    storm. With --lockout-seconds 0 (no lockout) every attempt costs a hash, for
+    comparison. Exits with status 1 if the lockout run fails those checks.
+"""
+import argparse, asyncio, sys, time
+from benchutil import SERVER_DIR, ServerProcess, encode_frame, read_frame, server_stats, cpu_seconds
+
+sys.path.insert(0, SERVER_DIR)
+import credentials
+
+ATTEMPTS = 3
+ITERATIONS = 100000
+
+
+async def attacker(port, deadline, counts):
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            continue
+        try:
+            writer.write(encode_frame("login"))
+            await read_frame(reader)
+            while time.monotonic() < deadline:
+                writer.write(encode_frame(f"victim guess{counts['attempts']}"))
+                counts["attempts"] += 1
+                reply = await read_frame(reader)
+                counts[reply] = counts.get(reply, 0) + 1
+                if reply != "Invalid":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def storm(server, attackers, seconds):
+    counts = {"attempts": 0}
+    deadline = time.monotonic() + seconds
+    samples = []
+
+    async def sample():
+        last = cpu_seconds(server.process.pid)
+        while time.monotonic() < deadline:
+            await asyncio.sleep(1)
+            now = cpu_seconds(server.process.pid)
+            samples.append(now - last)
+            last = now
+
+    await asyncio.gather(sample(), *(attacker(server.port, deadline, counts) for _ in range(attackers)))
+    return counts, samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--attackers", type=int, default=50)
+    parser.add_argument("--seconds", type=int, default=10)
+    parser.add_argument("--modes", nargs="+", default=["thread", "async"])
+    args = parser.parse_args()
+
+    accounts = [f"victim {credentials.hash_password('secret', iterations=ITERATIONS)}", "monitor monitor"]
+    print(f"{'mode':<8}{'lockout':>8}{'attempts':>10}{'blocked':>9}{'hashed':>8}"
+          f"{'cpu %/s first..last':>32}")
+    failed = False
+    for mode in args.modes:
+        for lockout in [args.seconds * 2, 0]:
+            with ServerProcess("--mode", mode, "--lockout-seconds", lockout, "--log-level", "WARNING",
+                               attempts=ATTEMPTS, credentials=accounts) as server:
+                counts, samples = asyncio.run(storm(server, args.attackers, args.seconds))
+                stats = server_stats(server.port, "monitor", "monitor")
+            hashed = stats["login_failures"]
+            cpu = " ".join(f"{100 * s:.0f}" for s in samples)
+            print(f"{mode:<8}{lockout:>8}{counts['attempts']:>10}{stats['logins_blocked']:>9}{hashed:>8}  {cpu}")
+            if lockout:
+                # attempts already past the lockout check when the block lands still get hashed
+                bounded = hashed <= ATTEMPTS + args.attackers
+                half = len(samples) // 2
+                flat = not samples or max(samples[half:] or samples) <= max(samples[:half] or samples) + 0.1
+                if not (bounded and flat):
+                    failed = True
+                    print(f"  FAIL: {hashed} credential checks, cpu per second {samples}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+    Login storm benchmark
+    Python 3
+    Usage: python3 bench_login.py [--logins 2000] [--concurrency 200] [--devices 1000]
+    coding: utf-8
+
+    A fleet of devices reconnects at once and every device logs in. Runs against a
+    credentials.txt with plain passwords and one with PBKDF2 hashes, in thread and
+    async mode, and reports logins per second and login latency percentiles.
+"""
+import argparse, asyncio, sys, time
+from benchutil import SERVER_DIR, ServerProcess, async_login, percentile
+
+sys.path.insert(0, SERVER_DIR)
+import credentials
+
+
+async def one_login(port, name, gate, latencies):
+    async with gate:
+        start = time.perf_counter()
+        reader, writer = await async_login(port, name, "secret")
+        latencies.append(time.perf_counter() - start)
+        writer.close()
+
+
+async def storm(port, devices, logins, concurrency):
+    gate = asyncio.Semaphore(concurrency)
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(one_login(port, f"device{i % devices}", gate, latencies) for i in range(logins)))
+    return time.perf_counter() - start, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=10000,
+                        help="PBKDF2 iterations of the hashed credentials, kept low so the run finishes")
+    parser.add_argument("--modes", nargs="+", default=["thread", "async"])
+    args = parser.parse_args()
+
+    plain = [f"device{i} secret" for i in range(args.devices)]
+    hashed = [f"device{i} {credentials.hash_password('secret', iterations=args.iterations)}"
+              for i in range(args.devices)]
+
+    print(f"{'mode':<8}{'secrets':<10}{'logins/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for mode in args.modes:
+        for label, lines in [("plain", plain), ("pbkdf2", hashed)]:
+            with ServerProcess("--mode", mode, credentials=lines) as server:
+                elapsed, latencies = asyncio.run(storm(server.port, args.devices, args.logins, args.concurrency))
+            print(f"{mode:<8}{label:<10}{args.logins / elapsed:>10.0f}{percentile(latencies, 50) * 1000:>9.1f}"
+                  f"{percentile(latencies, 95) * 1000:>9.1f}{percentile(latencies, 99) * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
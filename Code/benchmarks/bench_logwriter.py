@@ -0,0 +1,91 @@
+"""
+    Log writer microbenchmark
+    Python 3
+    Usage: python3 bench_logwriter.py [--threads 16] [--lines 2000]
+    coding: utf-8
+
+    Request threads append upload-log style lines the way the handlers do. Compares
+    the original open/append/close per line, DirectLogWriter (same thing under one
+    lock) and the background LogWriter, each with and without fsync, and reports the
+    time a request spends in the log call.
+"""
+import argparse, os, sys, tempfile, threading, time
+from datetime import datetime
+from benchutil import SERVER_DIR, percentile
+
+sys.path.insert(0, SERVER_DIR)
+import logwriter
+
+
+class LegacyWriter:
+    """What the handlers did before: open, append one line and close, no locking."""
+
+    def __init__(self, fsync):
+        self.fsync = fsync
+
+    def start(self):
+        pass
+
+    def write(self, fileName, line):
+        f = open(fileName, "a")
+        f.write(line)
+        if self.fsync != "none":
+            f.flush()
+            os.fsync(f.fileno())
+        f.close()
+
+    def close(self):
+        pass
+
+
+def run(writer, fileName, threads, lines):
+    latencies = [[] for _ in range(threads)]
+
+    def request_thread(index):
+        for i in range(lines):
+            line = f"device{index}; {datetime.now()}; {i}; 1000\n"
+            start = time.perf_counter()
+            writer.write(fileName, line)
+            latencies[index].append(time.perf_counter() - start)
+
+    writer.start()
+    start = time.perf_counter()
+    workers = [threading.Thread(target=request_thread, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    writer.close()
+    elapsed = time.perf_counter() - start
+    with open(fileName) as f:
+        written = sum(1 for _ in f)
+    return elapsed, [x for per_thread in latencies for x in per_thread], written
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--lines", type=int, default=2000, help="lines per thread")
+    args = parser.parse_args()
+
+    writers = []
+    for fsync in ["none", "batch"]:
+        writers.append((f"legacy fsync={fsync}", lambda fsync=fsync: LegacyWriter(fsync)))
+        writers.append((f"direct fsync={fsync}", lambda fsync=fsync: logwriter.DirectLogWriter(fsync)))
+        writers.append((f"background fsync={fsync}", lambda fsync=fsync: logwriter.LogWriter(fsync=fsync)))
+
+    total = args.threads * args.lines
+    print(f"{'writer':<26}{'lines/s':>10}{'p50 us':>9}{'p99 us':>10}{'lines ok':>10}")
+    for name, make in writers:
+        fd, fileName = tempfile.mkstemp(suffix=".txt")
+        os.close(fd)
+        try:
+            elapsed, latencies, written = run(make(), fileName, args.threads, args.lines)
+        finally:
+            os.remove(fileName)
+        print(f"{name:<26}{total / elapsed:>10.0f}{percentile(latencies, 50) * 1e6:>9.1f}"
+              f"{percentile(latencies, 99) * 1e6:>10.1f}{'yes' if written == total else 'NO':>10}")
+
+
+if __name__ == "__main__":
+    main()
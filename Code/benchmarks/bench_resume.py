@@ -0,0 +1,55 @@
+"""
+    Reconnect cost: full login against RESUME with a session token
+    Python 3
+    Usage: python3 bench_resume.py [--devices 50] [--reconnects 20] [--modes thread async]
+    coding: utf-8
+
+    Every device sends AED, drops its connection and reconnects, --reconnects times,
+    through client/batchclient.py with --reconnect. The devices' passwords are PBKDF2
+    hashes, as they would be in production. Without sessions every reconnect is a
+    full login: three frames, a password hash and a new line in edge-device-log.txt.
+    With sessions it is one RESUME frame and nothing is written.
+
+    Reported: reconnect latency percentiles, the server's CPU seconds and how many
+    bytes the device journal grew by.
+"""
+import argparse, asyncio, os, sys
+from benchutil import SERVER_DIR, CLIENT_DIR, ServerProcess, cpu_seconds
+
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, CLIENT_DIR)
+import credentials
+import batchclient
+
+ITERATIONS = 100000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--reconnects", type=int, default=20)
+    parser.add_argument("--modes", nargs="+", default=["thread", "async"])
+    args = parser.parse_args()
+
+    accounts = [(f"device{i}", f"secret{i}") for i in range(args.devices)]
+    lines = [f"{name} {credentials.hash_password(password, iterations=ITERATIONS)}" for name, password in accounts]
+    print(f"{'mode':<8}{'sessions':>9}{'reconnects':>11}{'p50 ms':>9}{'p99 ms':>9}{'cpu s':>8}{'journal B':>11}")
+    for mode in args.modes:
+        for sessions in [False, True]:
+            with ServerProcess("--mode", mode, "--log-level", "WARNING", credentials=lines) as server:
+                journal = server.path("edge-device-log.txt")
+                cpu = cpu_seconds(server.process.pid)
+                report = asyncio.run(batchclient.run_fleet("127.0.0.1", server.port, ["AED"], accounts,
+                                                           args.devices, repeat=args.reconnects + 1,
+                                                           sessions=sessions, reconnect=True))
+                cpu = cpu_seconds(server.process.pid) - cpu
+                size = os.path.getsize(journal)
+            # the first login of every device is a full login either way
+            name = "RESUME" if sessions else "LOGIN"
+            h = report.latency[name]
+            print(f"{mode:<8}{str(sessions):>9}{h.count:>11}{h.percentile(50) * 1000:>9.2f}"
+                  f"{h.percentile(99) * 1000:>9.2f}{cpu:>8.2f}{size:>11}")
+
+
+if __name__ == "__main__":
+    main()
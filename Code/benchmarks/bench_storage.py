@@ -0,0 +1,89 @@
+"""
+    Flat directory vs sharded storage with an index
+    Python 3
+    Usage: python3 bench_storage.py [--files 200000] [--devices 1000] [--lookups 100000]
+    coding: utf-8
+
+    Creates the same set of small data files twice: flat in one directory, as the
+    server used to keep them, and through server/storage.py. It then times what SCS,
+    DTE and a listing need: existence checks (os.path.exists against an index lookup),
+    listing one device's files (scanning the directory against the index) and
+    rebuilding the index at start up (walking the tree against loading SQLite).
+"""
+import argparse, os, random, shutil, sys, tempfile, time
+from benchutil import SERVER_DIR
+
+sys.path.insert(0, SERVER_DIR)
+import storage
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=200000)
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--lookups", type=int, default=100000)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="bench-storage-")
+    flat = os.path.join(scratch, "flat")
+    os.makedirs(flat)
+    store = storage.Storage(os.path.join(scratch, "data"), os.path.join(scratch, "index.db"))
+    store.open()
+    owners = [f"device{i}" for i in range(args.devices)]
+    try:
+        for n in range(args.files):
+            owner, fileId = owners[n % args.devices], str(n // args.devices)
+            with open(os.path.join(flat, f"{owner}-{fileId}.txt"), "w") as f:
+                f.write("1\n")
+            path = store.upload_path(owner, fileId, ".txt")
+            with open(path, "w") as f:
+                f.write("1\n")
+            store.add(owner, fileId, path, 2, 1)
+        print(f"{args.files} files from {args.devices} devices")
+
+        probes = [(random.choice(owners), str(random.randrange(2 * args.files // args.devices)))
+                  for _ in range(args.lookups)]
+        print(f"{'run':<34}{'seconds':>9}{'per op us':>11}")
+
+        def flat_exists():
+            return sum(os.path.exists(os.path.join(flat, f"{owner}-{fileId}.txt")) for owner, fileId in probes)
+
+        def index_exists():
+            return sum(store.lookup(owner, fileId) is not None for owner, fileId in probes)
+
+        def flat_list():
+            return sum(len([name for name in os.listdir(flat) if name.startswith(owner + "-")])
+                       for owner in owners[:20])
+
+        def index_list():
+            return sum(len(store.list(owner)) for owner in owners[:20])
+
+        def rebuild(index_name):
+            fresh = storage.Storage(store.root, index_name)
+            fresh.open()
+            fresh.close()
+            return len(fresh)
+
+        for name, func, ops in [("exists, flat os.path.exists", flat_exists, args.lookups),
+                                ("exists, index lookup", index_exists, args.lookups),
+                                ("list 20 devices, flat listdir", flat_list, 20),
+                                ("list 20 devices, index", index_list, 20)]:
+            elapsed, _ = timed(func)
+            print(f"{name:<34}{elapsed:>9.3f}{elapsed / ops * 1e6:>11.1f}")
+        store.close()
+        for name, index_name in [("start up, walk the tree", None), ("start up, load SQLite", store.index_name)]:
+            elapsed, count = timed(rebuild, index_name)
+            print(f"{name:<34}{elapsed:>9.3f}{'':>11}  {count} files")
+    finally:
+        store.close()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+    UED upload throughput benchmark
+    Python 3
+    Usage: python3 bench_upload.py [--sizes-mb 1 10 100 1000] [--modes thread async]
+    coding: utf-8
+
+    Generates data files of the requested sizes, uploads each one with the same
+    "UED fileID size" + sendfile exchange the client uses and reports MB/s. The server
+    writes the upload to disk as it arrives, so its memory should stay flat no matter
+    how large the file is.
+"""
+import argparse, os, tempfile, time
+from benchutil import ServerProcess, login, upload
+
+MB = 1024 * 1024
+
+
+# sequential samples until the file reaches size bytes
+def make_file(path, size):
+    block = "".join(f"{i}\n" for i in range(100000)).encode()
+    with open(path, "wb") as f:
+        written = 0
+        while written < size:
+            chunk = block[:size - written]
+            f.write(chunk)
+            written += len(chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes-mb", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--modes", nargs="+", default=["thread", "async"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="bench-upload-")
+    files = {}
+    for size_mb in args.sizes_mb:
+        files[size_mb] = os.path.join(scratch, f"{size_mb}mb.txt")
+        make_file(files[size_mb], size_mb * MB)
+
+    print(f"{'mode':<8}{'size MB':>8}{'best s':>9}{'MB/s':>9}{'server rss MB':>15}")
+    try:
+        for mode in args.modes:
+            with ServerProcess("--mode", mode) as server:
+                sock = login(server.port, "a", "b")
+                for size_mb, path in files.items():
+                    best = None
+                    for attempt in range(args.repeat):
+                        start = time.perf_counter()
+                        reply = upload(sock, size_mb, path)
+                        elapsed = time.perf_counter() - start
+                        best = elapsed if best is None else min(best, elapsed)
+                    rss = (server.rss_kb() or 0) / 1024
+                    print(f"{mode:<8}{size_mb:>8}{best:>9.3f}{size_mb / best:>9.1f}{rss:>15.1f}")
+                sock.close()
+    finally:
+        for path in files.values():
+            os.remove(path)
+        os.rmdir(scratch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+    UVF loopback benchmark
+    Python 3
+    Usage: python3 bench_uvf.py [--size-mb 10] [--loss 0 0.01 0.05 0.1 0.2] [--window 64]
+    coding: utf-8
+
+    Sends a file between two UDP endpoints on 127.0.0.1 with the UVF protocol from
+    client/udptransfer.py. Datagrams are dropped at random in both directions to
+    simulate a lossy link. Reports throughput, retransmissions and whether the
+    received file matches the original.
+"""
+import argparse, hashlib, os, sys, tempfile, threading
+from socket import *
+from benchutil import CLIENT_DIR
+
+sys.path.insert(0, CLIENT_DIR)
+import udptransfer
+
+
+def digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def run(path, loss, window, chunk, directory):
+    sock = socket(AF_INET, SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    done = threading.Event()
+    received = {}
+
+    def on_complete(sender, name, saved):
+        received["path"] = saved
+        done.set()
+
+    udptransfer.Receiver(sock, directory, on_complete, loss_rate=loss).start()
+    try:
+        stats = udptransfer.send_file(sock.getsockname(), path, "bench", window=window, chunk=chunk,
+                                      loss_rate=loss, timeout=30)
+        done.wait(10)
+    finally:
+        sock.close()
+    ok = "path" in received and digest(received["path"]) == digest(path)
+    if "path" in received:
+        os.remove(received["path"])
+    return stats, ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=float, default=10)
+    parser.add_argument("--loss", type=float, nargs="+", default=[0, 0.01, 0.05, 0.1, 0.2])
+    parser.add_argument("--window", type=int, default=udptransfer.WINDOW)
+    parser.add_argument("--chunk", type=int, default=udptransfer.CHUNK_SIZE)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench-uvf-")
+    path = os.path.join(directory, "source.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(int(args.size_mb * 1024 * 1024)))
+
+    print(f"{args.size_mb} MB, window {args.window}, chunk {args.chunk} bytes")
+    print(f"{'loss':>6}{'seconds':>9}{'MB/s':>8}{'packets':>9}{'retrans':>9}{'intact':>8}")
+    try:
+        for loss in args.loss:
+            stats, ok = run(path, loss, args.window, args.chunk, directory)
+            print(f"{loss:>6.2f}{stats.seconds:>9.2f}{args.size_mb / stats.seconds:>8.1f}"
+                  f"{stats.packets:>9}{stats.retransmits:>9}{'yes' if ok else 'NO':>8}")
+    finally:
+        os.remove(path)
+        os.rmdir(directory)
+
+
+if __name__ == "__main__":
+    main()
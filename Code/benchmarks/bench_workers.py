@@ -0,0 +1,92 @@
+"""
+    Commands per second against the number of server worker processes
+    Python 3
+    Usage: python3 bench_workers.py [--workers 1 2 4] [--clients 4] [--connections 16] [--seconds 10]
+    coding: utf-8
+
+    For every worker count a fresh server is started with --workers N and the summary
+    cache turned off, so every SCS parses the uploaded file and the load is CPU bound.
+    Several client processes, each with its own event loop, keep their connections
+    busy with a mix of SCS (parsing), AED (the shared device table) and fresh logins
+    (the shared lockout table) for a fixed time.
+
+    One worker is limited to one core by the GIL however many connections it has, so
+    commands per second should grow with the worker count up to the number of cores
+    and flatten after that. The default worker counts go up to os.cpu_count().
+"""
+import argparse, asyncio, multiprocessing, os, time
+from benchutil import ServerProcess, async_login, encode_frame, read_frame, login, upload, write_samples
+
+# commands sent round robin on every connection, "login" opens and logs in a new connection
+MIX = ["SCS 1 SUM", "SCS 1 AVERAGE", "SCS 1 MAX", "AED", "login"]
+
+
+async def connection_loop(port, deadline, udp_port):
+    count = 0
+    reader, writer = await async_login(port, "a", "b", udp_port)
+    try:
+        while time.monotonic() < deadline:
+            for command in MIX:
+                if command == "login":
+                    other = await async_login(port, "a", "b", udp_port)
+                    other[1].close()
+                else:
+                    writer.write(encode_frame(command))
+                    await read_frame(reader)
+                count += 1
+    finally:
+        writer.close()
+    return count
+
+
+def client(port, connections, seconds, udp_base):
+    async def run():
+        deadline = time.monotonic() + seconds
+        counts = await asyncio.gather(*(connection_loop(port, deadline, udp_base + i) for i in range(connections)))
+        return sum(counts)
+    return asyncio.run(run())
+
+
+def default_workers():
+    counts, n = [], 1
+    while n < (os.cpu_count() or 1):
+        counts.append(n)
+        n *= 2
+    return counts + [os.cpu_count() or 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=default_workers())
+    parser.add_argument("--mode", choices=["thread", "async"], default="async")
+    parser.add_argument("--clients", type=int, default=4, help="load generating processes")
+    parser.add_argument("--connections", type=int, default=16, help="connections per client process")
+    parser.add_argument("--samples", type=int, default=20000, help="samples in the file SCS parses")
+    parser.add_argument("--seconds", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, {args.clients} clients x {args.connections} connections, {args.mode} mode")
+    print(f"{'workers':>8}{'commands':>10}{'cmd/s':>10}{'speedup':>9}")
+    base = None
+    context = multiprocessing.get_context("fork")
+    for workers in args.workers:
+        with ServerProcess("--mode", args.mode, "--workers", workers, "--stats-cache-size", 0,
+                           "--log-level", "WARNING", "--log-max-bytes", 0) as server:
+            path = server.path("bench-1.txt")
+            write_samples(path, args.samples)
+            sock = login(server.port, "a", "b")
+            reply = upload(sock, 1, path, "txt")
+            sock.close()
+            if "successfully" not in reply:
+                raise RuntimeError(reply)
+            with context.Pool(args.clients) as pool:
+                jobs = [pool.apply_async(client, (server.port, args.connections, args.seconds, 20000 + 1000 * i))
+                        for i in range(args.clients)]
+                total = sum(job.get() for job in jobs)
+        rate = total / args.seconds
+        base = base or rate
+        print(f"{workers:>8}{total:>10}{rate:>10.0f}{rate / base:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
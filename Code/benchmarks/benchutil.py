@@ -0,0 +1,238 @@
+"""
+    Helpers shared by the benchmark scripts
+    Python 3
+    coding: utf-8
+
+    Each benchmark starts its own server.py in a scratch directory holding a copy of
+    credentials.txt and empty log files, so the logs next to the real server are
+    never touched.
+"""
+import os, sys, json, time, struct, asyncio, shutil, tempfile, subprocess, resource
+from socket import *
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(CODE_DIR, "server")
+CLIENT_DIR = os.path.join(CODE_DIR, "client")
+LOG_FILES = ["edge-device-log.txt", "upload-log.txt", "deletion-log.txt"]
+# same framing as server.py: 4-byte big-endian length then the utf-8 payload
+FRAME_HEADER = struct.Struct("!I")
+
+
+def encode_frame(message):
+    payload = message.encode()
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+async def read_frame(reader):
+    header = await reader.readexactly(FRAME_HEADER.size)
+    (length,) = FRAME_HEADER.unpack(header)
+    return (await reader.readexactly(length)).decode()
+
+
+def send_frame(sock, message):
+    sock.sendall(encode_frame(message))
+
+
+def recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("server closed the connection")
+        data.extend(chunk)
+    return bytes(data)
+
+
+def recv_frame(sock):
+    (length,) = FRAME_HEADER.unpack(recv_exact(sock, FRAME_HEADER.size))
+    return recv_exact(sock, length).decode()
+
+
+# blocking version of async_login, returns the connected socket
+def login(port, username, password, udp_port=9000):
+    sock = create_connection(("127.0.0.1", port))
+    send_frame(sock, "login")
+    recv_frame(sock)
+    send_frame(sock, f"{username} {password}")
+    reply = recv_frame(sock)
+    if reply != "Welcome":
+        sock.close()
+        raise RuntimeError(f"login as {username} failed: {reply}")
+    send_frame(sock, f"{username} 127.0.0.1 {udp_port}")
+    return sock
+
+
+# UED fileId with the content of path, fmt is "txt", "bin" or None for the server's default, returns the reply
+def upload(sock, fileId, path, fmt=None):
+    size = os.path.getsize(path)
+    send_frame(sock, f"UED {fileId} {size}" if fmt is None else f"UED {fileId} {size} {fmt}")
+    with open(path, "rb") as f:
+        sock.sendfile(f, 0, size)
+    return recv_frame(sock)
+
+
+# log in, read the server's STATS json and log out again
+def server_stats(port, username, password):
+    sock = login(port, username, password)
+    try:
+        send_frame(sock, "STATS json")
+        stats = json.loads(recv_frame(sock))
+        send_frame(sock, "OUT")
+        recv_frame(sock)
+    finally:
+        sock.close()
+    return stats
+
+
+# write count sequential samples, one per line, the same content EDG produces
+def write_samples(path, count):
+    with open(path, "w") as f:
+        for start in range(0, count, 100000):
+            f.write("\n".join(map(str, range(start, min(count, start + 100000)))))
+            f.write("\n")
+
+
+# run func(*args) in a forked child, returns (result, seconds, peak rss in MB of the child)
+def measure_in_child(func, *args):
+    import multiprocessing
+    context = multiprocessing.get_context("fork")
+    parent, child = context.Pipe()
+
+    def target():
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        child.send((result, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+    process = context.Process(target=target)
+    process.start()
+    outcome = parent.recv()
+    process.join()
+    return outcome
+
+
+# open a connection and log in as username, returns the asyncio streams
+async def async_login(port, username, password, udp_port=9000):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(encode_frame("login"))
+    await read_frame(reader)
+    writer.write(encode_frame(f"{username} {password}"))
+    reply = await read_frame(reader)
+    if reply != "Welcome":
+        writer.close()
+        raise RuntimeError(f"login as {username} failed: {reply}")
+    writer.write(encode_frame(f"{username} 127.0.0.1 {udp_port}"))
+    await writer.drain()
+    return reader, writer
+
+
+def free_port():
+    s = socket(AF_INET, SOCK_STREAM)
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+# allow as many sockets as the hard limit permits
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+# read a field such as VmRSS or Threads from /proc/<pid>/status
+def proc_status(pid, field):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+# user plus system CPU seconds pid has used so far
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime and stime are fields 14 and 15 of the whole line
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class ServerProcess:
+    """Run server.py on 127.0.0.1 in a scratch directory for the duration of a with block."""
+
+    def __init__(self, *extra_args, attempts=3, port=None, credentials=None, stderr_name=None):
+        self.extra_args = [str(a) for a in extra_args]
+        self.attempts = attempts
+        # lines for credentials.txt, by default the server's own file is copied
+        self.credentials = credentials
+        # file in the scratch directory the server's log output goes to, by default it is discarded
+        self.stderr_name = stderr_name
+        self.port = port or free_port()
+        self.workdir = None
+        self.process = None
+
+    def __enter__(self):
+        self.workdir = tempfile.mkdtemp(prefix="bench-server-")
+        if self.credentials is None:
+            shutil.copy(os.path.join(SERVER_DIR, "credentials.txt"), self.workdir)
+        else:
+            with open(os.path.join(self.workdir, "credentials.txt"), "w") as f:
+                f.write("\n".join(self.credentials) + "\n")
+        for name in LOG_FILES:
+            open(os.path.join(self.workdir, name), "w").close()
+        command = [sys.executable, os.path.join(SERVER_DIR, "server.py"),
+                   str(self.port), str(self.attempts), "--host", "127.0.0.1"] + self.extra_args
+        stderr = open(self.path(self.stderr_name), "w") if self.stderr_name else subprocess.DEVNULL
+        self.process = subprocess.Popen(command, cwd=self.workdir, stdout=subprocess.DEVNULL, stderr=stderr)
+        if self.stderr_name:
+            stderr.close()
+        self.wait_ready()
+        return self
+
+    def wait_ready(self, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("server exited during start up")
+            try:
+                create_connection(("127.0.0.1", self.port), timeout=0.5).close()
+                return
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError("server did not start listening")
+
+    def path(self, name):
+        return os.path.join(self.workdir, name)
+
+    def rss_kb(self):
+        return proc_status(self.process.pid, "VmRSS")
+
+    def threads(self):
+        return proc_status(self.process.pid, "Threads")
+
+    # SIGTERM, so queued log lines are written, then the exit status
+    def stop(self, timeout=5):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        return self.process.returncode
+
+    def __exit__(self, *exc):
+        self.stop()
+        shutil.rmtree(self.workdir, ignore_errors=True)
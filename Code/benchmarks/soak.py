@@ -0,0 +1,515 @@
+"""
+    Soak test: a fleet of simulated edge devices against one server for a long run
+    Python 3
+    Usage: python3 soak.py [--duration 600] [--devices 50] [--clients 2] [--mode thread] [--workers 1]
+                           [--mix EDG=2 UED=2 SCS=4 DTE=1 AED=2 LST=1 OUT=0.2 RECONNECT=0.3]
+                           [--sessions] [--compress zlib] [--server-arg=--heavy-processes=2]
+                           [--output soak.json] [--baseline earlier.json] [--tolerance 0.2]
+    coding: utf-8
+
+    server.py is started on 127.0.0.1 in a scratch directory with an account per
+    device, then --clients processes run --devices devices between them through
+    client/batchclient.py for --duration seconds. Every device picks its next command
+    at random with the --mix weights and keeps track of the files it has generated
+    and uploaded, so SCS and DTE name files that exist and UED is preceded by EDG the
+    first time. OUT logs out and logs in again, RECONNECT drops the connection without
+    OUT, which is a RESUME with --sessions. --think is the mean pause between commands.
+
+    While the fleet runs the server's process tree (workers, heavy pool, ...) is
+    sampled every --interval seconds for RSS, open file descriptors, threads and CPU
+    seconds. The clients keep a latency histogram per interval as well, so throughput
+    and p99 can be followed over the run instead of only at the end.
+
+    When the fleet is done the server is stopped with SIGTERM, so queued log lines are
+    written, and checked against what the devices were told:
+        upload-log.txt and deletion-log.txt hold exactly one well-formed line per
+            successful UED and DTE, with the number of samples of the file
+        replaying edge-device-log.txt leaves exactly the devices that did not log out
+        the data directory holds the files that were uploaded and not deleted
+        the server logged no errors or tracebacks, and once the clients disconnected
+            it held no more sockets than before the run (log files, the shared state
+            and the heavy pool are opened on first use, so plain descriptor counts
+            are only reported)
+
+    Results go to --output as JSON. With --baseline, a results file from an earlier
+    run, throughput, p99 latencies and peak memory are compared with it and anything
+    more than --tolerance worse is listed as a regression. The exit status is 1 if a
+    check failed or something regressed.
+"""
+import argparse, asyncio, json, multiprocessing, os, platform, random, re, shutil, sys, tempfile, time
+from collections import Counter
+from benchutil import CLIENT_DIR, ServerProcess, server_stats, raise_fd_limit
+
+sys.path.insert(0, CLIENT_DIR)
+import batchclient
+
+DEFAULT_MIX = ["EDG=2", "UED=2", "SCS=4", "DTE=1", "AED=2", "LST=1", "OUT=0.2", "RECONNECT=0.3"]
+MIX_COMMANDS = ["EDG", "UED", "SCS", "DTE", "AED", "LST", "OUT", "RECONNECT"]
+OPERATIONS = ["SUM", "AVERAGE", "MIN", "MAX", "COUNT", "STDDEV", "P50", "P95"]
+FORMAT_SUFFIXES = {"text": ".txt", "binary": ".bin"}
+# upload-log.txt and deletion-log.txt: user; timestamp; fileId; dataAmount
+LOG_LINE = re.compile(r"^(\S+); (\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?:\.\d+)?); (\d+); (\d+)$")
+# edge-device-log.txt: "seq; timestamp name ip port" and "OUT; timestamp name"
+JOIN_LINE = re.compile(r"^(\d+); (\S+ \S+) (\S+) (\S+) (\d+)$")
+OUT_LINE = re.compile(r"^OUT; (\S+ \S+) (\S+)$")
+DATA_FILE = re.compile(r"^(.+)-(\d+)(\.txt|\.bin)$")
+# logs in after the fleet to read STATS, and logs out again
+MONITOR = ("soakmonitor", "monitorpw")
+
+
+class SoakReport(batchclient.Report):
+    """A batchclient Report that also keeps a latency histogram per --interval of the run."""
+
+    def __init__(self, start, interval):
+        batchclient.Report.__init__(self)
+        self.start = start
+        self.interval = interval
+        # interval index -> [Histogram, errors]
+        self.buckets = {}
+
+    def record(self, command, seconds, ok):
+        batchclient.Report.record(self, command, seconds, ok)
+        index = int((time.monotonic() - self.start) / self.interval)
+        bucket = self.buckets.setdefault(index, [batchclient.Histogram(), 0])
+        bucket[0].record(seconds)
+        if not ok:
+            bucket[1] += 1
+
+    def merge(self, other):
+        batchclient.Report.merge(self, other)
+        for index, (histogram, errors) in other.buckets.items():
+            bucket = self.buckets.setdefault(index, [batchclient.Histogram(), 0])
+            bucket[0].merge(histogram)
+            bucket[1] += errors
+
+    def timeline(self):
+        rows = []
+        for index in sorted(self.buckets):
+            histogram, errors = self.buckets[index]
+            rows.append({"t": index * self.interval, "commands": histogram.count,
+                         "per_second": histogram.count / self.interval, "errors": errors,
+                         "p50_ms": histogram.percentile(50) * 1000, "p99_ms": histogram.percentile(99) * 1000,
+                         "max_ms": histogram.maximum * 1000})
+        return rows
+
+
+def parse_mix(items):
+    mix = {}
+    for item in items:
+        command, _, weight = item.partition("=")
+        if command not in MIX_COMMANDS or not weight:
+            raise ValueError(f"{item}: expected one of {', '.join(MIX_COMMANDS)} as COMMAND=WEIGHT")
+        mix[command] = float(weight)
+    return mix
+
+
+def account(index):
+    return f"soak{index}", f"pw{index}"
+
+
+# the file ids of a device's successful UEDs and DTEs, replayed in reply order
+def expected_files(events):
+    files = {}
+    for command, fileId, samples, fmt in events:
+        if command == "UED":
+            files[fileId] = (samples, fmt)
+        else:
+            files.pop(fileId, None)
+    return files
+
+
+class SoakDevice:
+    """One device of the fleet: a DeviceClient and what it believes is on its side and on the server."""
+
+    def __init__(self, index, args, report, directory):
+        self.name, password = account(index)
+        self.args = args
+        self.rng = random.Random(args.seed * 1000003 + index)
+        self.client = batchclient.DeviceClient("127.0.0.1", args.port, self.name, password, 10000 + index,
+                                               directory, args.window, report, args.sessions, args.compress)
+        # fileId -> (samples, format) of the files generated here and of the copies on the server
+        self.generated = {}
+        self.uploaded = {}
+        # (command, fileId, samples, format) of every successful UED and DTE, in reply order
+        self.events = []
+        # whether the journal should list the device as active
+        self.active = False
+        self.in_flight = []
+
+    async def connect(self):
+        try:
+            connected = await self.client.connect()
+        except (OSError, asyncio.IncompleteReadError):
+            connected = False
+        if connected:
+            self.active = True
+        else:
+            self.client.report.failed_logins += 1
+        return connected
+
+    # wait for every reply still outstanding
+    async def settle(self):
+        await asyncio.gather(*self.in_flight, return_exceptions=True)
+        self.in_flight = []
+
+    # keep track of a submitted command, event goes into events if its reply is a success
+    def send(self, future, event=None):
+        def done(f):
+            if event is not None and f.exception() is None and batchclient.reply_ok(event[0], f.result()):
+                self.events.append(event)
+        future.add_done_callback(done)
+        self.in_flight = [f for f in self.in_flight if not f.done()]
+        self.in_flight.append(future)
+
+    async def generate(self, fileId):
+        samples = self.rng.randint(self.args.samples[0], self.args.samples[1])
+        fmt = "binary" if self.rng.random() < self.args.binary_share else "text"
+        await self.client.submit(f"EDG {fileId} {samples} {fmt}")
+        self.generated[fileId] = (samples, fmt)
+
+    async def upload(self, fileId):
+        if fileId not in self.generated:
+            await self.generate(fileId)
+        samples, fmt = self.generated[fileId]
+        self.uploaded[fileId] = (samples, fmt)
+        self.send(await self.client.submit(f"UED {fileId}"), ("UED", fileId, samples, fmt))
+
+    async def step(self, command):
+        rng = self.rng
+        fileId = str(rng.randint(1, self.args.files_per_device))
+        if command == "EDG":
+            await self.generate(fileId)
+        elif command == "UED" or (command in ("SCS", "DTE") and not self.uploaded):
+            await self.upload(fileId)
+        elif command == "SCS":
+            fileId = rng.choice(sorted(self.uploaded))
+            self.send(await self.client.submit(f"SCS {fileId} {rng.choice(OPERATIONS)}"))
+        elif command == "DTE":
+            fileId = rng.choice(sorted(self.uploaded))
+            samples, fmt = self.uploaded.pop(fileId)
+            self.send(await self.client.submit(f"DTE {fileId}"), ("DTE", fileId, samples, fmt))
+        elif command in ("AED", "LST"):
+            self.send(await self.client.submit(command))
+        else:
+            await self.settle()
+            if command == "OUT":
+                reply = await (await self.client.submit("OUT"))
+                if batchclient.reply_ok("OUT", reply):
+                    self.active = False
+                # the token went with the OUT, the next connect() is a full login
+                self.client.token = None
+            await self.client.close()
+            return await self.connect()
+        return True
+
+    async def run(self, deadline, delay):
+        commands = [command for command in MIX_COMMANDS if self.args.mix.get(command, 0) > 0]
+        weights = [self.args.mix[command] for command in commands]
+        await asyncio.sleep(delay)
+        if not await self.connect():
+            return
+        try:
+            while time.monotonic() < deadline:
+                try:
+                    if not await self.step(self.rng.choices(commands, weights)[0]):
+                        break
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    # the replies that never came are already counted as errors
+                    await self.settle()
+                    await self.client.close()
+                    if not await self.connect():
+                        break
+                if self.args.think > 0:
+                    await asyncio.sleep(self.rng.expovariate(1 / self.args.think))
+            await self.settle()
+        finally:
+            await self.client.close()
+
+
+async def run_shard(indexes, args, start, deadline):
+    report = SoakReport(start, args.interval)
+    directory = tempfile.mkdtemp(prefix="soak-client-")
+    try:
+        fleet = [SoakDevice(index, args, report, os.path.join(directory, str(index))) for index in indexes]
+        for device in fleet:
+            os.makedirs(device.client.directory)
+        await asyncio.gather(*(device.run(deadline, args.ramp * index / max(1, args.devices))
+                               for index, device in zip(indexes, fleet)))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    report.finished = time.perf_counter()
+    return report, {device.name: device.events for device in fleet}, {device.name: device.active for device in fleet}
+
+
+def run_clients(job):
+    indexes, args, start, deadline = job
+    raise_fd_limit()
+    return asyncio.run(run_shard(indexes, args, start, deadline))
+
+
+# the server process and everything it started: workers, heavy pool, credential pool
+def process_tree(root):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, []))
+    return tree
+
+
+def sample_resources(root, start):
+    sample = {"t": round(time.monotonic() - start, 3), "processes": 0, "rss_kb": 0, "fds": 0, "sockets": 0,
+              "threads": 0, "cpu_s": 0.0}
+    ticks = os.sysconf("SC_CLK_TCK")
+    # by inode, a socket inherited by the heavy pool's processes is still one socket
+    sockets = set()
+    for pid in process_tree(root):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            fds = os.listdir(f"/proc/{pid}/fd")
+            links = [os.readlink(f"/proc/{pid}/fd/{fd}") for fd in fds]
+        except OSError:
+            # it exited between listing and reading
+            continue
+        sample["processes"] += 1
+        sample["threads"] += int(fields[17])
+        sample["rss_kb"] += int(fields[21]) * os.sysconf("SC_PAGE_SIZE") // 1024
+        sample["cpu_s"] += (int(fields[11]) + int(fields[12])) / ticks
+        sample["fds"] += len(fds)
+        sockets.update(link for link in links if link.startswith("socket:"))
+    sample["cpu_s"] = round(sample["cpu_s"], 2)
+    sample["sockets"] = len(sockets)
+    return sample
+
+
+def monitor_stats(port):
+    try:
+        return server_stats(port, *MONITOR)
+    except (OSError, RuntimeError, ValueError) as e:
+        return {"error": str(e)}
+
+
+def read_lines(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return [line.rstrip("\n") for line in f]
+
+
+def check(checks, name, ok, detail=""):
+    checks[name] = {"ok": bool(ok), "detail": detail}
+
+
+# how two multisets of log entries differ, for a failed check
+def difference(expected, found, limit=5):
+    missing = list((expected - found).elements())
+    extra = list((found - expected).elements())
+    return f"{len(missing)} missing {missing[:limit]}, {len(extra)} unexpected {extra[:limit]}"
+
+
+def check_amount_log(checks, name, path, expected):
+    found, malformed = Counter(), []
+    for line in read_lines(path):
+        match = LOG_LINE.match(line)
+        if match is None:
+            malformed.append(line)
+        else:
+            found[(match.group(1), match.group(3), int(match.group(4)))] += 1
+    check(checks, f"{name} format", not malformed, f"{len(malformed)} malformed lines {malformed[:5]}")
+    check(checks, f"{name} matches replies", found == expected, difference(expected, found))
+
+
+def check_journal(checks, path, expected_active):
+    active, malformed, unknown_out = set(), [], []
+    for line in read_lines(path):
+        join, out = JOIN_LINE.match(line), OUT_LINE.match(line)
+        if join is not None:
+            active.add(join.group(3))
+        elif out is not None:
+            # an OUT for a device that is not active means lines were written out of order
+            if out.group(2) not in active:
+                unknown_out.append(line)
+            active.discard(out.group(2))
+        else:
+            malformed.append(line)
+    check(checks, "edge-device-log.txt format", not malformed, f"{len(malformed)} malformed lines {malformed[:5]}")
+    check(checks, "edge-device-log.txt order", not unknown_out,
+          f"{len(unknown_out)} OUT lines for inactive devices {unknown_out[:5]}")
+    missing, extra = sorted(expected_active - active), sorted(active - expected_active)
+    check(checks, "edge-device-log.txt replays to the active devices", not missing and not extra,
+          f"{len(missing)} missing {missing[:5]}, {len(extra)} unexpected {extra[:5]}")
+
+
+def check_data(checks, root, expected):
+    found, stray = set(), []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            match = DATA_FILE.match(name)
+            if match is not None:
+                found.add((match.group(1), match.group(2), match.group(3)))
+            elif name.endswith(".part"):
+                stray.append(os.path.join(directory, name))
+    missing, extra = sorted(expected - found), sorted(found - expected)
+    check(checks, "data files match replies", not missing and not extra and not stray,
+          f"{len(missing)} missing {missing[:5]}, {len(extra)} unexpected {extra[:5]}, {len(stray)} partial {stray[:5]}")
+
+
+def check_server_log(checks, path):
+    lines = read_lines(path)
+    errors = [line for line in lines if " ERROR " in line or " CRITICAL " in line or line.startswith("Traceback")]
+    check(checks, "server log has no errors", not errors, f"{len(errors)} lines {errors[:5]}")
+
+
+# regressions of results against an earlier run's results
+def compare(results, baseline, tolerance):
+    pairs = [("throughput per second", results["summary"]["per_second"], baseline["summary"]["per_second"], False),
+             ("peak server rss kB", results["resources"]["peak_rss_kb"], baseline["resources"]["peak_rss_kb"], True)]
+    for command, row in results["summary"]["by_command"].items():
+        old = baseline["summary"]["by_command"].get(command)
+        if old is not None:
+            pairs.append((f"{command} p99 ms", row["p99_ms"], old["p99_ms"], True))
+    compared, regressions = {}, []
+    for name, new, old, higher_is_worse in pairs:
+        change = (new - old) / old if old else 0.0
+        compared[name] = {"baseline": old, "now": new, "change": round(change, 4)}
+        if (change if higher_is_worse else -change) > tolerance:
+            regressions.append(name)
+    return {"compared": compared, "regressions": regressions}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="soak test server.py with a fleet of simulated devices")
+    parser.add_argument("--duration", type=float, default=600, help="seconds the fleet runs for")
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--clients", type=int, default=2, help="client processes the devices are spread over")
+    parser.add_argument("--mode", choices=["thread", "async"], default="thread")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--mix", nargs="+", default=DEFAULT_MIX, help="COMMAND=WEIGHT for " + ", ".join(MIX_COMMANDS))
+    parser.add_argument("--think", type=float, default=0.05, help="mean seconds a device waits between commands")
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds over which the devices log in")
+    parser.add_argument("--window", type=int, default=8, help="commands a device may have in flight")
+    parser.add_argument("--samples", type=int, nargs=2, default=[100, 20000], metavar=("MIN", "MAX"),
+                        help="samples per generated file")
+    parser.add_argument("--binary-share", type=float, default=0.3, help="share of files generated as binary")
+    parser.add_argument("--files-per-device", type=int, default=5, help="file ids a device cycles through")
+    parser.add_argument("--sessions", action="store_true", help="log in with session tokens, RECONNECT resumes")
+    parser.add_argument("--compress", type=lambda s: s.split(","), default=[], help="codecs offered at login")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between samples")
+    parser.add_argument("--socket-slack", type=int, default=0,
+                        help="sockets the idle server may hold above its count before the run")
+    parser.add_argument("--server-arg", action="append", default=[], help="extra server.py argument, repeatable")
+    parser.add_argument("--output", default="soak-results.json")
+    parser.add_argument("--baseline", default=None, help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed fraction worse than the baseline")
+    parser.add_argument("--keep", default=None, metavar="DIR", help="copy the server's directory, logs and data, here")
+    args = parser.parse_args()
+    try:
+        args.mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    raise_fd_limit()
+    lines = [" ".join(account(index)) for index in range(args.devices)] + [" ".join(MONITOR)]
+    # nothing is rotated away, so the logs can be checked in full
+    server_args = ["--mode", args.mode, "--workers", args.workers, "--log-level", "WARNING",
+                   "--log-max-bytes", 0] + args.server_arg
+    with ServerProcess(*server_args, credentials=lines, stderr_name="server.log") as server:
+        args.port = server.port
+        time.sleep(0.5)
+        clock = time.monotonic()
+        idle_before = sample_resources(server.process.pid, clock)
+        samples = [idle_before]
+        start = time.monotonic()
+        deadline = start + args.duration
+        shards = [(list(range(shard, args.devices, args.clients)), args, start, deadline)
+                  for shard in range(min(args.clients, args.devices))]
+        print(f"{args.devices} devices in {len(shards)} processes for {args.duration:g}s, server in {server.workdir}")
+        print(f"{'t s':>7}{'rss MB':>9}{'fds':>7}{'sockets':>9}{'threads':>9}{'cpu s':>8}")
+        with multiprocessing.get_context("fork").Pool(len(shards)) as pool:
+            pending = pool.map_async(run_clients, shards)
+            while not pending.ready():
+                pending.wait(args.interval)
+                sample = sample_resources(server.process.pid, clock)
+                samples.append(sample)
+                print(f"{sample['t']:>7.1f}{sample['rss_kb'] / 1024:>9.1f}{sample['fds']:>7}{sample['sockets']:>9}{sample['threads']:>9}"
+                      f"{sample['cpu_s']:>8.1f}")
+            shard_results = pending.get()
+        finished = time.perf_counter()
+
+        report = SoakReport(start, args.interval)
+        events, active = {}, {}
+        for shard_report, shard_events, shard_active in shard_results:
+            report.merge(shard_report)
+            events.update(shard_events)
+            active.update(shard_active)
+        report.started, report.finished = finished - (time.monotonic() - start), finished
+
+        # give the server a moment to notice the closed connections
+        for _ in range(50):
+            time.sleep(0.1)
+            idle_after = sample_resources(server.process.pid, clock)
+            if idle_after["sockets"] <= idle_before["sockets"] + args.socket_slack:
+                break
+        stats = monitor_stats(server.port)
+        status = server.stop()
+
+        checks = {}
+        check(checks, "server exited cleanly", status in (0, -15), f"exit status {status}")
+        check(checks, "no failed logins", report.failed_logins == 0, f"{report.failed_logins} failed logins")
+        uploads, deletions, files = Counter(), Counter(), set()
+        for name, device_events in events.items():
+            for command, fileId, samples_, fmt in device_events:
+                (uploads if command == "UED" else deletions)[(name, fileId, samples_)] += 1
+            for fileId, (samples_, fmt) in expected_files(device_events).items():
+                files.add((name, fileId, FORMAT_SUFFIXES[fmt]))
+        check_amount_log(checks, "upload-log.txt", server.path("upload-log.txt"), uploads)
+        check_amount_log(checks, "deletion-log.txt", server.path("deletion-log.txt"), deletions)
+        check_journal(checks, server.path("edge-device-log.txt"), {name for name, on in active.items() if on})
+        check_data(checks, server.path("data"), files)
+        check_server_log(checks, server.path("server.log"))
+        check(checks, "no socket leak", idle_after["sockets"] <= idle_before["sockets"] + args.socket_slack,
+              f"{idle_before['sockets']} sockets before the run, {idle_after['sockets']} after")
+
+        config = {key: value for key, value in vars(args).items() if key != "port"}
+        config.update(python=platform.python_version(), cpus=os.cpu_count(), codecs=batchclient.available_codecs())
+        results = {"config": config, "summary": report.as_dict(), "timeline": report.timeline(),
+                   "resources": {"samples": samples, "idle_before": idle_before, "idle_after": idle_after,
+                                 "peak_rss_kb": max(s["rss_kb"] for s in samples),
+                                 "peak_fds": max(s["fds"] for s in samples),
+                                 "peak_threads": max(s["threads"] for s in samples)},
+                   "ledger": {"uploads": sum(uploads.values()), "deletions": sum(deletions.values()),
+                              "files": len(files), "active_devices": sum(active.values())},
+                   "server_stats": stats, "checks": checks}
+        if args.baseline:
+            with open(args.baseline, "r") as f:
+                results["baseline"] = dict(compare(results, json.load(f), args.tolerance), file=args.baseline)
+        if args.keep:
+            shutil.copytree(server.workdir, args.keep)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    report.print_table()
+    failed = [name for name, result in checks.items() if not result["ok"]]
+    for name in failed:
+        print(f"FAILED {name}: {checks[name]['detail']}")
+    regressions = results.get("baseline", {}).get("regressions", [])
+    for name in regressions:
+        change = results["baseline"]["compared"][name]["change"]
+        print(f"REGRESSION {name}: {change:+.1%} against {args.baseline}")
+    print(f"{len(checks) - len(failed)}/{len(checks)} checks passed, results in {args.output}")
+    sys.exit(1 if failed or regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,505 @@
+"""
+    Non-interactive, pipelined client for driving load at the server
+    Python 3
+    Usage: python3 batchclient.py SERVER_IP SERVER_PORT [--script FILE|-] [--devices 100]
+                                  [--credentials credentials.txt] [--window 32] [--repeat 1]
+                                  [--sessions] [--reconnect] [--compress zlib] [--json]
+    coding: utf-8
+
+    The script holds one command per line in the same syntax as the interactive
+    client (EDG, UED, SCS, DTE, AED, LST, OUT), blank lines and lines starting with # are
+    skipped. "-" reads the script from stdin. Every simulated device logs in on its
+    own connection, with the name and password of one line of the credentials file
+    (plain passwords only), and all devices run the script at the same time.
+
+    A device does not wait for a reply before sending its next command: up to window
+    commands are in flight, and replies are matched to commands in order since the
+    server answers every command with exactly one frame. EDG runs locally and is
+    finished before the next command is sent, so a following UED finds its file.
+
+    With --sessions a device logs in with "login session" and keeps the token it is
+    given. --reconnect closes and re-opens every device's connection between repeats,
+    as a flaky link would, and with a token the new connection is resumed with RESUME
+    in one round trip instead of logging in again. Logins and resumes are timed like
+    commands, as LOGIN and RESUME.
+
+    --compress zlib (or lzma, zstd, lz4, a comma separated list in order of
+    preference) asks the server for compression at login. If it agrees, uploads are
+    streamed as compressed frames and large replies arrive compressed.
+
+    At the end the per-command latency percentiles (p50/p95/p99), error counts and
+    throughput are printed as a table, or as JSON with --json.
+"""
+import argparse, asyncio, json, lzma, math, os, shutil, struct, sys, tempfile, time, zlib
+from collections import deque
+import datagen
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4frame
+except ImportError:
+    lz4frame = None
+
+# same framing as the server: 4-byte big-endian length then the utf-8 payload,
+# the top bit of the length marks a compressed reply
+FRAME_HEADER = struct.Struct("!I")
+COMPRESSED_FRAME = 0x80000000
+# bytes of an upload read and compressed at a time
+UPLOAD_CHUNK = 256 * 1024
+NETWORK_COMMANDS = ["UED", "SCS", "DTE", "AED", "LST", "OUT", "STATS"]
+# how a successful reply starts, per command
+SUCCESS_REPLIES = {"UED": "successfully uploaded", "SCS": "result of", "DTE": "File removed",
+                   "OUT": "removed log", "STATS": "stats cache", "EDG": ""}
+
+
+class Histogram:
+    """
+        Latencies in log-spaced buckets, SUB_BUCKETS per power of two (about 4% wide),
+        so millions of samples take a few hundred counters.
+    """
+
+    SUB_BUCKETS = 16
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def record(self, seconds):
+        micros = max(seconds * 1e6, 1.0)
+        index = int(math.log2(micros) * self.SUB_BUCKETS)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def merge(self, other):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+
+    # upper edge of the bucket holding the pct-th percentile, in seconds
+    def percentile(self, pct):
+        if self.count == 0:
+            return 0.0
+        rank = math.ceil(self.count * pct / 100) or 1
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(2 ** ((index + 1) / self.SUB_BUCKETS) / 1e6, self.maximum)
+        return self.maximum
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class Report:
+    def __init__(self):
+        self.latency = {}
+        self.errors = {}
+        self.failed_logins = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def record(self, command, seconds, ok):
+        self.latency.setdefault(command, Histogram()).record(seconds)
+        if not ok:
+            self.errors[command] = self.errors.get(command, 0) + 1
+
+    # add the numbers of a report from another device or process
+    def merge(self, other):
+        for command, histogram in other.latency.items():
+            self.latency.setdefault(command, Histogram()).merge(histogram)
+        for command, count in other.errors.items():
+            self.errors[command] = self.errors.get(command, 0) + count
+        self.failed_logins += other.failed_logins
+
+    def as_dict(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        total = sum(h.count for h in self.latency.values())
+        commands = {}
+        for command, h in sorted(self.latency.items()):
+            commands[command] = {"count": h.count, "errors": self.errors.get(command, 0),
+                                 "per_second": h.count / elapsed if elapsed else 0.0,
+                                 "mean_ms": h.mean() * 1000, "p50_ms": h.percentile(50) * 1000,
+                                 "p95_ms": h.percentile(95) * 1000, "p99_ms": h.percentile(99) * 1000,
+                                 "max_ms": h.maximum * 1000}
+        return {"seconds": elapsed, "commands": total, "per_second": total / elapsed if elapsed else 0.0,
+                "failed_logins": self.failed_logins, "by_command": commands}
+
+    def print_table(self, out=sys.stdout):
+        result = self.as_dict()
+        print(f"{'command':<8}{'count':>9}{'errors':>8}{'per s':>10}{'p50 ms':>9}{'p95 ms':>9}"
+              f"{'p99 ms':>9}{'max ms':>9}", file=out)
+        for command, row in result["by_command"].items():
+            print(f"{command:<8}{row['count']:>9}{row['errors']:>8}{row['per_second']:>10.1f}"
+                  f"{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}{row['max_ms']:>9.2f}", file=out)
+        print(f"{result['commands']} commands in {result['seconds']:.2f}s, {result['per_second']:.1f}/s, "
+              f"{result['failed_logins']} failed logins", file=out)
+
+
+# the client's half of server/wirecodec.py: installed codecs, fastest first
+def available_codecs():
+    names = []
+    if zstandard is not None:
+        names.append("zstd")
+    if lz4frame is not None:
+        names.append("lz4")
+    return names + ["zlib", "lzma"]
+
+
+class LZ4Compressor:
+    """lz4.frame's compressor with the compress()/flush() interface of the others."""
+
+    def __init__(self, level):
+        self.stream = lz4frame.LZ4FrameCompressor(compression_level=level)
+        self.header = self.stream.begin()
+
+    def compress(self, data):
+        out, self.header = self.header + self.stream.compress(data), b""
+        return out
+
+    def flush(self):
+        return self.header + self.stream.flush()
+
+
+# a streaming compressor for uploads, level None is the codec's default
+def compressor(name, level=None):
+    if name == "zlib":
+        return zlib.compressobj(6 if level is None else level)
+    elif name == "lzma":
+        return lzma.LZMACompressor(preset=6 if level is None else level)
+    elif name == "zstd":
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+    elif name == "lz4":
+        return LZ4Compressor(0 if level is None else level)
+    raise ValueError(f"unknown codec {name}")
+
+
+def decompress(name, data):
+    if name == "zlib":
+        return zlib.decompress(data)
+    elif name == "lzma":
+        return lzma.decompress(data)
+    elif name == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif name == "lz4":
+        return lz4frame.decompress(data)
+    raise ValueError(f"unknown codec {name}")
+
+
+def reply_ok(command, reply):
+    if command in ("AED", "LST"):
+        try:
+            return "error" not in json.loads(reply.split("\n", 1)[0])
+        except ValueError:
+            return False
+    return reply.startswith(SUCCESS_REPLIES.get(command, ""))
+
+
+# the command lines of a script, without blank lines and comments
+def read_script(lines):
+    script = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            script.append(line)
+    return script
+
+
+# name password pairs from a credentials file
+def read_credentials(fileName):
+    pairs = []
+    with open(fileName, "r") as f:
+        for line in f:
+            fields = line.rstrip("\n").split(" ", 1)
+            if len(fields) == 2 and fields[0]:
+                pairs.append((fields[0], fields[1]))
+    return pairs
+
+
+class DeviceClient:
+    """One simulated edge device: a logged-in connection that pipelines commands."""
+
+    def __init__(self, host, port, username, password, udp_port=9000, directory=".",
+                 window=32, report=None, sessions=False, compress=(), level=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.udp_port = udp_port
+        self.directory = directory
+        self.window = asyncio.Semaphore(window)
+        self.report = report or Report()
+        # (command, start time, future) of the commands still waiting for a reply, in send order
+        self.pending = deque()
+        self.reader = None
+        self.writer = None
+        self.reader_task = None
+        # ask for a session token at login, and resume with it on the next connect()
+        self.sessions = sessions
+        self.token = None
+        # codecs offered at login, the level uploads are compressed at, and the codec the server picked
+        self.compress = [name for name in compress if name in available_codecs()]
+        self.level = level
+        self.codec = None
+
+    def send_frame(self, message):
+        self.send_bytes(message.encode())
+
+    def send_bytes(self, payload):
+        self.writer.write(FRAME_HEADER.pack(len(payload)) + payload)
+
+    async def read_frame(self):
+        header = await self.reader.readexactly(FRAME_HEADER.size)
+        (length,) = FRAME_HEADER.unpack(header)
+        if length & COMPRESSED_FRAME:
+            payload = await self.reader.readexactly(length & ~COMPRESSED_FRAME)
+            return decompress(self.codec, payload).decode()
+        return (await self.reader.readexactly(length)).decode()
+
+    # "Welcome [token] [compress=codec]", returns False for any other reply
+    def welcome(self, reply):
+        words = reply.split(" ")
+        if words[0] != "Welcome":
+            return False
+        self.codec = None
+        for word in words[1:]:
+            if word.startswith("compress="):
+                self.codec = word[len("compress="):]
+            elif self.sessions:
+                self.token = word
+        return True
+
+    def login_options(self):
+        return f" compress={','.join(self.compress)}" if self.compress else ""
+
+    # returns True once logged in, False if the server refused the credentials,
+    # a token from an earlier connection is tried first and a full login follows if it expired
+    async def connect(self):
+        start = time.perf_counter()
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        if self.token is not None:
+            self.send_frame(f"RESUME {self.token} 127.0.0.1 {self.udp_port}" + self.login_options())
+            resumed = self.welcome(await self.read_frame())
+            self.report.record("RESUME", time.perf_counter() - start, resumed)
+            if resumed:
+                self.reader_task = asyncio.ensure_future(self.read_replies())
+                return True
+            self.token = None
+            start = time.perf_counter()
+        self.send_frame(("login session" if self.sessions else "login") + self.login_options())
+        await self.read_frame()
+        self.send_frame(f"{self.username} {self.password}")
+        if not self.welcome(await self.read_frame()):
+            self.writer.close()
+            return False
+        self.send_frame(f"{self.username} 127.0.0.1 {self.udp_port}")
+        await self.writer.drain()
+        self.report.record("LOGIN", time.perf_counter() - start, True)
+        self.reader_task = asyncio.ensure_future(self.read_replies())
+        return True
+
+    async def read_replies(self):
+        try:
+            while True:
+                reply = await self.read_frame()
+                command, start, future = self.pending.popleft()
+                self.report.record(command, time.perf_counter() - start, reply_ok(command, reply))
+                self.window.release()
+                future.set_result(reply)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            while self.pending:
+                command, start, future = self.pending.popleft()
+                self.report.record(command, time.perf_counter() - start, False)
+                future.set_exception(ConnectionError(f"connection closed before the {command} reply"))
+                self.window.release()
+
+    def data_file(self, fileId):
+        base = os.path.join(self.directory, f"{self.username}-{fileId}")
+        for suffix in datagen.FORMATS.values():
+            if os.path.exists(base + suffix):
+                return base + suffix
+        return None
+
+    # send one command line, returns a future for its reply without waiting for it
+    async def submit(self, line):
+        words = line.split()
+        command = words[0]
+        if command == "EDG":
+            return await self.generate(words)
+        if command not in NETWORK_COMMANDS:
+            raise ValueError(f"{command} is not supported in a script")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        fileName = None
+        if command == "UED":
+            fileName = self.data_file(words[1]) if len(words) == 2 else None
+            if fileName is None:
+                # the server would drop a UED without a size, so fail it here
+                self.report.record(command, 0.0, False)
+                future.set_result("the file to be uploaded does not exist")
+                return future
+        await self.window.acquire()
+        self.pending.append((command, time.perf_counter(), future))
+        if fileName is not None:
+            size = os.path.getsize(fileName)
+            self.send_frame(f"UED {words[1]} {size} {fileName.rsplit('.', 1)[1]}")
+            with open(fileName, "rb") as f:
+                if self.codec is None:
+                    await loop.sendfile(self.writer.transport, f, 0, size)
+                else:
+                    await self.send_compressed(f)
+        else:
+            self.send_frame(line)
+        await self.writer.drain()
+        return future
+
+    # stream a file as frames of compressed bytes, an empty frame ends it
+    async def send_compressed(self, f):
+        stream = compressor(self.codec, self.level)
+        for block in iter(lambda: f.read(UPLOAD_CHUNK), b""):
+            packed = stream.compress(block)
+            # an empty frame would end the upload early
+            if packed:
+                self.send_bytes(packed)
+                await self.writer.drain()
+        packed = stream.flush()
+        if packed:
+            self.send_bytes(packed)
+        self.send_bytes(b"")
+
+    # EDG fileID dataAmount [text|binary], done on a worker thread and timed like a command
+    async def generate(self, words):
+        future = asyncio.get_running_loop().create_future()
+        start = time.perf_counter()
+        try:
+            fmt = words[3] if len(words) == 4 else "text"
+            fileName = os.path.join(self.directory, f"{self.username}-{words[1]}{datagen.FORMATS[fmt]}")
+            await asyncio.get_running_loop().run_in_executor(None, datagen.generate, fileName, int(words[2]), fmt)
+            for suffix in datagen.FORMATS.values():
+                other = os.path.join(self.directory, f"{self.username}-{words[1]}{suffix}")
+                if other != fileName and os.path.exists(other):
+                    os.remove(other)
+        except (IndexError, KeyError, ValueError):
+            self.report.record("EDG", time.perf_counter() - start, False)
+            future.set_result("EDG needs fileID, dataAmount and optionally text or binary")
+            return future
+        self.report.record("EDG", time.perf_counter() - start, True)
+        future.set_result(f"{fileName} is created")
+        return future
+
+    # send every line of the script, pipelined, then wait for all the replies
+    async def run_script(self, script):
+        futures = [await self.submit(line) for line in script]
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+        if self.reader_task is not None:
+            await self.reader_task
+            self.reader_task = None
+
+
+# log in devices devices and run the script on each of them repeat times,
+# with reconnect every repetition after the first starts on a new connection
+async def run_fleet(host, port, script, credentials, devices=1, window=32, repeat=1,
+                    udp_base=9000, directory=None, report=None, sessions=False, reconnect=False,
+                    compress=(), level=None):
+    report = report or Report()
+    scratch = directory is None
+    if scratch:
+        directory = tempfile.mkdtemp(prefix="batchclient-")
+
+    async def one_device(index):
+        username, password = credentials[index % len(credentials)]
+        # devices sharing a name get their own directory so their EDG files do not collide
+        workdir = os.path.join(directory, str(index))
+        os.makedirs(workdir, exist_ok=True)
+        client = DeviceClient(host, port, username, password, udp_base + index, workdir, window, report, sessions,
+                              compress, level)
+        try:
+            logged_in = await client.connect()
+        except (OSError, asyncio.IncompleteReadError):
+            logged_in = False
+        if not logged_in:
+            report.failed_logins += 1
+            await client.close()
+            return
+        try:
+            for repetition in range(repeat):
+                if reconnect and repetition > 0:
+                    await client.close()
+                    if not await client.connect():
+                        report.failed_logins += 1
+                        return
+                await client.run_script(script)
+        except ConnectionError:
+            # the replies that never came are already counted as errors
+            pass
+        finally:
+            await client.close()
+
+    report.started = time.perf_counter()
+    try:
+        await asyncio.gather(*(one_device(index) for index in range(devices)))
+    finally:
+        report.finished = time.perf_counter()
+        if scratch:
+            shutil.rmtree(directory, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run a command script on many simulated edge devices at once")
+    parser.add_argument("host")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--script", default="-", help="file with one command per line, - for stdin")
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument("--credentials", default="credentials.txt")
+    parser.add_argument("--window", type=int, default=32, help="commands in flight per device")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--udp-base", type=int, default=9000)
+    parser.add_argument("--sessions", action="store_true", help="log in with a session token")
+    parser.add_argument("--reconnect", action="store_true",
+                        help="open a new connection for every repeat, resuming the session with --sessions")
+    parser.add_argument("--compress", default="",
+                        help="codecs to offer at login in order of preference, e.g. zstd,zlib")
+    parser.add_argument("--compress-level", type=int, default=None, help="level uploads are compressed at")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    if args.script == "-":
+        script = read_script(sys.stdin)
+    else:
+        with open(args.script, "r") as f:
+            script = read_script(f)
+    credentials = read_credentials(args.credentials)
+    if not credentials:
+        parser.error(f"no credentials in {args.credentials}")
+    report = asyncio.run(run_fleet(args.host, args.port, script, credentials, args.devices,
+                                   args.window, args.repeat, args.udp_base,
+                                   sessions=args.sessions, reconnect=args.reconnect,
+                                   compress=[name for name in args.compress.split(",") if name],
+                                   level=args.compress_level))
+    if args.json:
+        print(json.dumps(report.as_dict(), indent=2))
+    else:
+        report.print_table()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,8 @@
 from socket import *
 import sys
 import time
-import shutil, os
+import os, struct, json
+import udptransfer, datagen
 from datetime import datetime
 
 #Server would be running on the same host as Client
@@ -28,7 +29,45 @@ clientSocket.connect(serverAddress)
 
 ip_address = gethostbyname(gethostname())
 
-    
+# other edge devices send UVF files to this UDP port, a background thread receives them
+def file_received(sender, name, path):
+    print(f"\nReceived {name} from {sender}, saved as {path}")
+
+udpSocket = socket(AF_INET, SOCK_DGRAM)
+udpSocket.bind(("", UDP_port))
+udptransfer.Receiver(udpSocket, ".", on_complete=file_received).start()
+
+# every message is one frame: a 4-byte big-endian payload length then the utf-8 payload,
+# so messages sent back-to-back are never merged or split by TCP
+FRAME_HEADER = struct.Struct("!I")
+recv_buffer = bytearray()
+
+def send_msg(message):
+    payload = message.encode()
+    clientSocket.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+# returns the next message from the server, '' once the server has closed the connection
+def recv_msg():
+    while True:
+        if len(recv_buffer) >= FRAME_HEADER.size:
+            (length,) = FRAME_HEADER.unpack_from(recv_buffer)
+            end = FRAME_HEADER.size + length
+            if len(recv_buffer) >= end:
+                message = bytes(recv_buffer[FRAME_HEADER.size:end]).decode()
+                del recv_buffer[:end]
+                return message
+        data = clientSocket.recv(65536)
+        if not data:
+            return ''
+        recv_buffer.extend(data)
+
+# send the whole command line as one frame and print the single reply
+def request(command_line):
+    send_msg(command_line)
+    msg = recv_msg()
+    print(msg)
+    return msg
+
 def client_login():
     client_login.successful = False
     while True:
@@ -48,9 +87,8 @@ def client_login():
         # combine username and password so that the format is the same in credential.txt
         # which is easy to compare the username and password
         combination_id_and_password = client_login.username + " " + password
-        clientSocket.sendall(combination_id_and_password.encode())
-        data = clientSocket.recv(1024)
-        receivedMsg = data.decode()
+        send_msg(combination_id_and_password)
+        receivedMsg = recv_msg()
         if receivedMsg == 'Invalid':
             print("Invalid login")
             continue
@@ -58,7 +96,7 @@ def client_login():
             print("Welcome")
             client_login.successful = True
             edge_device_log()
-            print("Enter one of the following commands (EDG, UED, SCS, DTE, AED, UVF, OUT)")
+            print("Enter one of the following commands (EDG, UED, SCS, DTE, AED, LST, UVF, OUT)")
             commands()
             break
         elif receivedMsg == 'block':
@@ -73,142 +111,181 @@ def edge_device_log():
     if client_login.successful:
         edge_device_name = client_login.username
         edge_device_log.log = edge_device_name + " " + str(ip_address) + " " + str(UDP_port)
-        clientSocket.sendall(edge_device_log.log.encode())
+        send_msg(edge_device_log.log)
     
 def commands():
     while True:
         commands_list = input("Command: ")
-        commands.command_input = commands_list.split()          
-        clientSocket.sendall(commands.command_input[0].encode())
-
-        data = clientSocket.recv(1024).decode()
-        if commands.command_input[0] == "EDG":
+        commands.command_input = commands_list.split()
+        if not commands.command_input:
+            continue
+        command = commands.command_input[0]
+        if command == "EDG":
             EDG_execution()
-        elif data == "UED":
+        elif command == "UED":
             UED_execution()
-        elif data == "SCS":
+        elif command == "SCS":
             SCS_execution()
-        elif data == "DTE":
+        elif command == "DTE":
             DTE_execution()
-        elif data == "AED":
+        elif command == "AED":
             AED_execution()
-        elif data == "OUT":
+        elif command == "UVF":
+            UVF_execution()
+        elif command == "OUT":
             OUT_execution()
+        else:
+            request(commands_list)
         
 def EDG_execution():
     
-    # check input arguments
-    if len(commands.command_input) != 3:
+    # check input arguments, EDG fileID dataAmount [text|binary]
+    if len(commands.command_input) not in (3, 4):
         print("EDG command requires fileID and dataAmount as arguments.")
         
     # check input arguments are integer (except the command)
     elif not commands.command_input[1].isdigit() or not commands.command_input[2].isdigit():
         print("the fileID or dataAmount are not integers, you need to specify the parameter as integers")
+    elif len(commands.command_input) == 4 and commands.command_input[3] not in datagen.FORMATS:
+        print("the format should be text or binary")
     else:
         fileId = client_login.username + "-" + commands.command_input[1]
         EDG_execution.dataAmount = commands.command_input[2]
-        f = open(fileId + ".txt", 'w')
-        i = 0
-        while i < int(EDG_execution.dataAmount):
-            f.write(str(i) + "\n")
-            i += 1
-        f.close()
+        fmt = commands.command_input[3] if len(commands.command_input) == 4 else "text"
+        fileName = fileId + datagen.FORMATS[fmt]
+        datagen.generate(fileName, int(EDG_execution.dataAmount), fmt)
+        # a fileID is one file, so a copy left over in the other format would be uploaded by mistake
+        for suffix in datagen.FORMATS.values():
+            if fileId + suffix != fileName and os.path.exists(fileId + suffix):
+                os.remove(fileId + suffix)
         file_created_time = datetime.now()
-        file_made_msg = f'{fileId}.txt is created (data generation done)'
+        file_made_msg = f'{fileName} is created (data generation done)'
         print(file_made_msg)
 
 def UED_execution():
     
     # check input arguments
-    if len(commands.command_input) != 2:
+    if len(commands.command_input) != 2 or not commands.command_input[1].isdigit():
         print("fileID is needed to upload the data")
     else:
         name = client_login.username + "-" + commands.command_input[1]
         print(name)
-        fileName = f'{name}.txt'
+        # whichever format EDG wrote, text or binary
+        fileName = next((name + suffix for suffix in datagen.FORMATS.values()
+                         if os.path.exists(name + suffix)), None)
         # check if the file exists
-        if os.path.exists(fileName):
-            f = open(fileName, "r")
-            lines = f.read().splitlines()
-            nums = []
-            for line in lines:
-                nums.append(line) 
-                datas = len(nums)
-            # copy the file to the server directory
-            shutil.copy(fileName, "../server")
-            log_username = client_login.username + "; "
-            log_format = "; " + commands.command_input[1] + "; " + str(datas)
-            clientSocket.sendall(log_username.encode())
-            msg = clientSocket.recv(1024).decode()
-            clientSocket.sendall(log_format.encode())
-            msg = clientSocket.recv(1024).decode()
-            print(msg)
+        if fileName is not None:
+            # announce the size and format, then stream the file itself (zero-copy sendfile where the OS has it)
+            size = os.path.getsize(fileName)
+            send_msg(f"UED {commands.command_input[1]} {size} {fileName.rsplit('.', 1)[1]}")
+            with open(fileName, "rb") as f:
+                clientSocket.sendfile(f, 0, size)
+            print(recv_msg())
         else:
-            msg = clientSocket.recv(1024).decode()
-            print(msg)
+            print("the file to be uploaded does not exist")
     
+# SUM, AVERAGE, MIN, MAX, COUNT, STDDEV or a percentile written as P followed by 0-100, e.g. P95
+def valid_operation(operation):
+    operations = ["SUM", "AVERAGE", "MIN", "MAX", "COUNT", "STDDEV"]
+    if operation in operations:
+        return True
+    try:
+        return operation.startswith("P") and 0 <= float(operation[1:]) <= 100
+    except ValueError:
+        return False
+
 def SCS_execution():
-    operations = ["SUM", "AVERAGE", "MIN", "MAX"]
     
     # check the input arguments and type
     if len(commands.command_input) != 3 or not commands.command_input[1].isdigit():
         print("fileID is missing or fileID should be an integer")
         
     # check if the operations are the correct operations
-    elif not commands.command_input[2] in operations:
+    elif not valid_operation(commands.command_input[2]):
         print("wrong operation input")
     else: 
-        file = client_login.username + "-" + commands.command_input[1]
-        operation = commands.command_input[2]
-        clientSocket.sendall(operation.encode())
-        clientSocket.sendall(file.encode())
-        msg = clientSocket.recv(1024).decode()
-        print(msg)
+        request(f"SCS {commands.command_input[1]} {commands.command_input[2]}")
     
 def DTE_execution():
-    file = client_login.username + "-" + commands.command_input[1]
-    clientSocket.sendall(file.encode())
-    fileName = f'{file}.txt'
-    if not os.path.exists("../server/" + fileName):
-        msg = clientSocket.recv(1024).decode()
+    if len(commands.command_input) != 2 or not commands.command_input[1].isdigit():
+        print("fileID is missing or fileID should be an integer")
     else:
-        log = client_login.username + "; "
-        fileId = commands.command_input[1]
-        msg = clientSocket.recv(1024).decode()
-        print(msg)
-        clientSocket.sendall(log.encode())
-        msg = clientSocket.recv(1024).decode()
-        print(msg)
-        clientSocket.sendall(fileId.encode())
-        msg = clientSocket.recv(1024).decode()
-    print(msg)
+        request(f"DTE {commands.command_input[1]}")
     
+# ask the server for the active device called name, None if it is not active
+def find_active_device(name):
+    args = [f"prefix={name}"]
+    while True:
+        send_msg(" ".join(["AED"] + args))
+        lines = recv_msg().split("\n")
+        header = json.loads(lines[0])
+        if "error" in header:
+            return None
+        for line in lines[1:]:
+            device = json.loads(line)
+            if device["device"] == name:
+                return device
+        if header["next"] is None:
+            return None
+        args = [f"prefix={name}", f"offset={header['next']}"]
+
+# UVF deviceName filename: send a file straight to another edge device over UDP
+def UVF_execution():
+    if len(commands.command_input) != 3:
+        print("UVF command requires deviceName and filename as arguments.")
+        return
+    deviceName, fileName = commands.command_input[1], commands.command_input[2]
+    if not os.path.exists(fileName):
+        print(f"the file {fileName} does not exist")
+        return
+    device = find_active_device(deviceName)
+    if device is None:
+        print(f"{deviceName} is not active")
+        return
+    address = (device["ip_address"], int(device["udp_port"]))
+    try:
+        stats = udptransfer.send_file(address, fileName, client_login.username)
+    except TimeoutError as e:
+        print(f"could not send {fileName} to {deviceName}: {e}")
+        return
+    print(f"{fileName} has been uploaded to {deviceName} "
+          f"({stats.bytes} bytes in {stats.seconds:.2f}s, {stats.retransmits} retransmissions)")
+
 def OUT_execution():
-    username = client_login.username
-    clientSocket.sendall(username.encode())
-    msg = clientSocket.recv(1024).decode()
-    print(msg)
+    request("OUT")
     exit(0)
     
+# AED [prefix=NAME] [since=2022-09-30T10:31:13] [offset=N] [limit=N]
+# the reply is JSON lines, a header and then one line per device; follow "next" to get every page
 def AED_execution():
-    username = client_login.username
-    clientSocket.sendall(username.encode())
-    msg = clientSocket.recv(1024).decode()
-    print(msg)
-    with open("../server/other_active_devices.txt", "r") as f:
-        lines = f.readlines()
-        for line in lines:
-            print(line)
-        f.close()
+    args = commands.command_input[1:]
+    first_page = True
+    while True:
+        send_msg(" ".join(["AED"] + args))
+        lines = recv_msg().split("\n")
+        header = json.loads(lines[0])
+        if "error" in header:
+            print(header["error"])
+            return
+        if first_page:
+            print(header["message"])
+            first_page = False
+        for line in lines[1:]:
+            device = json.loads(line)
+            print(f"device: {device['device']} / timestamp: {device['timestamp']} / "
+                  f"ip_address: {device['ip_address']} / UDP_port: {device['udp_port']}")
+        if header["next"] is None:
+            return
+        args = [arg for arg in args if not arg.startswith("offset=")] + [f"offset={header['next']}"]
 
 while True:
     message = input("===== Please type any messsage you want to send to server: =====\n")
-    clientSocket.sendall(message.encode())
+    if message == '':
+        continue
+    send_msg(message)
 
-    # receive response from the server
-    # 1024 is a suggested packet size, you can specify it as 2048 or others
-    data = clientSocket.recv(1024)
-    receivedMessage = data.decode()
+    # receive response from the server, recv_msg() buffers until a whole frame is in
+    receivedMessage = recv_msg()
 
     # parse the message received from server and take corresponding actions
     if receivedMessage == "":
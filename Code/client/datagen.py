@@ -0,0 +1,49 @@
+"""
+    Data file generation for the EDG command
+    Python 3
+    coding: utf-8
+
+    A file of count samples 0, 1, ..., count-1 is written in large chunks, so EDG costs
+    one write() per CHUNK_SAMPLES samples instead of one per sample.
+
+    text    one sample per line, the format of the original assignment
+    binary  packed little-endian int64 samples with no header (.bin), read by the
+            server without any parsing
+"""
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CHUNK_SAMPLES = 1 << 16
+FORMATS = {"text": ".txt", "binary": ".bin"}
+
+
+def generate_text(fileName, count):
+    with open(fileName, "w") as f:
+        for start in range(0, count, CHUNK_SAMPLES):
+            end = min(start + CHUNK_SAMPLES, count)
+            f.write("\n".join(map(str, range(start, end))) + "\n")
+
+
+def generate_binary(fileName, count):
+    with open(fileName, "wb") as f:
+        for start in range(0, count, CHUNK_SAMPLES):
+            end = min(start + CHUNK_SAMPLES, count)
+            if numpy is not None:
+                f.write(numpy.arange(start, end, dtype="<i8").tobytes())
+            else:
+                values = array("q", range(start, end))
+                if sys.byteorder == "big":
+                    values.byteswap()
+                f.write(values.tobytes())
+
+
+def generate(fileName, count, fmt="text"):
+    if fmt == "binary":
+        generate_binary(fileName, count)
+    else:
+        generate_text(fileName, count)
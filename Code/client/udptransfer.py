@@ -0,0 +1,355 @@
+"""
+    Reliable file transfer over UDP for the UVF command
+    Python 3
+    coding: utf-8
+
+    Every datagram starts with a 9-byte header: type (1 byte), transfer id (4 bytes)
+    and a sequence number (4 bytes), all big-endian.
+
+        START      seq = number of chunks, payload = JSON {"sender", "name", "size", "chunk"}
+        START_ACK  seq = 0
+        DATA       seq = chunk number, payload = the chunk
+        ACK        seq = number of chunks received in order (the next one expected),
+                   payload = 8-byte selective ACK bitmap, bit i set when chunk seq+1+i is in
+
+    The sender keeps up to `window` chunks in flight. A chunk is sent again when its
+    retransmission timer runs out, or straight away when the selective ACKs show that
+    later chunks got through while it did not. The transfer is done once the
+    cumulative ACK reaches the number of chunks.
+
+    The receiver refuses a START beyond MAX_CHUNK / MAX_CHUNKS, ignores DATA whose
+    length does not match its chunk, and gives up a transfer, removing its .part
+    file, once nothing has arrived for it in IDLE_TIMEOUT seconds.
+"""
+import json, math, os, random, struct, threading, time
+from collections import OrderedDict
+from socket import socket, AF_INET, SOCK_DGRAM, timeout as SocketTimeout
+
+HEADER = struct.Struct("!BII")
+SACK = struct.Struct("!Q")
+SACK_BITS = 64
+START, START_ACK, DATA, ACK = 1, 2, 3, 4
+CHUNK_SIZE = 1200
+WINDOW = 64
+# a START asking for more is refused: the largest chunk a datagram can carry, and at most
+# MAX_CHUNKS chunks, which keeps the receiver's per-chunk bitmap to a megabyte
+MAX_CHUNK = 65507 - HEADER.size
+MAX_CHUNKS = 1 << 20
+# an incoming transfer that has not received a chunk for this long is given up, its .part removed
+IDLE_TIMEOUT = 30.0
+MIN_RTO, MAX_RTO, INITIAL_RTO = 0.01, 2.0, 0.2
+
+
+class LossySocket:
+    """Wraps a UDP socket and drops outgoing datagrams with probability loss_rate."""
+
+    def __init__(self, sock, loss_rate=0.0):
+        self.sock = sock
+        self.loss_rate = loss_rate
+        self.dropped = 0
+
+    def sendto(self, data, address):
+        if self.loss_rate and random.random() < self.loss_rate:
+            self.dropped += 1
+            return len(data)
+        return self.sock.sendto(data, address)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+class IncomingTransfer:
+    def __init__(self, sender, name, size, chunk, total, path):
+        self.sender = sender
+        self.name = name
+        self.size = size
+        self.chunk = chunk
+        self.total = total
+        self.path = path
+        self.received = bytearray(total)
+        self.count = 0
+        self.cumulative = 0
+        self.file = open(path + ".part", "wb")
+        self.last_active = time.monotonic()
+
+    # every chunk is chunk bytes long except the last, which holds what is left
+    def expected_length(self, seq):
+        return self.chunk if seq < self.total - 1 else self.size - seq * self.chunk
+
+    def store(self, seq, payload):
+        if seq >= self.total or self.received[seq] or len(payload) != self.expected_length(seq):
+            return
+        self.last_active = time.monotonic()
+        self.file.seek(seq * self.chunk)
+        self.file.write(payload)
+        self.received[seq] = 1
+        self.count += 1
+        while self.cumulative < self.total and self.received[self.cumulative]:
+            self.cumulative += 1
+
+    def sack(self):
+        bits = 0
+        for i in range(SACK_BITS):
+            seq = self.cumulative + 1 + i
+            if seq >= self.total:
+                break
+            if self.received[seq]:
+                bits |= 1 << i
+        return bits
+
+    def finish(self):
+        self.file.close()
+        os.replace(self.path + ".part", self.path)
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.remove(self.path + ".part")
+        except OSError:
+            pass
+
+
+# the metadata of a START datagram, None unless it is well formed and within the limits
+def parse_start(total, payload):
+    try:
+        meta = json.loads(payload)
+    except ValueError:
+        return None
+    if not isinstance(meta, dict):
+        return None
+    sender, name, size, chunk = meta.get("sender"), meta.get("name"), meta.get("size"), meta.get("chunk")
+    if not isinstance(sender, str) or not isinstance(name, str) or not os.path.basename(name):
+        return None
+    # bool is an int too
+    if type(size) is not int or type(chunk) is not int or size < 0 or not 0 < chunk <= MAX_CHUNK:
+        return None
+    if total > MAX_CHUNKS or total != -(-size // chunk):
+        return None
+    return meta
+
+
+class Receiver(threading.Thread):
+    """
+        Listens on a bound UDP socket and saves incoming files as sender_name in
+        directory. on_complete(sender, name, path) is called for every finished file.
+    """
+
+    def __init__(self, sock, directory=".", on_complete=None, loss_rate=0.0):
+        threading.Thread.__init__(self, name="uvf-receiver", daemon=True)
+        self.sock = LossySocket(sock, loss_rate)
+        self.directory = directory
+        self.on_complete = on_complete
+        self.transfers = {}
+        # finished transfers are remembered so a lost final ACK can be sent again
+        self.finished = OrderedDict()
+        self.last_sweep = time.monotonic()
+
+    def run(self):
+        # wake up now and then even when nothing arrives, so idle transfers are dropped
+        self.sock.settimeout(IDLE_TIMEOUT / 2)
+        while True:
+            if time.monotonic() - self.last_sweep >= IDLE_TIMEOUT / 2:
+                self.expire()
+            try:
+                packet, address = self.sock.recvfrom(65536)
+            except SocketTimeout:
+                continue
+            except OSError:
+                return
+            if len(packet) < HEADER.size:
+                continue
+            kind, transfer_id, seq = HEADER.unpack_from(packet)
+            key = (address, transfer_id)
+            try:
+                if kind == START:
+                    if self.start_transfer(key, seq, packet[HEADER.size:]):
+                        self.sock.sendto(HEADER.pack(START_ACK, transfer_id, 0), address)
+                elif kind == DATA:
+                    self.handle_data(key, seq, packet[HEADER.size:])
+            except Exception:
+                # whatever a peer sends, one bad datagram must not stop the receiver for everyone
+                continue
+
+    # returns False for a START that is refused, which is not acknowledged
+    def start_transfer(self, key, total, payload):
+        if key in self.transfers or key in self.finished:
+            return True
+        meta = parse_start(total, payload)
+        if meta is None:
+            return False
+        sender, name = os.path.basename(meta["sender"]), os.path.basename(meta["name"])
+        path = os.path.join(self.directory, f"{sender}_{name}")
+        try:
+            transfer = IncomingTransfer(sender, name, meta["size"], meta["chunk"], total, path)
+        except OSError:
+            return False
+        self.transfers[key] = transfer
+        if total == 0:
+            self.complete(key, transfer)
+        return True
+
+    def handle_data(self, key, seq, payload):
+        address, transfer_id = key
+        transfer = self.transfers.get(key)
+        if transfer is not None:
+            transfer.store(seq, payload)
+            ack = HEADER.pack(ACK, transfer_id, transfer.cumulative) + SACK.pack(transfer.sack())
+            self.sock.sendto(ack, address)
+            if transfer.count == transfer.total:
+                self.complete(key, transfer)
+        elif key in self.finished:
+            self.sock.sendto(HEADER.pack(ACK, transfer_id, self.finished[key]) + SACK.pack(0), address)
+
+    # give up the transfers whose sender has gone quiet
+    def expire(self):
+        now = time.monotonic()
+        self.last_sweep = now
+        for key, transfer in list(self.transfers.items()):
+            if now - transfer.last_active >= IDLE_TIMEOUT:
+                transfer.abort()
+                del self.transfers[key]
+
+    def complete(self, key, transfer):
+        transfer.finish()
+        del self.transfers[key]
+        self.finished[key] = transfer.total
+        if len(self.finished) > 256:
+            self.finished.popitem(last=False)
+        if self.on_complete is not None:
+            self.on_complete(transfer.sender, transfer.name, transfer.path)
+
+
+class TransferStats:
+    def __init__(self):
+        self.packets = 0
+        self.retransmits = 0
+        self.seconds = 0.0
+        self.bytes = 0
+
+
+def send_file(address, fileName, sender, remote_name=None, window=WINDOW, chunk=CHUNK_SIZE,
+              timeout=10.0, loss_rate=0.0):
+    """
+        Send fileName to the Receiver at address, blocking until every chunk has been
+        acknowledged. Raises TimeoutError when the peer stops answering for timeout seconds.
+    """
+    size = os.path.getsize(fileName)
+    total = math.ceil(size / chunk)
+    transfer_id = random.getrandbits(32)
+    stats = TransferStats()
+    stats.bytes = size
+    sock = LossySocket(socket(AF_INET, SOCK_DGRAM), loss_rate)
+    start = time.perf_counter()
+    try:
+        meta = json.dumps({"sender": sender, "name": remote_name or os.path.basename(fileName),
+                           "size": size, "chunk": chunk}).encode()
+        rto = handshake(sock, address, HEADER.pack(START, transfer_id, total) + meta, transfer_id, timeout)
+        with open(fileName, "rb") as f:
+            send_window(sock, address, f, transfer_id, total, chunk, window, rto, timeout, stats)
+    finally:
+        sock.close()
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+# send START until it is acknowledged, returns a first retransmission timeout from its RTT
+def handshake(sock, address, start_packet, transfer_id, timeout):
+    deadline = time.monotonic() + timeout
+    rto = INITIAL_RTO
+    while time.monotonic() < deadline:
+        sent = time.monotonic()
+        sock.sendto(start_packet, address)
+        sock.settimeout(rto)
+        try:
+            while True:
+                packet, _ = sock.recvfrom(65536)
+                kind, tid, _ = HEADER.unpack_from(packet)
+                if kind == START_ACK and tid == transfer_id:
+                    return min(MAX_RTO, max(MIN_RTO, 3 * (time.monotonic() - sent)))
+        except SocketTimeout:
+            rto = min(MAX_RTO, rto * 2)
+    raise TimeoutError(f"no answer from {address[0]}:{address[1]}")
+
+
+def send_window(sock, address, f, transfer_id, total, chunk, window, rto, timeout, stats):
+    acked = bytearray(total)
+    sent_at = {}
+    retransmitted = set()
+    base = 0
+    next_seq = 0
+    srtt = None
+    rttvar = 0.0
+    # doubles every time the oldest chunk times out, back to 1 as soon as anything is acknowledged
+    backoff = 1
+    last_progress = time.monotonic()
+
+    def transmit(seq):
+        f.seek(seq * chunk)
+        sock.sendto(HEADER.pack(DATA, transfer_id, seq) + f.read(chunk), address)
+        sent_at[seq] = time.monotonic()
+        stats.packets += 1
+
+    def retransmit(seq):
+        transmit(seq)
+        retransmitted.add(seq)
+        stats.retransmits += 1
+
+    while base < total:
+        while next_seq < total and next_seq < base + window:
+            transmit(next_seq)
+            next_seq += 1
+
+        now = time.monotonic()
+        oldest = min(sent_at[seq] for seq in range(base, next_seq) if not acked[seq])
+        sock.settimeout(max(0.0005, oldest + rto * backoff - now))
+        try:
+            packet, _ = sock.recvfrom(65536)
+        except SocketTimeout:
+            packet = None
+
+        now = time.monotonic()
+        if packet is not None and len(packet) >= HEADER.size + SACK.size:
+            kind, tid, cumulative = HEADER.unpack_from(packet)
+            (bits,) = SACK.unpack_from(packet, HEADER.size)
+            if kind == ACK and tid == transfer_id:
+                newly = [seq for seq in range(base, min(cumulative, total)) if not acked[seq]]
+                highest_sacked = None
+                for i in range(SACK_BITS):
+                    seq = cumulative + 1 + i
+                    if seq >= total:
+                        break
+                    if bits >> i & 1:
+                        highest_sacked = seq
+                        if not acked[seq]:
+                            newly.append(seq)
+                for seq in newly:
+                    acked[seq] = 1
+                # Karn's rule: only chunks sent once give an RTT sample
+                samples = [now - sent_at[seq] for seq in newly if seq not in retransmitted]
+                if samples:
+                    sample = min(samples)
+                    if srtt is None:
+                        srtt, rttvar = sample, sample / 2
+                    else:
+                        rttvar = 0.75 * rttvar + 0.25 * abs(srtt - sample)
+                        srtt = 0.875 * srtt + 0.125 * sample
+                    rto = min(MAX_RTO, max(MIN_RTO, srtt + 4 * rttvar))
+                if newly:
+                    backoff = 1
+                    last_progress = now
+                while base < total and acked[base]:
+                    base += 1
+                # chunks below a selectively acknowledged one were probably lost, resend each once per RTT
+                if highest_sacked is not None:
+                    gap = srtt if srtt is not None else rto
+                    for seq in range(base, highest_sacked):
+                        if not acked[seq] and now - sent_at[seq] > gap:
+                            retransmit(seq)
+
+        expired = [seq for seq in range(base, next_seq) if not acked[seq] and now - sent_at[seq] >= rto * backoff]
+        for seq in expired:
+            retransmit(seq)
+        if expired:
+            backoff = min(backoff * 2, int(MAX_RTO / MIN_RTO))
+        if now - last_progress > timeout:
+            raise TimeoutError(f"{address[0]}:{address[1]} stopped acknowledging")
@@ -0,0 +1,277 @@
+"""
+    Aggregation engine for the SCS command
+    Python 3
+    coding: utf-8
+
+    A data file is read once, block by block through datafile.DataFile, and folded
+    into a Summary (count, sum, min, max, sum of squares), so SUM, AVERAGE, MIN, MAX,
+    COUNT and STDDEV all come out of the same pass in constant memory. Blocks are
+    parsed with NumPy when it is installed and with plain int() otherwise. Percentiles
+    (P50, P99.9, ...) need the samples themselves and keep them as a packed int64 array.
+
+    SummaryCache keeps the Summary of recently used files so repeated SCS requests
+    for an unchanged file are answered without reading it again.
+"""
+import math, os, threading
+from array import array
+from collections import OrderedDict
+from operator import mul
+import datafile
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SUMMARY_OPERATIONS = ["SUM", "AVERAGE", "MIN", "MAX", "COUNT", "STDDEV"]
+INT64_MAX = 2 ** 63 - 1
+
+
+class Summary:
+    def __init__(self, count=0, total=0, minimum=None, maximum=None, sum_squares=0):
+        self.count = count
+        self.total = total
+        self.minimum = minimum
+        self.maximum = maximum
+        self.sum_squares = sum_squares
+
+    # fold one block of samples into the running totals
+    def add(self, count, total, minimum, maximum, sum_squares):
+        if count == 0:
+            return
+        self.count += count
+        self.total += total
+        self.sum_squares += sum_squares
+        self.minimum = minimum if self.minimum is None else min(self.minimum, minimum)
+        self.maximum = maximum if self.maximum is None else max(self.maximum, maximum)
+
+    def average(self):
+        return self.total / self.count
+
+    # population standard deviation, the variance is worked out in exact integers
+    def stddev(self):
+        variance = (self.count * self.sum_squares - self.total * self.total) / (self.count * self.count)
+        return math.sqrt(max(variance, 0))
+
+    def result(self, operation):
+        if self.count == 0 and operation != "COUNT" and operation != "SUM":
+            return None
+        if operation == "SUM":
+            return self.total
+        elif operation == "AVERAGE":
+            return self.average()
+        elif operation == "MIN":
+            return self.minimum
+        elif operation == "MAX":
+            return self.maximum
+        elif operation == "COUNT":
+            return self.count
+        elif operation == "STDDEV":
+            return self.stddev()
+        raise ValueError(f"unknown operation {operation}")
+
+
+# returns the percentile asked for by an operation such as P95 or P99.9, None if it is not one
+def percentile_of(operation):
+    if not operation.startswith("P"):
+        return None
+    try:
+        pct = float(operation[1:])
+    except ValueError:
+        return None
+    if not 0 <= pct <= 100 or math.isnan(pct):
+        return None
+    return pct
+
+
+def valid_operation(operation):
+    return operation in SUMMARY_OPERATIONS or percentile_of(operation) is not None
+
+
+def block_stats_python(values):
+    if not values:
+        return 0, 0, None, None, 0
+    return len(values), sum(values), min(values), max(values), sum(map(mul, values, values))
+
+
+def block_stats_numpy(values):
+    if len(values) == 0:
+        return 0, 0, None, None, 0
+    minimum, maximum = int(values.min()), int(values.max())
+    biggest = max(abs(minimum), abs(maximum))
+    # int64 arithmetic is exact as long as the squares cannot overflow, else use Python ints
+    if biggest * biggest * len(values) <= INT64_MAX:
+        total, sum_squares = int(values.sum()), int(numpy.dot(values, values))
+    else:
+        as_list = values.tolist()
+        total, sum_squares = sum(as_list), sum(map(mul, as_list, as_list))
+    return len(values), total, minimum, maximum, sum_squares
+
+
+def pick_engine(use_numpy):
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    if use_numpy and numpy is None:
+        raise RuntimeError("NumPy is not installed")
+    return use_numpy
+
+
+# the samples of a text or binary file, one block at a time
+def value_blocks(fileName, use_numpy):
+    with datafile.DataFile(fileName) as data:
+        yield from data.values(use_numpy)
+
+
+# one streaming pass over the file
+def summarize_file(fileName, use_numpy=None):
+    use_numpy = pick_engine(use_numpy)
+    stats = block_stats_numpy if use_numpy else block_stats_python
+    summary = Summary()
+    for values in value_blocks(fileName, use_numpy):
+        summary.add(*stats(values))
+    return summary
+
+
+# linear interpolation between the closest ranks, the same as numpy.percentile's default
+def percentile_file(fileName, pct, use_numpy=None):
+    use_numpy = pick_engine(use_numpy)
+    if use_numpy:
+        blocks = list(value_blocks(fileName, use_numpy))
+        if not blocks or sum(len(b) for b in blocks) == 0:
+            return None
+        return float(numpy.percentile(numpy.concatenate(blocks), pct))
+    samples = array("q")
+    for values in value_blocks(fileName, use_numpy):
+        if isinstance(samples, array):
+            try:
+                samples.extend(array("q", values))
+                continue
+            except OverflowError:
+                # a sample outside int64, keep exact Python ints from here on
+                samples = list(samples)
+        samples.extend(values)
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    position = (len(ordered) - 1) * pct / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return float(ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower))
+
+
+def compute(fileName, operation, use_numpy=None):
+    pct = percentile_of(operation)
+    if pct is not None:
+        return percentile_file(fileName, pct, use_numpy)
+    return summarize_file(fileName, use_numpy).result(operation)
+
+
+class SummaryBuilder:
+    """
+        Folds a file into a Summary from the chunks it arrives in, so an upload is
+        summarized on its way to disk instead of being read again afterwards. A text
+        sample split between two chunks waits for the rest of its line. result() is
+        None if the data does not parse, as summarize_file() would raise.
+    """
+
+    # no sample is anywhere near this long, a longer unfinished line means the data is bad
+    MAX_PENDING = 64 * 1024
+
+    def __init__(self, binary, use_numpy=None):
+        self.binary = binary
+        self.use_numpy = pick_engine(use_numpy)
+        self.stats = block_stats_numpy if self.use_numpy else block_stats_python
+        self.summary = Summary()
+        self.pending = b""
+        self.failed = False
+
+    def feed(self, chunk):
+        if self.failed:
+            return
+        data = self.pending + chunk if self.pending else chunk
+        if self.binary:
+            end = len(data) - len(data) % datafile.SAMPLE_SIZE
+        else:
+            end = data.rfind(b"\n") + 1
+        self.pending = bytes(data[end:])
+        if len(self.pending) > self.MAX_PENDING:
+            self.failed = True
+        elif end:
+            self.add(data[:end])
+
+    def add(self, block):
+        try:
+            if self.binary:
+                values = datafile.parse_block_binary(block, self.use_numpy)
+            elif self.use_numpy:
+                values = datafile.parse_block_numpy(block)
+            else:
+                values = datafile.parse_block_python(block)
+            self.summary.add(*self.stats(values))
+        except (ValueError, OverflowError):
+            self.failed = True
+
+    def result(self):
+        # the last sample may not end with a newline, a trailing partial binary sample is not one
+        if self.pending and not self.binary and not self.failed:
+            self.add(self.pending + b"\n")
+        self.pending = b""
+        return None if self.failed else self.summary
+
+
+class SummaryCache:
+    """
+        Bounded LRU of file name -> Summary. Every entry remembers the size, mtime and
+        inode the file had when it was summarized, so a file replaced behind the
+        server's back is treated as a miss rather than answered from stale numbers.
+    """
+
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def signature(fileName):
+        st = os.stat(fileName)
+        return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def get(self, fileName):
+        try:
+            signature = self.signature(fileName)
+        except OSError:
+            signature = None
+        with self.lock:
+            entry = self.entries.get(fileName)
+            if entry is not None and entry[0] == signature:
+                self.entries.move_to_end(fileName)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[fileName]
+            self.misses += 1
+            return None
+
+    # signature should be taken before the file was read, so a file replaced during the read is a miss later
+    def put(self, fileName, signature, summary):
+        if self.capacity <= 0:
+            return
+        with self.lock:
+            self.entries[fileName] = (signature, summary)
+            self.entries.move_to_end(fileName)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def evict(self, fileName):
+        with self.lock:
+            self.entries.pop(fileName, None)
+
+    def counters(self):
+        with self.lock:
+            return {"entries": len(self.entries), "capacity": self.capacity, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
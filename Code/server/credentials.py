@@ -0,0 +1,130 @@
+"""
+    Credential store for edge device logins
+    Python 3
+    Usage: python3 credentials.py hash PASSWORD [--scheme pbkdf2_sha256|scrypt]
+    coding: utf-8
+
+    credentials.txt holds one "name secret" pair per line. The secret is either the
+    plain password, as in the original assignment file, or a salted hash made by
+    hash_password():
+
+        supersmartwatch pbkdf2_sha256$600000$<salt hex>$<hash hex>
+        supersensor scrypt$16384$8$1$<salt hex>$<hash hex>
+
+    The file is loaded once into a dict and loaded again only when its size or mtime
+    changes, so a login is a dict lookup plus, for hashed secrets, one hash.
+"""
+import argparse, hashlib, hmac, os, secrets, threading, time
+
+PBKDF2_ITERATIONS = 600000
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 16384, 8, 1
+
+
+def hash_password(password, scheme="pbkdf2_sha256", iterations=PBKDF2_ITERATIONS):
+    salt = secrets.token_bytes(16)
+    if scheme == "pbkdf2_sha256":
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+        return f"pbkdf2_sha256${iterations}${salt.hex()}${digest.hex()}"
+    elif scheme == "scrypt":
+        digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+        return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+    raise ValueError(f"unknown scheme {scheme}")
+
+
+def is_hashed(secret):
+    return secret.startswith("pbkdf2_sha256$") or secret.startswith("scrypt$")
+
+
+# compare a password with a stored secret in constant time
+def check_secret(secret, password):
+    if not is_hashed(secret):
+        return hmac.compare_digest(secret.encode(), password.encode())
+    fields = secret.split("$")
+    try:
+        if fields[0] == "pbkdf2_sha256":
+            iterations, salt, expected = int(fields[1]), bytes.fromhex(fields[2]), bytes.fromhex(fields[3])
+            digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+        else:
+            n, r, p = int(fields[1]), int(fields[2]), int(fields[3])
+            salt, expected = bytes.fromhex(fields[4]), bytes.fromhex(fields[5])
+            digest = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=len(expected))
+    except (IndexError, ValueError):
+        # a malformed line never lets anyone in
+        return False
+    return hmac.compare_digest(digest, expected)
+
+
+class CredentialStore:
+    def __init__(self, fileName="credentials.txt", reload_interval=1.0):
+        self.fileName = fileName
+        self.reload_interval = reload_interval
+        self.lock = threading.Lock()
+        self.secrets = {}
+        self.signature = None
+        self.next_check = 0
+        self.reload()
+
+    def reload(self):
+        st = os.stat(self.fileName)
+        table = {}
+        with open(self.fileName, "r") as f:
+            for line in f:
+                fields = line.rstrip("\n").split(" ", 1)
+                if len(fields) == 2 and fields[0]:
+                    table[fields[0]] = fields[1]
+        self.secrets = table
+        self.signature = (st.st_size, st.st_mtime_ns)
+
+    # stat the file at most once per reload_interval and reload it if it changed
+    def refresh(self):
+        now = time.monotonic()
+        if now < self.next_check:
+            return
+        with self.lock:
+            if now < self.next_check:
+                return
+            self.next_check = now + self.reload_interval
+            try:
+                st = os.stat(self.fileName)
+                if (st.st_size, st.st_mtime_ns) != self.signature:
+                    self.reload()
+            except OSError:
+                # keep serving the last good copy while the file is being replaced
+                pass
+
+    def lookup(self, username):
+        self.refresh()
+        return self.secrets.get(username)
+
+    # "name password" exactly as the client sends it, split into its two halves
+    @staticmethod
+    def split_login(data):
+        fields = data.rstrip("\n").split(" ", 1)
+        if len(fields) != 2:
+            return None, None
+        return fields[0], fields[1]
+
+    # True when checking this user's password means running a slow hash
+    def is_expensive(self, username):
+        secret = self.lookup(username)
+        return secret is not None and is_hashed(secret)
+
+    def verify(self, username, password):
+        secret = self.lookup(username)
+        if secret is None:
+            return False
+        return check_secret(secret, password)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="print the hashed secret to put after the device name in credentials.txt")
+    parser.add_argument("action", choices=["hash"])
+    parser.add_argument("password")
+    parser.add_argument("--scheme", choices=["pbkdf2_sha256", "scrypt"], default="pbkdf2_sha256")
+    parser.add_argument("--iterations", type=int, default=PBKDF2_ITERATIONS)
+    args = parser.parse_args()
+    print(hash_password(args.password, args.scheme, args.iterations))
+
+
+if __name__ == "__main__":
+    main()
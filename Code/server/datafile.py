@@ -0,0 +1,153 @@
+"""
+    Read-only access to uploaded data files
+    Python 3
+    coding: utf-8
+
+    Every command that reads a data file goes through DataFile. The file is mapped
+    into memory instead of read into a Python list of lines, so the only copies are
+    the page cache and one bounded block at a time.
+
+    Text files (one sample per line) are handed out in blocks that end on a line
+    boundary. Records are counted by scanning a block for newlines and a block is
+    parsed in one call, numpy.fromstring when NumPy is installed, so no string object
+    is made per line. Binary files (.bin, packed little-endian int64) are not parsed
+    at all: with NumPy a block is an array over the mapped pages themselves.
+"""
+import mmap, os, sys, warnings
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+BLOCK_SIZE = 1024 * 1024
+BINARY_SUFFIX = ".bin"
+SAMPLE_SIZE = 8
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def is_binary(fileName):
+    return fileName.endswith(BINARY_SUFFIX)
+
+
+def parse_block_python(block):
+    lines = block.split(b"\n")
+    lines.pop()
+    try:
+        return list(map(int, lines))
+    except ValueError:
+        # blank lines are skipped, anything else that is not an integer is an error
+        return [int(line) for line in lines if line.strip()]
+
+
+def parse_block_numpy(block):
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            values = numpy.fromstring(block, dtype=numpy.int64, sep="\n")
+    except ValueError:
+        values = None
+    # depending on the NumPy version fromstring stops quietly or raises at the first bad
+    # line, either way let the slow path skip blank lines or report the bad sample.
+    # A sample outside int64 is clamped to one of its bounds, so those go the slow way too
+    if values is None or len(values) != block.count(b"\n") \
+            or (len(values) and (values.min() == INT64_MIN or values.max() == INT64_MAX)):
+        parsed = parse_block_python(block)
+        if parsed and (min(parsed) < INT64_MIN or max(parsed) > INT64_MAX):
+            # exact Python ints, as the pure-Python path would give
+            return numpy.array(parsed, dtype=object)
+        values = numpy.array(parsed, dtype=numpy.int64)
+    return values
+
+
+# packed little-endian int64 samples, an array over block itself with NumPy
+def parse_block_binary(block, use_numpy):
+    if use_numpy:
+        return numpy.frombuffer(block, "<i8")
+    values = array("q")
+    values.frombytes(block)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+class DataFile:
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.binary = is_binary(fileName)
+        with open(fileName, "rb") as f:
+            self.size = os.fstat(f.fileno()).st_size
+            # an empty file cannot be mapped, and has nothing to read anyway
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                # a caller still holds an array over the map, it is unmapped once that is freed
+                pass
+            self.map = None
+
+    # (start, end) offsets of about block_size bytes, ending on a line or sample boundary
+    def spans(self, block_size=BLOCK_SIZE):
+        if self.binary:
+            if self.size % SAMPLE_SIZE:
+                raise ValueError(f"{self.fileName} ends in the middle of a sample")
+            step = block_size - block_size % SAMPLE_SIZE
+            for start in range(0, self.size, step):
+                yield start, min(start + step, self.size)
+            return
+        start = 0
+        while start < self.size:
+            end = self.map.rfind(b"\n", start, start + block_size) + 1
+            if end == 0:
+                # no newline in this block: a line longer than block_size, or the last line
+                end = self.map.find(b"\n", start + block_size) + 1 or self.size
+            yield start, end
+            start = end
+
+    # number of samples, without parsing them
+    def count(self):
+        if self.binary:
+            return self.size // SAMPLE_SIZE
+        if self.map is None:
+            return 0
+        records = 0
+        for start, end in self.spans():
+            if numpy is not None:
+                records += int(numpy.count_nonzero(numpy.frombuffer(self.map, numpy.uint8, end - start, start) == 10))
+            else:
+                records += self.map[start:end].count(b"\n")
+        # the last sample may not end with a newline
+        if self.map[self.size - 1] != 10:
+            records += 1
+        return records
+
+    # the samples one block at a time, NumPy int64 arrays or lists/arrays of ints,
+    # a text block holding a sample outside int64 is a NumPy array of Python ints
+    def values(self, use_numpy):
+        if self.map is None:
+            return
+        for start, end in self.spans():
+            if self.binary and use_numpy:
+                yield numpy.frombuffer(self.map, "<i8", (end - start) // SAMPLE_SIZE, start)
+            elif self.binary:
+                yield parse_block_binary(self.map[start:end], False)
+            else:
+                block = self.map[start:end]
+                if not block.endswith(b"\n"):
+                    block += b"\n"
+                yield parse_block_numpy(block) if use_numpy else parse_block_python(block)
+
+
+def count_samples(fileName):
+    with DataFile(fileName) as data:
+        return data.count()
@@ -0,0 +1,204 @@
+"""
+    Registry of the active edge devices
+    Python 3
+    coding: utf-8
+
+    The registry lives in memory, keyed by device name, so registering, removing and
+    listing devices never reads edge-device-log.txt. The log file is an append-only
+    journal of what happened, one line per event:
+
+        1; 2022-09-30 10:31:13.123456 supersmartwatch 10.0.0.5 8000     (device joined)
+        OUT; 2022-09-30 10:35:02.654321 supersmartwatch                 (device left)
+
+    Join lines keep the format of the original active edge device log, so an existing
+    log replays as-is. On start up the server replays the journal and rewrites it with
+    only the devices that are still active, numbered 1..n in the order they joined.
+"""
+import os, threading
+from collections import namedtuple
+from datetime import datetime
+
+Device = namedtuple("Device", ["name", "timestamp", "ip_address", "udp_port"])
+
+
+class DeviceRegistry:
+    def __init__(self, journalName="edge-device-log.txt", writer=None):
+        self.journalName = journalName
+        # a LogWriter to append journal lines through, without one they are written here
+        self.writer = writer
+        self.lock = threading.Lock()
+        # dicts keep insertion order, which is the order the devices joined in
+        self.devices = {}
+        self.journal = None
+
+    # rebuild the registry from the journal, then compact the journal
+    def replay(self):
+        with self.lock:
+            self.devices = {}
+            if os.path.exists(self.journalName):
+                with open(self.journalName, "r") as f:
+                    for line in f:
+                        self.apply(line.rstrip("\n"))
+            self.compact()
+
+    def apply(self, line):
+        head, _, rest = line.partition("; ")
+        fields = rest.split(" ")
+        if head == "OUT" and len(fields) >= 3:
+            self.devices.pop(fields[2], None)
+        elif head.isdigit() and len(fields) >= 5:
+            device = Device(fields[2], fields[0] + " " + fields[1], fields[3], fields[4])
+            self.devices.pop(device.name, None)
+            self.devices[device.name] = device
+
+    # only safe before the server starts taking logins
+    def compact(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        partName = self.journalName + ".part"
+        with open(partName, "w") as f:
+            for seq, device in enumerate(self.devices.values(), 1):
+                f.write(self.join_line(seq, device))
+        os.replace(partName, self.journalName)
+
+    @staticmethod
+    def join_line(seq, device):
+        return f"{seq}; {device.timestamp} {device.name} {device.ip_address} {device.udp_port}\n"
+
+    def append(self, line):
+        if self.writer is not None:
+            self.writer.write(self.journalName, line)
+            return
+        if self.journal is None:
+            self.journal = open(self.journalName, "a")
+        self.journal.write(line)
+        self.journal.flush()
+
+    # returns the device's sequence number among the active devices
+    def register(self, name, timestamp, ip_address, udp_port):
+        device = Device(name, str(timestamp), ip_address, str(udp_port))
+        with self.lock:
+            # logging in again replaces the earlier entry
+            self.devices.pop(name, None)
+            self.devices[name] = device
+            seq = len(self.devices)
+            self.append(self.join_line(seq, device))
+        return seq
+
+    # returns False if the device was not active
+    def remove(self, name):
+        with self.lock:
+            if self.devices.pop(name, None) is None:
+                return False
+            self.append(f"OUT; {datetime.now()} {name}\n")
+        return True
+
+    # the active device called name, None if it is not active
+    def get(self, name):
+        return self.devices.get(name)
+
+    # a consistent copy of the active devices in join order, without exclude
+    def snapshot(self, exclude=None):
+        with self.lock:
+            return [device for device in self.devices.values() if device.name != exclude]
+
+    # one page of the active devices whose name starts with prefix and that joined at or
+    # after since (a datetime), returns (number of matching devices, page)
+    def query(self, exclude=None, prefix=None, since=None, offset=0, limit=None):
+        # str(datetime) timestamps sort in time order, so they compare as strings
+        since = str(since) if since is not None else None
+        with self.lock:
+            matches = [device for device in self.devices.values()
+                       if device.name != exclude
+                       and (prefix is None or device.name.startswith(prefix))
+                       and (since is None or device.timestamp >= since)]
+        end = None if limit is None else offset + limit
+        return len(matches), matches[offset:end]
+
+    def __len__(self):
+        return len(self.devices)
+
+    def close(self):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+
+
+class SharedDeviceRegistry:
+    """
+        DeviceRegistry's interface on a shared.SharedDatabase, so every worker process
+        sees the same active devices. Journal lines are appended inside the write
+        transaction rather than through writer: each worker has its own LogWriter, and
+        an OUT batched on one worker could otherwise land after the login that
+        followed it on another, leaving the device out when the journal is replayed.
+    """
+
+    def __init__(self, database, journalName="edge-device-log.txt", writer=None):
+        self.database = database
+        self.journalName = journalName
+        self.writer = writer
+
+    # start from the devices of a replayed DeviceRegistry, in their join order
+    def load(self, devices):
+        def fill(db):
+            db.execute("DROP TABLE IF EXISTS devices")
+            db.execute("CREATE TABLE devices (name TEXT PRIMARY KEY, timestamp TEXT, ip_address TEXT,"
+                       " udp_port TEXT, joined INTEGER)")
+            db.execute("CREATE INDEX devices_joined ON devices (joined)")
+            db.executemany("INSERT INTO devices VALUES (?, ?, ?, ?, ?)",
+                           [tuple(device) + (joined,) for joined, device in enumerate(devices, 1)])
+        self.database.transaction(fill)
+
+    # only called inside a transaction, which holds the database's write lock
+    def append(self, line):
+        with open(self.journalName, "a") as f:
+            f.write(line)
+
+    def register(self, name, timestamp, ip_address, udp_port):
+        device = Device(name, str(timestamp), ip_address, str(udp_port))
+
+        def insert(db):
+            db.execute("DELETE FROM devices WHERE name = ?", (name,))
+            db.execute("INSERT INTO devices SELECT ?, ?, ?, ?, COALESCE(MAX(joined), 0) + 1 FROM devices",
+                       tuple(device))
+            seq = db.execute("SELECT COUNT(*) FROM devices").fetchone()[0]
+            self.append(DeviceRegistry.join_line(seq, device))
+            return seq
+        return self.database.transaction(insert)
+
+    def remove(self, name):
+        def delete(db):
+            if not db.execute("DELETE FROM devices WHERE name = ?", (name,)).rowcount:
+                return False
+            self.append(f"OUT; {datetime.now()} {name}\n")
+            return True
+        return self.database.transaction(delete)
+
+    def get(self, name):
+        rows = self.database.execute("SELECT name, timestamp, ip_address, udp_port FROM devices WHERE name = ?", (name,))
+        return Device(*rows[0]) if rows else None
+
+    def snapshot(self, exclude=None):
+        return self.query(exclude)[1]
+
+    def query(self, exclude=None, prefix=None, since=None, offset=0, limit=None):
+        where, params = ["name != ?"], [exclude if exclude is not None else ""]
+        if prefix:
+            where.append("substr(name, 1, ?) = ?")
+            params += [len(prefix), prefix]
+        if since is not None:
+            where.append("timestamp >= ?")
+            params.append(str(since))
+        condition = " AND ".join(where)
+        total = self.database.execute(f"SELECT COUNT(*) FROM devices WHERE {condition}", params)[0][0]
+        rows = self.database.execute(f"SELECT name, timestamp, ip_address, udp_port FROM devices WHERE {condition}"
+                                     " ORDER BY joined LIMIT ? OFFSET ?", params + [-1 if limit is None else limit, offset])
+        return total, [Device(*row) for row in rows]
+
+    def __len__(self):
+        return self.database.execute("SELECT COUNT(*) FROM devices")[0][0]
+
+    def close(self):
+        pass
@@ -0,0 +1,128 @@
+"""
+    Login lockout table
+    Python 3
+    coding: utf-8
+
+    Failed logins are counted per (username, source IP) across connections. Once a
+    key reaches max_failures it is blocked for duration seconds, and while it is
+    blocked every login attempt is turned away before the password is looked at.
+
+    Nothing sleeps or waits for a block to run out. Every entry carries the time it
+    can be forgotten, and a heap ordered by that time is trimmed on each call, so an
+    entry costs O(log n) to add and expire and the table only holds keys that failed
+    recently.
+"""
+import heapq, threading, time
+
+
+class Entry:
+    __slots__ = ["failures", "blocked_until", "forget_at"]
+
+    def __init__(self):
+        self.failures = 0
+        self.blocked_until = 0.0
+        self.forget_at = 0.0
+
+
+class LockoutTable:
+    def __init__(self, max_failures, duration=10.0, clock=time.monotonic):
+        self.max_failures = max_failures
+        # failures are forgotten once duration seconds pass without another one
+        self.duration = duration
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = {}
+        # (forget_at, key), an entry whose forget_at has moved on leaves a stale item behind
+        self.heap = []
+
+    def expire(self, now):
+        while self.heap and self.heap[0][0] <= now:
+            forget_at, key = heapq.heappop(self.heap)
+            entry = self.entries.get(key)
+            if entry is not None and entry.forget_at == forget_at:
+                del self.entries[key]
+
+    # seconds until key may try again, 0 if it is not blocked
+    def blocked(self, key):
+        now = self.clock()
+        with self.lock:
+            self.expire(now)
+            entry = self.entries.get(key)
+            if entry is None or entry.blocked_until <= now:
+                return 0
+            return entry.blocked_until - now
+
+    # count a failed attempt, returns True when it blocks the key
+    def failure(self, key):
+        now = self.clock()
+        with self.lock:
+            self.expire(now)
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = Entry()
+            entry.failures += 1
+            if entry.failures >= self.max_failures:
+                entry.failures = 0
+                entry.blocked_until = now + self.duration
+            entry.forget_at = now + self.duration
+            heapq.heappush(self.heap, (entry.forget_at, key))
+            return entry.blocked_until > now
+
+    def success(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SharedLockoutTable:
+    """
+        LockoutTable's interface on a shared.SharedDatabase, so a block set by one worker
+        process holds on all of them. Times are wall clock seconds since every process
+        reads them, and expired rows are deleted through an index on forget_at.
+    """
+
+    def __init__(self, database, max_failures, duration=10.0, clock=time.time):
+        self.database = database
+        self.max_failures = max_failures
+        self.duration = duration
+        self.clock = clock
+
+    def create(self):
+        def schema(db):
+            db.execute("DROP TABLE IF EXISTS lockouts")
+            db.execute("CREATE TABLE lockouts (name TEXT, ip TEXT, failures INTEGER, blocked_until REAL,"
+                       " forget_at REAL, PRIMARY KEY (name, ip))")
+            db.execute("CREATE INDEX lockouts_forget_at ON lockouts (forget_at)")
+        self.database.transaction(schema)
+
+    def blocked(self, key):
+        now = self.clock()
+        rows = self.database.execute("SELECT blocked_until FROM lockouts WHERE name = ? AND ip = ? AND forget_at > ?",
+                                     (key[0], key[1], now))
+        if not rows or rows[0][0] <= now:
+            return 0
+        return rows[0][0] - now
+
+    def failure(self, key):
+        now = self.clock()
+
+        def count(db):
+            db.execute("DELETE FROM lockouts WHERE forget_at <= ?", (now,))
+            row = db.execute("SELECT failures, blocked_until FROM lockouts WHERE name = ? AND ip = ?", key).fetchone()
+            failures, blocked_until = row if row is not None else (0, 0.0)
+            failures += 1
+            if failures >= self.max_failures:
+                failures = 0
+                blocked_until = now + self.duration
+            db.execute("INSERT OR REPLACE INTO lockouts VALUES (?, ?, ?, ?, ?)",
+                       (key[0], key[1], failures, blocked_until, now + self.duration))
+            return blocked_until > now
+        return self.database.transaction(count)
+
+    def success(self, key):
+        self.database.execute("DELETE FROM lockouts WHERE name = ? AND ip = ?", key)
+
+    def __len__(self):
+        return self.database.execute("SELECT COUNT(*) FROM lockouts WHERE forget_at > ?", (self.clock(),))[0][0]
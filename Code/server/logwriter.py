@@ -0,0 +1,195 @@
+"""
+    Background writer for the server's log files
+    Python 3
+    coding: utf-8
+
+    Request handlers call write(fileName, line) which only puts the line on a queue.
+    One thread owns every log file, collects queued lines and writes each file's batch
+    with a single write() once batch_size lines are waiting or flush_interval seconds
+    have passed. Since only that thread writes, lines never interleave or tear.
+
+    fsync policy: "none" leaves flushing to the OS, "batch" fsyncs after every batch,
+    "interval" fsyncs at most once per fsync_interval seconds.
+    Files listed in max_bytes are rotated to name.1, name.2, ... when they grow past
+    their limit; backups sets how many old files are kept.
+
+    With shared set, several processes (server workers) append to the same files,
+    each through its own LogWriter. Writing a batch to a rotated file, and rotating
+    it, then happen under an flock on name.lock, and a writer whose open file has
+    been rotated away by another process reopens the name before writing.
+"""
+import os, queue, threading, time
+from contextlib import nullcontext
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FSYNC_POLICIES = ["none", "batch", "interval"]
+
+
+class LogWriter(threading.Thread):
+    def __init__(self, flush_interval=0.05, batch_size=512, fsync="none", fsync_interval=1.0,
+                 max_bytes=None, backups=5, shared=False):
+        threading.Thread.__init__(self, name="log-writer", daemon=True)
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"unknown fsync policy {fsync}")
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes or {}
+        self.backups = backups
+        if shared and self.max_bytes and fcntl is None:
+            raise ValueError("rotating logs shared between processes needs fcntl")
+        self.shared = shared
+        self.queue = queue.SimpleQueue()
+        self.files = {}
+        # fileName -> open name.lock, when shared
+        self.locks = {}
+        self.last_fsync = time.monotonic()
+        self.closed = False
+
+    # called from request threads, never touches the disk
+    def write(self, fileName, line):
+        self.queue.put((fileName, line))
+
+    # block until every line queued before this call is on disk (in the OS at least)
+    def flush(self):
+        done = threading.Event()
+        self.queue.put((None, done))
+        done.wait()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.flush()
+            self.queue.put((None, None))
+            self.join()
+
+    def run(self):
+        pending = {}
+        waiting = 0
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                fileName, item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                fileName, item = None, False
+            if fileName is not None:
+                pending.setdefault(fileName, []).append(item)
+                waiting += 1
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if waiting < self.batch_size:
+                    continue
+            # a full batch, the flush interval ran out, or flush()/close() was called
+            self.write_batches(pending)
+            pending = {}
+            waiting = 0
+            deadline = None
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is None:
+                for f in list(self.files.values()) + list(self.locks.values()):
+                    f.close()
+                self.files = {}
+                self.locks = {}
+                return
+
+    def write_batches(self, pending):
+        for fileName, lines in pending.items():
+            data = "".join(lines).encode()
+            with self.rotation_lock(fileName):
+                f = self.open_file(fileName, len(data))
+                f.write(data)
+                f.flush()
+            if self.fsync == "batch":
+                os.fsync(f.fileno())
+        if self.fsync == "interval" and pending and time.monotonic() - self.last_fsync >= self.fsync_interval:
+            for f in self.files.values():
+                os.fsync(f.fileno())
+            self.last_fsync = time.monotonic()
+
+    # held while a shared file that rotates is checked, rotated and written
+    def rotation_lock(self, fileName):
+        if not self.shared or fileName not in self.max_bytes:
+            return nullcontext()
+        lock = self.locks.get(fileName)
+        if lock is None:
+            lock = self.locks[fileName] = open(fileName + ".lock", "ab")
+        return FileLock(lock)
+
+    def open_file(self, fileName, incoming):
+        f = self.files.get(fileName)
+        limit = self.max_bytes.get(fileName)
+        if f is not None and self.shared and limit and self.rotated_away(fileName, f):
+            f.close()
+            f = None
+        if f is None:
+            f = self.files[fileName] = open(fileName, "ab")
+        # other processes append too, so only the file itself knows its size
+        size = os.fstat(f.fileno()).st_size if self.shared else f.tell()
+        if limit and size > 0 and size + incoming > limit:
+            f.close()
+            self.rotate(fileName)
+            f = self.files[fileName] = open(fileName, "ab")
+        return f
+
+    @staticmethod
+    def rotated_away(fileName, f):
+        try:
+            return os.stat(fileName).st_ino != os.fstat(f.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    # name -> name.1 -> name.2 ... the oldest one past backups is dropped
+    def rotate(self, fileName):
+        for index in range(self.backups - 1, 0, -1):
+            older = f"{fileName}.{index}"
+            if os.path.exists(older):
+                os.replace(older, f"{fileName}.{index + 1}")
+        if self.backups > 0:
+            os.replace(fileName, f"{fileName}.1")
+        else:
+            os.remove(fileName)
+
+
+class FileLock:
+    """An exclusive flock on an open file for the duration of a with block."""
+
+    def __init__(self, f):
+        self.f = f
+
+    def __enter__(self):
+        fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+
+
+class DirectLogWriter:
+    """Same interface as LogWriter but writes on the calling thread, for comparison."""
+
+    def __init__(self, fsync="none"):
+        self.fsync = fsync
+        self.lock = threading.Lock()
+
+    def start(self):
+        pass
+
+    def write(self, fileName, line):
+        with self.lock:
+            with open(fileName, "a") as f:
+                f.write(line)
+                if self.fsync != "none":
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
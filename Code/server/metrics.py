@@ -0,0 +1,174 @@
+"""
+    Server metrics
+    Python 3
+    coding: utf-8
+
+    One Metrics object counts what the server does: commands and their latency,
+    bytes in and out, connections and logins. Recording is a lock and a few integer
+    additions, latencies go into log-spaced histogram buckets so memory stays fixed
+    however many commands are served.
+
+    The numbers are read with the STATS command (STATS json for JSON) or, when the
+    server runs with --metrics-port, from http://127.0.0.1:PORT/metrics.
+"""
+import json, math, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Histogram:
+    """Latencies in buckets SUB_BUCKETS per power of two wide (about 9%), in microseconds."""
+
+    SUB_BUCKETS = 8
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def record(self, seconds):
+        micros = max(seconds * 1e6, 1.0)
+        index = int(math.log2(micros) * self.SUB_BUCKETS)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    # upper edge of the bucket holding the pct-th percentile, in seconds
+    def percentile(self, pct):
+        if self.count == 0:
+            return 0.0
+        rank = math.ceil(self.count * pct / 100) or 1
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(2 ** ((index + 1) / self.SUB_BUCKETS) / 1e6, self.maximum)
+        return self.maximum
+
+    def summary(self):
+        return {"count": self.count,
+                "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+                "p50_ms": self.percentile(50) * 1000, "p95_ms": self.percentile(95) * 1000,
+                "p99_ms": self.percentile(99) * 1000, "max_ms": self.maximum * 1000}
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.latency = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.connections = 0
+        self.active_connections = 0
+        self.logins = 0
+        self.login_failures = 0
+        self.logins_blocked = 0
+        self.resumes = 0
+        self.resume_failures = 0
+        # SCS/DTE work turned away by a full process pool, given up after its timeout,
+        # or dropped because the client hung up first
+        self.heavy_busy = 0
+        self.heavy_timeouts = 0
+        self.heavy_cancelled = 0
+
+    def received(self, size):
+        with self.lock:
+            self.bytes_in += size
+
+    def sent(self, size):
+        with self.lock:
+            self.bytes_out += size
+
+    def connection_opened(self):
+        with self.lock:
+            self.connections += 1
+            self.active_connections += 1
+
+    def connection_closed(self):
+        with self.lock:
+            self.active_connections -= 1
+
+    def login(self, ok):
+        with self.lock:
+            if ok:
+                self.logins += 1
+            else:
+                self.login_failures += 1
+
+    # a login turned away by the lockout, the password was never checked
+    def login_blocked(self):
+        with self.lock:
+            self.logins_blocked += 1
+
+    # a RESUME with a live session token, or with an unknown or expired one
+    def resume(self, ok):
+        with self.lock:
+            if ok:
+                self.resumes += 1
+            else:
+                self.resume_failures += 1
+
+    def heavy(self, outcome):
+        with self.lock:
+            if outcome == "busy":
+                self.heavy_busy += 1
+            elif outcome == "timeout":
+                self.heavy_timeouts += 1
+            else:
+                self.heavy_cancelled += 1
+
+    def command(self, name, seconds):
+        with self.lock:
+            histogram = self.latency.get(name)
+            if histogram is None:
+                histogram = self.latency[name] = Histogram()
+            histogram.record(seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return {"uptime_s": time.time() - self.started,
+                    "bytes_in": self.bytes_in, "bytes_out": self.bytes_out,
+                    "connections": self.connections, "active_connections": self.active_connections,
+                    "logins": self.logins, "login_failures": self.login_failures,
+                    "logins_blocked": self.logins_blocked,
+                    "resumes": self.resumes, "resume_failures": self.resume_failures,
+                    "heavy_busy": self.heavy_busy, "heavy_timeouts": self.heavy_timeouts,
+                    "heavy_cancelled": self.heavy_cancelled,
+                    "commands": {name: h.summary() for name, h in sorted(self.latency.items())}}
+
+    # the snapshot as "key=value" lines, one line per command
+    def render(self):
+        snapshot = self.snapshot()
+        commands = snapshot.pop("commands")
+        lines = ["server: " + " ".join(f"{key}={round(value, 1)}" for key, value in snapshot.items())]
+        for name, summary in commands.items():
+            lines.append(f"{name}: " + " ".join(f"{key}={round(value, 2)}" for key, value in summary.items()))
+        return "\n".join(lines)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = json.dumps(self.server.metrics.snapshot(), indent=2).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # requests to the endpoint are not worth a log line each
+    def log_message(self, format, *args):
+        pass
+
+
+# serve metrics.snapshot() as JSON on a background thread, returns the HTTP server
+def serve_http(metrics, port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -1,311 +1,1012 @@
 """
     Sample code for Multi-Threaded Server
     Python 3
-    Usage: python3 TCPserver3.py localhost 12000
+    Usage: python3 server.py SERVER_PORT LOGIN_FAILED_ATTEMPTS [--mode thread|async]
     coding: utf-8
-    
+
     Author: Jaywoo Choi
 """
 from socket import *
 from threading import Thread
-import sys, select, os
+import sys, select, os, struct, json, signal, tempfile, time
+import argparse
+import logging
+import asyncio
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import aggregation
+import credentials
+import datafile
+import devices
+import lockout
+import logwriter
+import metrics
+import sessions
+import shared
+import storage
+import wirecodec
+import workpool
 
-# acquire server host and port from command line parameter
-if len(sys.argv) != 3:
-    print("\n===== Error usage, python3 TCPServer3.py SERVER_PORT LOGIN_FAILED_ATTEMPTS ======\n")
-    exit(0)
-serverHost = gethostbyname(gethostname())
-serverPort = int(sys.argv[1])
-num_of_chance_login = int(sys.argv[2])
-commands_array = ["UED", "SCS", "DTE", "AED", "OUT"]
-
-if num_of_chance_login > 6 or num_of_chance_login < 1:
-    print(f'Invalid number of allowed failed consecutive attempts: {num_of_chance_login}')
-    exit(0)
-    
-serverAddress = (serverHost, serverPort)
-
-# define socket for the server side and bind address
-serverSocket = socket(AF_INET, SOCK_STREAM)
-serverSocket.bind(serverAddress)
+commands_array = ["UED", "SCS", "DTE", "AED", "LST", "OUT", "STATS"]
+# uploaded data files are text, one sample per line, or packed little-endian int64
+DATA_SUFFIXES = {"txt": ".txt", "bin": datafile.BINARY_SUFFIX}
+# set from the command line in main()
+num_of_chance_login = 1
+stats_cache = aggregation.SummaryCache()
+credential_store = None
+# every log line goes through log_writer, replaced in main() by the configured writer
+log_writer = logwriter.DirectLogWriter()
+device_registry = devices.DeviceRegistry("edge-device-log.txt")
+# uploaded data files and their index, opened in main()
+file_storage = storage.Storage("data")
+# hashed passwords are checked here so slow hashes never hold up the event loop
+credential_pool = None
+# SCS parsing and DTE counting run in these processes, see workpool.py, None runs them in threads
+heavy_pool = None
+server_metrics = metrics.Metrics()
+# replaced in main() once the number of allowed attempts is known
+login_lockout = lockout.LockoutTable(1)
+# tokens handed out by "login session" for RESUME, None when --session-ttl is 0
+session_table = sessions.SessionTable()
+# codecs a client may ask for at login, and the level replies are compressed at (None: the codec's default)
+wire_codecs = wirecodec.available()
+compression_level = None
+# [recv]/[send] lines are DEBUG, connections and logins INFO, see main() for the sampling
+logger = logging.getLogger("server")
 
 """
-    Define multi-thread class for client
-    This class would be used to define the instance for each connection from each client
-    For example, client-1 makes a connection request to the server, the server will call
-    class (ClientThread) to define a thread for client-1, and when client-2 make a connection
-    request to the server, the server will call class (ClientThread) again and create a thread
-    for client-2. Each client will be runing in a separate therad, which is the multi-threading
+    Wire format
+    Every message is one frame: a 4-byte big-endian payload length followed by the
+    utf-8 payload. TCP is free to merge or split segments, so both sides buffer the
+    stream and only hand complete frames to the handlers. A command and all of its
+    arguments travel in a single frame, e.g. "SCS 1 SUM", and get a single reply.
+    On a connection that agreed on compression at login, the top bit of the length
+    marks a reply whose payload is compressed, see wirecodec.py.
 """
-class ClientThread(Thread):
-    def __init__(self, clientAddress, clientSocket):
-        Thread.__init__(self)
-        self.clientAddress = clientAddress
+FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+COMPRESSED_FRAME = 0x80000000
+RECV_SIZE = 65536
+# how often a request waiting on a pool checks whether its client is still there
+OFFLOAD_POLL = 0.1
+BUSY_REPLY = "busy, retry"
+TIMEOUT_REPLY = "request timed out"
+
+
+class ProtocolError(ConnectionError):
+    pass
+
+
+# with a codec, a payload of wirecodec.COMPRESS_MIN bytes or more goes out compressed if that makes it smaller
+def encode_frame(message, codec=None):
+    payload = message.encode()
+    if codec is not None and len(payload) >= wirecodec.COMPRESS_MIN:
+        packed = wirecodec.compress(codec, payload, compression_level)
+        if len(packed) < len(payload):
+            return FRAME_HEADER.pack(len(packed) | COMPRESSED_FRAME) + packed
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def check_frame_length(length):
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"frame of {length} bytes is larger than {MAX_FRAME_SIZE}")
+
+
+# pop the payload of one complete frame off the front of buffer, None if it has not all arrived yet
+def take_frame(buffer):
+    if len(buffer) < FRAME_HEADER.size:
+        return None
+    (length,) = FRAME_HEADER.unpack_from(buffer)
+    check_frame_length(length)
+    end = FRAME_HEADER.size + length
+    if len(buffer) < end:
+        return None
+    payload = bytes(buffer[FRAME_HEADER.size:end])
+    del buffer[:end]
+    return payload
+
+
+# a command frame's payload as text, the protocol is utf-8 throughout
+def decode_frame(payload):
+    try:
+        return payload.decode()
+    except UnicodeDecodeError:
+        raise ProtocolError("frame is not valid utf-8")
+
+
+"""
+    The handlers below are written once as coroutines and run on either transport.
+    BlockingConnection wraps a plain socket for the thread-per-connection server; its
+    methods never suspend, so a ClientThread can drive the coroutine to completion on
+    its own thread. StreamConnection wraps asyncio streams so the same handlers run on
+    a single event loop in async mode. recv() returns None once the client has gone.
+    codec is the compression agreed on at login, None until then.
+"""
+class BlockingConnection:
+    def __init__(self, clientSocket):
         self.clientSocket = clientSocket
-        self.clientAlive = False
-        
-        print("===== New connection created for: ", clientAddress)
+        self.buffer = bytearray()
+        self.codec = None
+
+    async def recv(self):
+        payload = await self.recv_bytes()
+        return None if payload is None else decode_frame(payload)
+
+    # one frame's payload as bytes, e.g. a piece of a compressed upload
+    async def recv_bytes(self):
+        while True:
+            payload = take_frame(self.buffer)
+            if payload is not None:
+                return payload
+            data = self.clientSocket.recv(RECV_SIZE)
+            if not data:
+                return None
+            server_metrics.received(len(data))
+            self.buffer.extend(data)
+
+    # raw bytes that follow a frame, e.g. an uploaded file, handed out as they arrive
+    async def recv_chunks(self, size):
+        if self.buffer and size > 0:
+            chunk = bytes(self.buffer[:size])
+            del self.buffer[:len(chunk)]
+            size -= len(chunk)
+            yield chunk
+        while size > 0:
+            data = self.clientSocket.recv(min(RECV_SIZE, size))
+            if not data:
+                raise ProtocolError("connection closed in the middle of a transfer")
+            server_metrics.received(len(data))
+            size -= len(data)
+            yield data
+
+    async def send(self, message):
+        frame = encode_frame(message, self.codec)
+        self.clientSocket.sendall(frame)
+        server_metrics.sent(len(frame))
+
+    # run slow file work inline, this thread only serves one client anyway,
+    # unless a bounded pool is given to cap how many of these run at once; the work
+    # is then cancelled after timeout seconds or as soon as the client hangs up
+    async def offload(self, func, *args, executor=None, timeout=None):
+        if executor is None:
+            return func(*args)
+        future = executor.submit(func, *args)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                return future.result(OFFLOAD_POLL)
+            except futures.TimeoutError:
+                pass
+            if self.disconnected():
+                future.cancel()
+                raise ConnectionError("client went away while its request was running")
+            if deadline is not None and time.monotonic() >= deadline:
+                future.cancel()
+                raise TimeoutError()
+
+    # peek without consuming, a pipelined next command must stay where recv() finds it
+    def disconnected(self):
+        readable, _, _ = select.select([self.clientSocket], [], [], 0)
+        if not readable:
+            return False
+        try:
+            return not self.clientSocket.recv(1, MSG_PEEK)
+        except ConnectionError:
+            return True
+
+    def close(self):
+        self.clientSocket.close()
+
+
+class StreamConnection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.codec = None
+
+    async def recv(self):
+        payload = await self.recv_bytes()
+        return None if payload is None else decode_frame(payload)
+
+    async def recv_bytes(self):
+        try:
+            header = await self.reader.readexactly(FRAME_HEADER.size)
+            (length,) = FRAME_HEADER.unpack(header)
+            check_frame_length(length)
+            payload = await self.reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            return None
+        server_metrics.received(FRAME_HEADER.size + length)
+        return payload
+
+    async def recv_chunks(self, size):
+        while size > 0:
+            data = await self.reader.read(min(RECV_SIZE, size))
+            if not data:
+                raise ProtocolError("connection closed in the middle of a transfer")
+            server_metrics.received(len(data))
+            size -= len(data)
+            yield data
+
+    async def send(self, message):
+        frame = encode_frame(message, self.codec)
+        self.writer.write(frame)
+        server_metrics.sent(len(frame))
+        await self.writer.drain()
+
+    # run slow file work on an executor (the default one unless given) so the loop keeps serving others,
+    # work on a given executor is cancelled after timeout seconds or once the client hangs up
+    async def offload(self, func, *args, executor=None, timeout=None):
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(executor, func, *args)
+        if executor is None:
+            return await future
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            done, _ = await asyncio.wait({future}, timeout=OFFLOAD_POLL)
+            if done:
+                return future.result()
+            if self.disconnected():
+                future.cancel()
+                raise ConnectionError("client went away while its request was running")
+            if deadline is not None and loop.time() >= deadline:
+                future.cancel()
+                raise TimeoutError()
+
+    # the transport keeps reading while a handler waits, so a hang up shows as EOF
+    def disconnected(self):
+        return self.reader.at_eof() or self.reader.exception() is not None
+
+    def close(self):
+        self.writer.close()
+
+
+# "login [session] [compress=codec,...]", returns (session, offered codecs) or None
+def parse_login_options(words):
+    session, offered = False, []
+    for word in words:
+        if word == "session":
+            session = True
+        elif word.startswith("compress="):
+            offered = word[len("compress="):].split(",")
+        else:
+            return None
+    return session, offered
+
+
+"""
+    AED replies with one frame of JSON lines: a header line, then one line per device
+
+        {"message":"There is/are other device(s) active","total":2,"offset":0,"next":null}
+        {"device":"supersensor","timestamp":"2022-09-30 10:31:13.123456","ip_address":"10.0.0.5","udp_port":"8000"}
+
+    "next" is the offset of the following page, or null on the last page.
+"""
+AED_PAGE_SIZE = 1000
+AED_MAX_PAGE_SIZE = 10000
+
+
+def parse_aed_query(args):
+    query = {"prefix": None, "since": None, "offset": 0, "limit": AED_PAGE_SIZE}
+    for arg in args:
+        key, sep, value = arg.partition("=")
+        if not sep or key not in query:
+            raise ValueError(f"unknown AED argument {arg}")
+        if key == "prefix":
+            query["prefix"] = value
+        elif key == "since":
+            # 2022-09-30T10:31:13, a space cannot be used because it separates arguments
+            query["since"] = datetime.fromisoformat(value)
+        elif not value.isdigit():
+            raise ValueError(f"{key} should be a non-negative integer")
+        else:
+            query[key] = int(value)
+    query["limit"] = max(1, min(query["limit"], AED_MAX_PAGE_SIZE))
+    return query
+
+
+def encode_aed_page(total, offset, page):
+    message = "There is/are other device(s) active" if total else "no other active edge devices"
+    following = offset + len(page)
+    header = {"message": message, "total": total, "offset": offset,
+              "next": following if following < total else None}
+    lines = [json.dumps(header, separators=(",", ":"))]
+    for device in page:
+        lines.append(json.dumps({"device": device.name, "timestamp": device.timestamp,
+                                 "ip_address": device.ip_address, "udp_port": device.udp_port},
+                                separators=(",", ":")))
+    return "\n".join(lines)
+
+
+class SampleFilter(logging.Filter):
+    """Passes one in every rate records below WARNING, and every warning and error."""
+
+    def __init__(self, rate):
+        logging.Filter.__init__(self)
+        self.rate = rate
+        self.seen = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        # a lost increment between threads only shifts which line is sampled
+        self.seen += 1
+        return self.seen % self.rate == 0
+
+
+# run a handler coroutine to completion on the calling thread
+def drive(coroutine):
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise RuntimeError("handler suspended outside of an event loop")
+
+
+"""
+    Define the session for each client
+    This class holds the state of one connection and the handlers for the login and
+    the UED, SCS, DTE, AED and OUT commands. All messages go through self.connection,
+    so the same session works under a ClientThread or on the asyncio event loop.
+"""
+class ClientSession:
+    def __init__(self, clientAddress, connection):
+        self.clientAddress = clientAddress
+        self.connection = connection
         self.clientAlive = True
-    
+        self.login_time = None
+        self.username = None
+        # the session token this connection logged in or resumed with, if any
+        self.token = None
+
+    async def recv(self):
+        return await self.connection.recv()
+
+    async def send(self, message):
+        await self.connection.send(message)
+
     # checking if username and password are in credential
-    def check_credential(self, data):
-        f = open("credentials.txt", "r")
-        for combination in f:
-            if combination.rstrip("\n") == data.rstrip("\n"):
-                return True
-        f.close()
-        return False
+    async def check_credential(self, data):
+        username, password = credentials.CredentialStore.split_login(data)
+        if username is None:
+            return False
+        if credential_store.is_expensive(username):
+            return await self.connection.offload(credential_store.verify, username, password,
+                                                 executor=credential_pool)
+        return credential_store.verify(username, password)
 
-    def process_login(self):
+    # returns True once the client has logged in
+    # failed attempts are counted in login_lockout per user name and source IP, across
+    # connections, and a blocked pair is turned away without checking the password;
+    # with session set the welcome carries a token for RESUME, and with codecs offered
+    # it names the one this connection compresses with from then on
+    async def process_login(self, session=False, offered=()):
         message = 'user credentials request'
-        global login_time
-        login_attempts = 1
-        print('[send] ' + message)
-        self.clientSocket.send(message.encode())
-        login_try_num = 0
+        logger.debug("[send] %s", message)
+        await self.send(message)
         while(1):
-            data = self.clientSocket.recv(1024).decode()
-            if login_attempts == num_of_chance_login and not self.check_credential(data):
+            data = await self.recv()
+            if data is None:
+                return False
+            key = (data.split(' ')[0], self.clientAddress[0])
+            if login_lockout.blocked(key):
+                server_metrics.login_blocked()
+                await self.send("block")
+                return False
+            valid = await self.check_credential(data)
+            server_metrics.login(valid)
+            if not valid and login_lockout.failure(key):
+                logger.info("%s from %s is blocked", key[0], key[1])
                 msg = "block"
-                self.clientSocket.send(msg.encode())
-                break
-            if not self.check_credential(data):
-                print("Invalid login")
-                login_attempts = login_attempts + 1
+                await self.send(msg)
+                return False
+            if not valid:
+                logger.info("invalid login from %s", self.clientAddress)
                 msg = 'Invalid'
-                self.clientSocket.send(msg.encode())
+                await self.send(msg)
             else:
-                print("Welcome")
+                login_lockout.success(key)
                 msg = 'Welcome'
-                login_time = datetime.now()
-                print(f'login time: {login_time}')
-                self.clientSocket.send(msg.encode())    
-                break  
-        
-    # open and read the cse_edge_device_log.txt and append the login log
-    def edge_device_log(self):
-            line = 0
-            data = self.clientSocket.recv(1024).decode()
-            with open("edge-device-log.txt", "r") as fp:
-                line = len(fp.readlines()) + 1
-            EDLOG = str(line) + "; " + str(login_time) + " " + data
-            f = open("edge-device-log.txt", "a")
-            f.write(EDLOG)
-            f.write("\n")
-            f.close()
-    
-    # calculate SUM or AVERAGE or MAX or MIN
-    def calculate(self, operation, file):
-        f = open(file + ".txt", "r")
-        lines = f.read().splitlines()
-        nums = []
-        sum_data = 0
-        avg_data = 0
-        
-        for line in lines:
-            nums.append(line)
-        
-        max_data = nums[0]
-        min_data = nums[0]
-        
-        for a in range(0, len(nums)):
-            sum_data += int(nums[a])
-            avg_data = sum_data / len(nums)
-            
-        for b in range(0, len(nums)):
-            if b > int(max_data):
-                max_data = b
-        
-        for c in range(0, len(nums)):
-            if c < int(min_data):
-                min_data = b
-        
-        if operation == "SUM":
-            return sum_data
-        elif operation == "AVERAGE":
-            return avg_data
-        elif operation == "MAX":
-            return max_data
-        elif operation == "MIN":
-            return min_data
-        
-    def commands(self, command):
+                self.username = data.split(' ')[0]
+                self.login_time = datetime.now()
+                logger.info("%s logged in at %s", self.username, self.login_time)
+                if session and session_table is not None:
+                    # the address is filled in once the device reports it
+                    self.token = session_table.issue(self.username, "", "")
+                    msg += f" {self.token}"
+                codec = wirecodec.choose(offered, wire_codecs)
+                if codec is not None:
+                    msg += f" compress={codec}"
+                await self.send(msg)
+                self.connection.codec = codec
+                return True
+
+    # register the device with the IP address and UDP port it reports after logging in
+    async def edge_device_log(self):
+        data = await self.recv()
+        if data is None:
+            return
+        fields = data.split(' ')
+        if len(fields) != 3:
+            logger.warning("bad edge device log message: %s", data)
+            return
+        seq = device_registry.register(self.username, self.login_time, fields[1], fields[2])
+        logger.info("%s is active edge device %s", self.username, seq)
+        if self.token is not None:
+            session_table.put(self.token, sessions.Session(self.username, fields[1], fields[2]))
+
+    # RESUME token ip udp_port [compress=codec,...]: log in again in one round trip with
+    # the token of an earlier "login session", replies "Welcome token" or "session expired"
+    async def resume_session(self, args):
+        session = None
+        options = parse_login_options(args[3:])
+        if len(args) >= 3 and options is not None and not options[0] and session_table is not None:
+            session = session_table.resume(args[0])
+        server_metrics.resume(session is not None)
+        if session is None:
+            await self.send("session expired")
+            return
+        self.username = session.username
+        self.login_time = datetime.now()
+        self.token = args[0]
+        address = (args[1], args[2])
+        # the registration made at login is kept, unless the device moved or logged out meanwhile
+        device = device_registry.get(self.username)
+        if device is None or (device.ip_address, device.udp_port) != address:
+            device_registry.register(self.username, self.login_time, *address)
+        if (session.ip_address, session.udp_port) != address:
+            session_table.put(self.token, sessions.Session(self.username, *address))
+        logger.info("%s resumed its session from %s", self.username, self.clientAddress)
+        msg = f"Welcome {self.token}"
+        codec = wirecodec.choose(options[1], wire_codecs)
+        if codec is not None:
+            msg += f" compress={codec}"
+        await self.send(msg)
+        self.connection.codec = codec
+
+    # write an upload to disk as it arrives, counting the data samples and, when
+    # stats_cache is on, summarizing them on the way, so SCS never has to read it again;
+    # the file only appears under its real name once every byte is in.
+    # Returns the number of samples and the Summary, None if it is off or the data does not parse
+    async def receive_file(self, fileName, size):
+        binary = datafile.is_binary(fileName)
+        builder = aggregation.SummaryBuilder(binary) if stats_cache.capacity > 0 else None
+        records = 0
+        last = b"\n"
+        # a temporary file of its own, so concurrent uploads of the same fileID do not share one
+        fd, partName = tempfile.mkstemp(dir=os.path.dirname(fileName) or ".",
+                                        prefix=os.path.basename(fileName) + ".", suffix=".part")
+        try:
+            with open(fd, "wb") as f:
+                async for chunk in self.upload_chunks(size):
+                    f.write(chunk)
+                    if builder is not None:
+                        builder.feed(chunk)
+                    if not binary:
+                        records += chunk.count(b"\n")
+                        last = chunk[-1:]
+        except BaseException:
+            storage.Storage.delete_file(partName)
+            raise
+        os.replace(partName, fileName)
+        summary = builder.result() if builder is not None else None
+        if binary:
+            return size // datafile.SAMPLE_SIZE, summary
+        # the last sample may not end with a newline
+        if last != b"\n":
+            records += 1
+        return records, summary
+
+    # an upload's bytes as they arrive: raw, or on a compressed connection a run of frames
+    # of compressed bytes, ended by an empty frame, that must come to exactly size bytes
+    async def upload_chunks(self, size):
+        if self.connection.codec is None:
+            async for chunk in self.connection.recv_chunks(size):
+                yield chunk
+            return
+        decompressor = wirecodec.Decompressor(self.connection.codec)
+        received = 0
+        while True:
+            frame = await self.connection.recv_bytes()
+            if frame is None:
+                raise ProtocolError("connection closed in the middle of a transfer")
+            if not frame:
+                break
+            try:
+                for piece in decompressor.feed(frame):
+                    received += len(piece)
+                    if received > size:
+                        raise ProtocolError(f"upload is larger than the {size} bytes declared")
+                    yield piece
+            except wirecodec.CodecError as e:
+                raise ProtocolError(str(e))
+        if received != size:
+            raise ProtocolError(f"upload is {received} bytes, {size} were declared")
+
+    # run CPU-heavy file work in heavy_pool, raises workpool.Busy when it is full and
+    # TimeoutError when the result does not come back in time
+    async def heavy(self, func, *args):
+        if heavy_pool is None:
+            return await self.connection.offload(func, *args)
+        try:
+            return await self.connection.offload(func, *args, executor=heavy_pool, timeout=heavy_pool.timeout)
+        except workpool.Busy:
+            server_metrics.heavy("busy")
+            raise
+        except TimeoutError:
+            server_metrics.heavy("timeout")
+            raise
+        except ConnectionError:
+            server_metrics.heavy("cancelled")
+            raise
+
+    # the file's Summary, read in the pool and kept in stats_cache here,
+    # with the signature taken before the read
+    async def summarize(self, fileName):
+        signature = stats_cache.signature(fileName)
+        try:
+            summary = await self.heavy(aggregation.summarize_file, fileName)
+        except (ValueError, OverflowError):
+            stats_cache.evict(fileName)
+            raise
+        stats_cache.put(fileName, signature, summary)
+        return summary
+
+    # calculate SUM, AVERAGE, MAX, MIN, COUNT, STDDEV or a percentile such as P95,
+    # SCS has already looked in stats_cache so this always reads the file
+    async def calculate(self, operation, fileName):
+        if aggregation.percentile_of(operation) is not None:
+            return await self.heavy(aggregation.compute, fileName, operation)
+        summary = await self.summarize(fileName)
+        return summary.result(operation)
+
+    # every command arrives as one frame "COMMAND arg1 arg2 ..." and gets one reply
+    async def commands(self, command, args):
+        start = time.perf_counter()
+        logger.debug("[recv] %s %s", command, args)
         if command == "UED":
-            print("[recv] UED")
-            message = 'UED'
-            print("[send] " + message)
-            self.clientSocket.send(message.encode())
-            log_username = self.clientSocket.recv(1024).decode()
-            msg = f"username is {log_username}"
-            self.clientSocket.send(msg.encode())
-            log_format = self.clientSocket.recv(1024).decode()
-            f = open("upload-log.txt", "a")
+            # UED fileID size [txt|bin], followed by exactly size bytes of file content
+            if len(args) not in (2, 3) or not args[0].isdigit() or not args[1].isdigit() \
+                    or (len(args) == 3 and args[2] not in DATA_SUFFIXES):
+                # without a size there is no telling where the file ends, so drop the client
+                raise ProtocolError("UED needs fileID, size and optionally the format")
+            fileId = args[0]
+            suffix = DATA_SUFFIXES[args[2] if len(args) == 3 else "txt"]
+            fileName = file_storage.upload_path(self.username, fileId, suffix)
+            dataAmount, summary = await self.receive_file(fileName, int(args[1]))
+            # a fileID holds one file, the storage drops the copy in the other format if there is one
+            old = file_storage.add(self.username, fileId, fileName, int(args[1]), dataAmount)
+            if old is not None and old.path != fileName:
+                stats_cache.evict(old.path)
+            if summary is not None:
+                stats_cache.put(fileName, stats_cache.signature(fileName), summary)
+            else:
+                stats_cache.evict(fileName)
             log_time = str(datetime.now())
-            log = log_username + log_time + log_format
-            f.write(log + "\n")
-            f.close()
-            msg = "successfully moved to server"
-            self.clientSocket.send(msg.encode())
-            
+            log = f"{self.username}; {log_time}; {fileId}; {dataAmount}"
+            log_writer.write("upload-log.txt", log + "\n")
+            msg = "successfully uploaded to server"
+
         elif command == "SCS":
-            print("[recv] SCS")
-            message = 'SCS'
-            print("[send] " + message)
-            self.clientSocket.send(message.encode())
-            operation = self.clientSocket.recv(1024).decode()
-            file = self.clientSocket.recv(1024).decode() 
-            fileName = f'{file}.txt'
-            if not os.path.exists(fileName):
-                msg = 'file does not exist'
-                print(msg)
+            # SCS fileID computationOperation
+            if len(args) != 2 or not args[0].isdigit():
+                msg = "fileID is missing or fileID should be an integer"
+            elif not aggregation.valid_operation(args[1]):
+                msg = "wrong operation input"
             else:
-                result = self.calculate(operation, file)
-                msg = f'result of {operation} in file {file}.txt is {result}'
-            self.clientSocket.send(msg.encode())
-            
+                operation = args[1]
+                record = file_storage.lookup(self.username, args[0])
+                if record is None:
+                    msg = 'file does not exist'
+                else:
+                    fileName = record.path
+                    name = os.path.basename(fileName)
+                    # summary statistics of an unchanged file come straight from the cache
+                    summary = None
+                    if operation in aggregation.SUMMARY_OPERATIONS:
+                        summary = stats_cache.get(fileName)
+                    try:
+                        if summary is not None:
+                            result = summary.result(operation)
+                        else:
+                            result = await self.calculate(operation, fileName)
+                    except workpool.Busy:
+                        msg = BUSY_REPLY
+                    except TimeoutError:
+                        msg = TIMEOUT_REPLY
+                    except FileNotFoundError:
+                        # removed behind the server's back, or by a DTE that got in first
+                        msg = 'file does not exist'
+                    except ValueError:
+                        msg = f'file {name} does not hold integer data samples'
+                    except OverflowError:
+                        # samples too large for the result to be a float
+                        msg = f'{operation} of file {name} is out of range'
+                    else:
+                        if result is None:
+                            msg = f'file {name} has no data samples'
+                        else:
+                            msg = f'result of {operation} in file {name} is {result}'
+
         elif command == "DTE":
-            print("[recv] DTE")
-            message = 'DTE'
-            print("[send] " + message)
-            self.clientSocket.send(message.encode())
-            file = self.clientSocket.recv(1024).decode()
-            fileName = f'{file}.txt'
-            
-            # check if the file exists
-            if not os.path.exists(fileName):
-                msg = 'file does not exist'
+            # DTE fileID
+            if len(args) != 1 or not args[0].isdigit():
+                msg = "fileID is missing or fileID should be an integer"
             else:
-                msg = f"file name is {file}.txt"
-                self.clientSocket.send(msg.encode())
-                log_username = self.clientSocket.recv(1024).decode()
-                msg = f"log info {log_username}"
-                self.clientSocket.send(msg.encode())
-                fileId = self.clientSocket.recv(1024).decode()
-                
-                # Data amount in the file
-                f = open(file + ".txt", "r")
-                lines = f.read().splitlines()
-                nums = []
-                for line in lines:
-                    nums.append(line) 
-                    dataAmount = len(nums)
-                
-                # delete the file
-                os.remove(file + ".txt")
-                time_deleted = datetime.now()
-                msg = "File removed"
-                f = open("deletion-log.txt", "a")
-                f.write(log_username + str(time_deleted) + "; " + fileId + "; " + str(dataAmount) + "\n")
-                f.close()
-                msg = "File removed"
-                print(msg)
-            self.clientSocket.send(msg.encode())
-            
+                fileId = args[0]
+                record = file_storage.lookup(self.username, fileId)
+
+                # check if the file exists
+                if record is None:
+                    msg = 'file does not exist'
+                else:
+                    # Data amount in the file, counted at upload except for files found at start up
+                    dataAmount = record.records
+                    msg = None
+                    if dataAmount is None:
+                        try:
+                            dataAmount = await self.heavy(datafile.count_samples, record.path)
+                        except FileNotFoundError:
+                            dataAmount = 0
+                        except workpool.Busy:
+                            msg = BUSY_REPLY
+                        except TimeoutError:
+                            msg = TIMEOUT_REPLY
+
+                    # delete the file, unless it could not be counted yet and the client has to retry
+                    if msg is None:
+                        file_storage.remove(self.username, fileId)
+                        stats_cache.evict(record.path)
+                        time_deleted = datetime.now()
+                        log_writer.write("deletion-log.txt", f"{self.username}; {time_deleted}; {fileId}; {dataAmount}\n")
+                        msg = "File removed"
+
         elif command == "AED":
-            print("[recv] AED")
-            message = 'AED'
-            print("[send]" + message)
-            self.clientSocket.send(message.encode())
-            username = self.clientSocket.recv(1024).decode()
-            devices = []
-            timestamps = []
-            ip_adresses = []
-            UDP_ports = []
-            msg = "no other active edge devices"
-            with open("edge-device-log.txt", "r") as f:
-                lines = f.readlines()
-                for line in lines:
-                    data = line.split(' ')
-                    timestamp = data[1] + ' ' + data[2]
-                    ip_address = data[4]
-                    UDP_port = data[5]
-                    if data[3] != username:
-                        devices.append(data[3])
-                        timestamps.append(timestamp)
-                        ip_adresses.append(ip_address)
-                        UDP_ports.append(UDP_port)
-                        msg = "There is/are other device(s) active"
-            # record the active edge devices info in
-            # the file called other_active_devices.txt
-            # and the client simply reads the file
-            with open("other_active_devices.txt", "w") as f:
-                for x in range(len(devices)):
-                    f.write(f"device: {devices[x]} / timestamp: {timestamps[x]} / ip_address: {ip_adresses[x]} / UDP_port: {UDP_ports[x]}\n ")
-            self.clientSocket.send(msg.encode())
-            
+            # AED [prefix=NAME] [since=TIMESTAMP] [offset=N] [limit=N]
+            try:
+                query = parse_aed_query(args)
+            except ValueError as e:
+                msg = json.dumps({"error": str(e)})
+            else:
+                total, page = device_registry.query(exclude=self.username, **query)
+                msg = encode_aed_page(total, query["offset"], page)
+
+        elif command == "LST":
+            # LST: the device's own uploads, JSON lines like AED's reply
+            files = file_storage.list(self.username)
+            lines = [json.dumps({"message": f"{len(files)} file(s) uploaded", "total": len(files)},
+                                separators=(",", ":"))]
+            for record in files:
+                lines.append(json.dumps({"fileID": record.file_id, "name": os.path.basename(record.path),
+                                         "size": record.size, "records": record.records,
+                                         "uploaded": record.uploaded}, separators=(",", ":")))
+            msg = "\n".join(lines)
+
         elif command == "OUT":
-            print("[recv] OUT")
-            message = 'OUT'
-            print("[send] " + message)
-            self.clientSocket.send(message.encode())
-            username = self.clientSocket.recv(1024).decode()
-            with open("edge-device-log.txt", "r") as f:
-                lines = f.readlines()
-            with open("edge-device-log.txt", "w") as f:
-                i = 1
-                for line in lines:
-                    username_in_log = line.split(' ')
-                    if username_in_log[3] != username:
-                        # replace the first word which is
-                        # the sequnce number to new sequence number
-                        line = line.replace(line[:1], str(i))
-                        f.write(line)
-                        i += 1
-                f.close()
+            device_registry.remove(self.username)
+            if self.token is not None:
+                session_table.revoke(self.token)
+                self.token = None
             msg = "removed log"
-            self.clientSocket.send(msg.encode())
-            
-    def run(self):
+
+        elif command == "STATS":
+            # STATS [json]
+            counters = stats_cache.counters()
+            pool = heavy_pool.counters() if heavy_pool is not None else None
+            if args == ["json"]:
+                msg = json.dumps(dict(server_metrics.snapshot(), stats_cache=counters, heavy_pool=pool))
+            else:
+                msg = "stats cache: " + " ".join(f"{key}={value}" for key, value in counters.items())
+                if pool is not None:
+                    msg += "\nheavy pool: " + " ".join(f"{key}={value}" for key, value in pool.items())
+                msg += "\n" + server_metrics.render()
+        logger.debug("[send] %s", msg)
+        await self.send(msg)
+        server_metrics.command(command, time.perf_counter() - start)
+
+    async def serve(self):
         message = ''
-        
+
         while self.clientAlive:
-            # use recv() to receive message from the client
-            data = self.clientSocket.recv(1024)
-            message = data.decode()
-            
-            # if the message from client is empty, the client would be off-line then set the client as offline (alive=Flase)
-            if message == '':
+            # receive message from the client
+            message = await self.recv()
+
+            # if there is no message the client would be off-line then set the client as offline (alive=Flase)
+            if message is None:
                 self.clientAlive = False
-                print("===== the user disconnected - ", clientAddress)
+                logger.info("%s disconnected", self.clientAddress)
                 break
-            
+
             # handle message from the client
-            if message == 'login':
-                print("[recv] New login request")
-                self.process_login()
-                self.edge_device_log()
+            words = message.split()
+            if words and words[0] == 'login' and parse_login_options(words[1:]) is not None:
+                logger.debug("[recv] login request")
+                session, offered = parse_login_options(words[1:])
+                if await self.process_login(session, offered):
+                    await self.edge_device_log()
+            elif words and words[0] == "RESUME":
+                logger.debug("[recv] resume request")
+                await self.resume_session(words[1:])
             elif message == 'download':
-                print("[recv] Download request")
+                logger.debug("[recv] download request")
                 message = 'download filename'
-                print("[send] " + message)
-                self.clientSocket.send(message.encode())
-            elif message in commands_array:
-                self.commands(message)
+                await self.send(message)
+            elif words and words[0] in commands_array:
+                if self.username is None:
+                    await self.send("please login first")
+                else:
+                    await self.commands(words[0], words[1:])
             else:
-                print("[recv] " + message)
-                print("[send] Cannot understand this message")
+                logger.debug("[recv] unknown message %r", message)
                 message = 'Cannot understand this message'
-                self.clientSocket.send(message.encode())
-    
+                await self.send(message)
+
     """
         You can create more customized APIs here, e.g., logic for processing user authentication
         Each api can be used to handle one specific function, for example:
-        def process_login(self):
+        async def process_login(self):
             message = 'user credentials request'
-            self.clientSocket.send(message.encode())
+            await self.send(message)
     """
 
-        
+
+"""
+    Define multi-thread class for client
+    This class would be used to define the instance for each connection from each client
+    For example, client-1 makes a connection request to the server, the server will call
+    class (ClientThread) to define a thread for client-1, and when client-2 make a connection
+    request to the server, the server will call class (ClientThread) again and create a thread
+    for client-2. Each client will be runing in a separate therad, which is the multi-threading
+"""
+class ClientThread(Thread):
+    def __init__(self, clientAddress, clientSocket):
+        # daemon threads let the server shut down while clients are still connected
+        Thread.__init__(self, daemon=True)
+        self.clientAddress = clientAddress
+        self.clientSocket = clientSocket
+        self.session = ClientSession(clientAddress, BlockingConnection(clientSocket))
+
+    def run(self):
+        logger.info("new connection from %s", self.clientAddress)
+        server_metrics.connection_opened()
+        try:
+            drive(self.session.serve())
+        except ConnectionError:
+            logger.info("%s disconnected", self.clientAddress)
+        finally:
+            server_metrics.connection_closed()
+            self.session.connection.close()
+
+
+def run_threaded_server(serverAddress, backlog, reuse_port=False):
+    # define socket for the server side and bind address
+    serverSocket = socket(AF_INET, SOCK_STREAM)
+    serverSocket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    if reuse_port:
+        # every worker binds the same port and the kernel spreads new connections between them
+        serverSocket.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+    serverSocket.bind(serverAddress)
+    serverSocket.listen(backlog)
+    while True:
+        clientSockt, clientAddress = serverSocket.accept()
+        clientThread = ClientThread(clientAddress, clientSockt)
+        clientThread.start()
+
+
+# every connection is a task on one event loop instead of an OS thread
+async def handle_async_client(reader, writer):
+    clientAddress = writer.get_extra_info('peername')
+    logger.info("new connection from %s", clientAddress)
+    server_metrics.connection_opened()
+    session = ClientSession(clientAddress, StreamConnection(reader, writer))
+    try:
+        await session.serve()
+    except ConnectionError:
+        logger.info("%s disconnected", clientAddress)
+    finally:
+        server_metrics.connection_closed()
+        session.connection.close()
+
+
+async def run_async_server(serverAddress, backlog, reuse_port=False):
+    server = await asyncio.start_server(handle_async_client, serverAddress[0], serverAddress[1],
+                                        backlog=backlog, reuse_address=True, reuse_port=reuse_port)
+    # SIGTERM ends serve_forever() from the loop, rather than raising SystemExit in whichever
+    # connection's task happens to be running, which asyncio reports as an unhandled exception
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.close)
+    async with server:
+        try:
+            await server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+
+def main():
+    global num_of_chance_login, credential_store, device_registry, login_lockout, session_table, \
+        wire_codecs, compression_level
+    parser = argparse.ArgumentParser(usage="python3 server.py SERVER_PORT LOGIN_FAILED_ATTEMPTS [options]")
+    parser.add_argument("port", type=int)
+    parser.add_argument("attempts", type=int)
+    parser.add_argument("--mode", choices=["thread", "async"], default="thread",
+                        help="thread: one OS thread per connection, async: one asyncio event loop")
+    parser.add_argument("--host", default=None, help="address to bind, defaults to this host's IP")
+    parser.add_argument("--backlog", type=int, default=1024, help="listen() backlog")
+    parser.add_argument("--credential-workers", type=int, default=4,
+                        help="threads that check hashed passwords")
+    parser.add_argument("--log-writer", choices=["background", "direct"], default="background",
+                        help="background: batch log lines on a writer thread, direct: write on the request thread")
+    parser.add_argument("--log-flush-ms", type=int, default=50, help="longest a log line waits in the batch")
+    parser.add_argument("--log-batch", type=int, default=512, help="lines that trigger an early flush")
+    parser.add_argument("--log-fsync", choices=logwriter.FSYNC_POLICIES, default="none")
+    parser.add_argument("--log-max-bytes", type=int, default=64 * 1024 * 1024,
+                        help="rotate upload-log.txt and deletion-log.txt past this size, 0 never rotates")
+    parser.add_argument("--log-backups", type=int, default=5, help="rotated log files to keep")
+    parser.add_argument("--stats-cache-size", type=int, default=10000,
+                        help="number of files whose SCS summary is kept in memory, 0 disables the cache")
+    parser.add_argument("--storage-dir", default="data", help="directory the uploaded data files are kept in")
+    parser.add_argument("--storage-index", default=None,
+                        help="SQLite file to keep the file index in, by default it is rebuilt from --storage-dir at start up")
+    parser.add_argument("--lockout-seconds", type=float, default=10,
+                        help="how long a user name and IP stay blocked after too many failed logins")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="INFO",
+                        help="DEBUG also logs every message received and sent")
+    parser.add_argument("--log-sample", type=int, default=1,
+                        help="log only 1 in N DEBUG and INFO lines, warnings and errors are always logged")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="serve the metrics as JSON on http://127.0.0.1:PORT/metrics, 0 disables it")
+    parser.add_argument("--session-ttl", type=float, default=300,
+                        help="seconds a session token from \"login session\" stays good for RESUME, 0 disables tokens")
+    parser.add_argument("--compression", default=",".join(wirecodec.available()),
+                        help="codecs clients may ask for at login, comma separated, none disables compression")
+    parser.add_argument("--compression-level", type=int, default=None,
+                        help="level replies are compressed at, by default the codec's own")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="server processes sharing the port through SO_REUSEPORT")
+    parser.add_argument("--shared-state", default="shared-state.db",
+                        help="SQLite file the workers keep active devices, lockouts and the file index in")
+    parser.add_argument("--heavy-processes", type=int, default=None,
+                        help="processes per server process that parse files for SCS and count them for DTE,"
+                             " 0 runs that work on threads, by default the cores divided by --workers")
+    parser.add_argument("--heavy-queue", type=int, default=64,
+                        help="SCS/DTE requests that may wait for a process before clients are told to retry")
+    parser.add_argument("--heavy-timeout", type=float, default=30,
+                        help="seconds an SCS/DTE request may take before it is given up")
+    # acquire server port and login attempts from command line parameter
+    args = parser.parse_args()
+    handler = logging.StreamHandler()
+    if args.workers > 1:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(process)d] %(message)s"))
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    if args.log_sample > 1:
+        handler.addFilter(SampleFilter(args.log_sample))
+    logger.addHandler(handler)
+    logger.setLevel(args.log_level)
+    num_of_chance_login = args.attempts
+    login_lockout = lockout.LockoutTable(num_of_chance_login, args.lockout_seconds)
+    session_table = sessions.SessionTable(args.session_ttl) if args.session_ttl > 0 else None
+    wire_codecs = [name for name in args.compression.split(",") if name in wirecodec.available()]
+    compression_level = args.compression_level
+    stats_cache.capacity = args.stats_cache_size
+    credential_store = credentials.CredentialStore("credentials.txt")
+    if num_of_chance_login > 6 or num_of_chance_login < 1:
+        logger.error("Invalid number of allowed failed consecutive attempts: %s", num_of_chance_login)
+        exit(0)
+
+    file_storage.root = args.storage_dir
+    file_storage.index_name = args.storage_index
+    if args.workers > 1:
+        # the shared state only lives as long as one run, unless the file index has its own file
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(args.shared_state + suffix):
+                os.remove(args.shared_state + suffix)
+        shared_state = shared.SharedDatabase(args.shared_state)
+        file_storage.index_name = args.storage_index or args.shared_state
+        file_storage.shared = True
+    file_storage.open()
+    moved = file_storage.migrate(".")
+    if moved:
+        logger.info("moved %s data files into %s", moved, args.storage_dir)
+    device_registry.replay()
+    if args.workers > 1:
+        registry = devices.SharedDeviceRegistry(shared_state, device_registry.journalName)
+        registry.load(device_registry.snapshot())
+        device_registry = registry
+        login_lockout = lockout.SharedLockoutTable(shared_state, num_of_chance_login, args.lockout_seconds)
+        login_lockout.create()
+        if session_table is not None:
+            session_table = sessions.SharedSessionTable(shared_state, args.session_ttl)
+            session_table.create()
+        # no SQLite connection may be carried across fork()
+        shared_state.close()
+        file_storage.db.close()
+
+    serverHost = args.host if args.host else gethostbyname(gethostname())
+    serverAddress = (serverHost, args.port)
+
+    logger.info("server is running on %s:%s in %s mode with %s worker(s), waiting for connection requests from clients",
+             serverHost, args.port, args.mode, args.workers)
+    if args.workers > 1:
+        run_workers(args, serverAddress)
+    else:
+        serve(args, serverAddress)
+
+
+# the part of start up every process serving connections does for itself
+def serve(args, serverAddress, worker=None):
+    global credential_pool, log_writer, heavy_pool
+    if args.log_writer == "background":
+        # workers append to the same files, so they take turns rotating them, see logwriter.py
+        rotate = {name: args.log_max_bytes for name in ["upload-log.txt", "deletion-log.txt"]} \
+            if args.log_max_bytes else {}
+        log_writer = logwriter.LogWriter(flush_interval=args.log_flush_ms / 1000, batch_size=args.log_batch,
+                                         fsync=args.log_fsync, max_bytes=rotate, backups=args.log_backups,
+                                         shared=worker is not None)
+    else:
+        log_writer = logwriter.DirectLogWriter(fsync=args.log_fsync)
+    device_registry.writer = log_writer
+    log_writer.start()
+    credential_pool = ThreadPoolExecutor(max_workers=args.credential_workers,
+                                         thread_name_prefix="credentials")
+    heavy_processes = args.heavy_processes
+    if heavy_processes is None:
+        heavy_processes = max(1, (os.cpu_count() or 1) // args.workers)
+    if heavy_processes > 0:
+        heavy_pool = workpool.WorkPool(heavy_processes, args.heavy_queue, args.heavy_timeout)
+        heavy_pool.start()
+    if args.metrics_port:
+        # worker i serves its own metrics on --metrics-port + i
+        metrics.serve_http(server_metrics, args.metrics_port + (worker or 0))
+
+    # SIGTERM shuts down like Ctrl-C so the queued log lines are still written
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        if args.mode == "async":
+            asyncio.run(run_async_server(serverAddress, args.backlog, reuse_port=worker is not None))
+        else:
+            run_threaded_server(serverAddress, args.backlog, reuse_port=worker is not None)
+    finally:
+        if heavy_pool is not None:
+            heavy_pool.close()
+        log_writer.close()
+        file_storage.close()
+
+
+# fork args.workers processes that each serve() on the same port, then wait for them
+def run_workers(args, serverAddress):
+    children = []
+    for worker in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                serve(args, serverAddress, worker)
+            except (SystemExit, KeyboardInterrupt):
+                pass
+            except BaseException:
+                logger.exception("worker %s failed", worker)
+                status = 1
+            os._exit(status)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while children:
+        pid, status = os.wait()
+        children.remove(pid)
+        if status:
+            logger.warning("worker process %s exited with status %s", pid, status)
 
 
-print("\n===== Server is running =====")
-print("IP address is " + serverHost)
-print("===== Waiting for connection request from clients...=====")
 
 
-while True:
-    serverSocket.listen()
-    clientSockt, clientAddress = serverSocket.accept()
-    clientThread = ClientThread(clientAddress, clientSockt)
-    clientThread.start()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+    Session tokens for resuming a login
+    Python 3
+    coding: utf-8
+
+    A client that logs in with "login session" is sent "Welcome TOKEN". After a
+    dropped connection it can open a new one and send "RESUME TOKEN IP UDP_PORT" as its
+    first frame: one round trip, no password check, and the device registration made
+    at login is kept as long as its address has not changed.
+
+    A token is good for ttl seconds after it was issued or last resumed, and OUT
+    revokes it. Like the lockout table, expired tokens are dropped from a heap ordered
+    by expiry on every call, so nothing has to wake up to clean them out.
+"""
+import heapq, secrets, threading, time
+from collections import namedtuple
+
+Session = namedtuple("Session", ["username", "ip_address", "udp_port"])
+
+
+def new_token():
+    return secrets.token_urlsafe(24)
+
+
+class SessionTable:
+    def __init__(self, ttl=300.0, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        # token -> (Session, expires)
+        self.sessions = {}
+        # (expires, token), a resumed token leaves a stale item behind
+        self.heap = []
+
+    def expire(self, now):
+        while self.heap and self.heap[0][0] <= now:
+            expires, token = heapq.heappop(self.heap)
+            entry = self.sessions.get(token)
+            if entry is not None and entry[1] == expires:
+                del self.sessions[token]
+
+    def issue(self, username, ip_address, udp_port):
+        token = new_token()
+        self.put(token, Session(username, ip_address, str(udp_port)))
+        return token
+
+    def put(self, token, session):
+        now = self.clock()
+        with self.lock:
+            self.expire(now)
+            expires = now + self.ttl
+            self.sessions[token] = (session, expires)
+            heapq.heappush(self.heap, (expires, token))
+
+    # the token's Session with its ttl started again, None if it is unknown or expired
+    def resume(self, token):
+        now = self.clock()
+        with self.lock:
+            self.expire(now)
+            entry = self.sessions.get(token)
+            if entry is None:
+                return None
+            expires = now + self.ttl
+            self.sessions[token] = (entry[0], expires)
+            heapq.heappush(self.heap, (expires, token))
+            return entry[0]
+
+    def revoke(self, token):
+        with self.lock:
+            self.sessions.pop(token, None)
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+class SharedSessionTable:
+    """
+        SessionTable's interface on a shared.SharedDatabase, so a token issued by one
+        worker process can be resumed on another. Times are wall clock seconds.
+    """
+
+    def __init__(self, database, ttl=300.0, clock=time.time):
+        self.database = database
+        self.ttl = ttl
+        self.clock = clock
+
+    def create(self):
+        def schema(db):
+            db.execute("DROP TABLE IF EXISTS sessions")
+            db.execute("CREATE TABLE sessions (token TEXT PRIMARY KEY, username TEXT, ip_address TEXT,"
+                       " udp_port TEXT, expires REAL)")
+            db.execute("CREATE INDEX sessions_expires ON sessions (expires)")
+        self.database.transaction(schema)
+
+    def issue(self, username, ip_address, udp_port):
+        token = new_token()
+        self.put(token, Session(username, ip_address, str(udp_port)))
+        return token
+
+    def put(self, token, session):
+        now = self.clock()
+
+        def insert(db):
+            db.execute("DELETE FROM sessions WHERE expires <= ?", (now,))
+            db.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?)", (token,) + tuple(session) + (now + self.ttl,))
+        self.database.transaction(insert)
+
+    def resume(self, token):
+        now = self.clock()
+
+        def touch(db):
+            row = db.execute("SELECT username, ip_address, udp_port FROM sessions WHERE token = ? AND expires > ?",
+                             (token, now)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE sessions SET expires = ? WHERE token = ?", (now + self.ttl, token))
+            return Session(*row)
+        return self.database.transaction(touch)
+
+    def revoke(self, token):
+        self.database.execute("DELETE FROM sessions WHERE token = ?", (token,))
+
+    def __len__(self):
+        return self.database.execute("SELECT COUNT(*) FROM sessions WHERE expires > ?", (self.clock(),))[0][0]
@@ -0,0 +1,56 @@
+"""
+    SQLite file for state the worker processes share
+    Python 3
+    coding: utf-8
+
+    With --workers N every worker process serves its own connections, so anything a
+    client on one worker must see from another (active devices, login lockouts, the
+    file index) lives in one local SQLite database in WAL mode instead of in memory.
+
+    A connection must not cross a fork, so each process opens its own on first use;
+    within a process one connection is shared by all threads behind a lock.
+"""
+import os, sqlite3, threading
+
+
+class SharedDatabase:
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.lock = threading.Lock()
+        self.db = None
+        self.pid = None
+
+    def connection(self):
+        if self.pid != os.getpid():
+            # first use in this process, main() closes the parent's connection before forking
+            self.db = sqlite3.connect(self.fileName, timeout=30, check_same_thread=False, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.pid = os.getpid()
+        return self.db
+
+    # run one statement, returns every row it produced
+    def execute(self, sql, params=()):
+        with self.lock:
+            return self.connection().execute(sql, params).fetchall()
+
+    # run func(connection) inside one write transaction, returns what func returns
+    def transaction(self, func):
+        with self.lock:
+            db = self.connection()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(db)
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+            return result
+
+    # to be called before forking, so no connection is carried into the workers
+    def close(self):
+        with self.lock:
+            if self.db is not None and self.pid == os.getpid():
+                self.db.close()
+            self.db = None
+            self.pid = None
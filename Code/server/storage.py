@@ -0,0 +1,182 @@
+"""
+    Storage of uploaded data files
+    Python 3
+    coding: utf-8
+
+    Uploads are kept under one root directory, sharded first by a hash of the owner
+    and then by owner, so no directory grows with the total number of uploads:
+
+        data/3f/supersmartwatch/supersmartwatch-1.txt
+        data/3f/supersmartwatch/supersmartwatch-2.bin
+
+    An in-memory index holds owner, fileID, path, size, record count and upload time
+    of every file, so checking that a file exists, deleting it and listing a device's
+    files never touch the directory. The index is rebuilt by walking the root at start
+    up, or, with index_name set, kept in SQLite and loaded from there. With shared set
+    (several worker processes) the SQLite table itself is the index and is queried
+    directly, so an upload handled by one worker is visible to all of them.
+"""
+import hashlib, os, re, threading
+from collections import namedtuple
+from datetime import datetime
+import datafile
+import shared as shared_state
+
+FileRecord = namedtuple("FileRecord", ["owner", "file_id", "path", "size", "records", "uploaded"])
+# owner-fileID.txt or owner-fileID.bin, as uploads have always been named
+DATA_FILE_NAME = re.compile(r"^(.+)-(\d+)\.(txt|bin)$")
+
+
+class Storage:
+    def __init__(self, root="data", index_name=None, shard_chars=2, shared=False):
+        self.root = root
+        self.index_name = index_name
+        self.shard_chars = shard_chars
+        self.shared = shared
+        self.lock = threading.Lock()
+        # owner -> {fileID -> FileRecord}
+        self.owners = {}
+        self.db = None
+
+    # load the index, from SQLite if there is one, else from the files under root
+    def open(self):
+        os.makedirs(self.root, exist_ok=True)
+        if self.index_name is None:
+            self.scan()
+            return
+        self.db = shared_state.SharedDatabase(self.index_name)
+        known = self.db.execute("SELECT name FROM sqlite_master WHERE name = 'files'")
+        if known and self.shared:
+            return
+        if known:
+            for row in self.db.execute("SELECT owner, file_id, path, size, records, uploaded FROM files"):
+                self.put(FileRecord(*row))
+            return
+        self.scan()
+
+        def fill(db):
+            db.execute("CREATE TABLE files (owner TEXT, file_id TEXT, path TEXT, size INTEGER,"
+                       " records INTEGER, uploaded TEXT, PRIMARY KEY (owner, file_id))")
+            db.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                           [record for files in self.owners.values() for record in files.values()])
+        self.db.transaction(fill)
+        if self.shared:
+            self.owners = {}
+
+    def scan(self):
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                match = DATA_FILE_NAME.match(name)
+                if match and os.path.basename(directory) == match.group(1):
+                    self.put(self.describe(match.group(1), match.group(2), os.path.join(directory, name)))
+
+    # move owner-fileID.txt/.bin files left in directory by earlier versions under root
+    def migrate(self, directory="."):
+        moved = 0
+        for name in os.listdir(directory):
+            match = DATA_FILE_NAME.match(name)
+            if match is None or not os.path.isfile(os.path.join(directory, name)):
+                continue
+            owner, fileId, fmt = match.groups()
+            path = self.upload_path(owner, fileId, "." + fmt)
+            os.replace(os.path.join(directory, name), path)
+            record = self.describe(owner, fileId, path)
+            self.add(owner, fileId, path, record.size, record.records)
+            moved += 1
+        return moved
+
+    # an index entry for a file already on disk, the records of a text file are counted on demand
+    @staticmethod
+    def describe(owner, fileId, path):
+        st = os.stat(path)
+        records = st.st_size // datafile.SAMPLE_SIZE if datafile.is_binary(path) else None
+        return FileRecord(owner, fileId, path, st.st_size, records, str(datetime.fromtimestamp(st.st_mtime)))
+
+    def directory(self, owner):
+        shard = hashlib.sha1(owner.encode()).hexdigest()[:self.shard_chars]
+        return os.path.join(self.root, shard, owner)
+
+    # where an upload should be written, the directory is created if needed
+    def upload_path(self, owner, fileId, suffix):
+        directory = self.directory(owner)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{owner}-{fileId}{suffix}")
+
+    def put(self, record):
+        self.owners.setdefault(record.owner, {})[record.file_id] = record
+
+    # record a finished upload, returns the record it replaced (whose file, if it was
+    # in the other format, has been removed) or None
+    def add(self, owner, fileId, path, size, records):
+        record = FileRecord(owner, fileId, path, size, records, str(datetime.now()))
+        if self.shared:
+            def replace(db):
+                row = db.execute("SELECT * FROM files WHERE owner = ? AND file_id = ?", (owner, fileId)).fetchone()
+                db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", record)
+                return FileRecord(*row) if row is not None else None
+            old = self.db.transaction(replace)
+        else:
+            with self.lock:
+                old = self.owners.get(owner, {}).get(fileId)
+                self.put(record)
+                if self.db is not None:
+                    self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", record)
+        if old is not None and old.path != path:
+            self.delete_file(old.path)
+        return old
+
+    def lookup(self, owner, fileId):
+        if self.shared:
+            rows = self.db.execute("SELECT * FROM files WHERE owner = ? AND file_id = ?", (owner, fileId))
+            return FileRecord(*rows[0]) if rows else None
+        return self.owners.get(owner, {}).get(fileId)
+
+    # delete a file, returns its record or None if there was no such file
+    def remove(self, owner, fileId):
+        if self.shared:
+            def delete(db):
+                row = db.execute("SELECT * FROM files WHERE owner = ? AND file_id = ?", (owner, fileId)).fetchone()
+                db.execute("DELETE FROM files WHERE owner = ? AND file_id = ?", (owner, fileId))
+                return FileRecord(*row) if row is not None else None
+            record = self.db.transaction(delete)
+            if record is not None:
+                self.delete_file(record.path)
+            return record
+        with self.lock:
+            files = self.owners.get(owner)
+            record = files.pop(fileId, None) if files else None
+            if record is None:
+                return None
+            if not files:
+                del self.owners[owner]
+            if self.db is not None:
+                self.db.execute("DELETE FROM files WHERE owner = ? AND file_id = ?", (owner, fileId))
+        self.delete_file(record.path)
+        return record
+
+    @staticmethod
+    def delete_file(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    # the owner's files ordered by fileID
+    def list(self, owner):
+        if self.shared:
+            rows = self.db.execute("SELECT * FROM files WHERE owner = ?", (owner,))
+            files = [FileRecord(*row) for row in rows]
+        else:
+            with self.lock:
+                files = list(self.owners.get(owner, {}).values())
+        return sorted(files, key=lambda record: int(record.file_id))
+
+    def __len__(self):
+        if self.shared:
+            return self.db.execute("SELECT COUNT(*) FROM files")[0][0]
+        return sum(len(files) for files in self.owners.values())
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,101 @@
+"""
+    Compression for frames on the wire
+    Python 3
+    coding: utf-8
+
+    A client asks for compression at login with "login compress=zstd,zlib", listing the
+    codecs it can use in the order it prefers them, and the server names the one it
+    picked in its welcome ("Welcome compress=zlib"). zlib and lzma come with Python,
+    zstd and lz4 are offered only when the zstandard and lz4 packages are installed.
+
+    Once agreed on, the server compresses replies of COMPRESS_MIN bytes or more in one
+    go and marks them with the top bit of the frame length, and an upload arrives as
+    a stream of frames of compressed bytes ended by an empty frame. Decompressor is
+    the streaming side of that: feed() takes one frame and yields the bytes it holds
+    in pieces of at most OUTPUT_LIMIT bytes where the codec allows, so a small frame
+    cannot blow up into a huge buffer.
+"""
+import lzma, zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4frame
+except ImportError:
+    lz4frame = None
+
+COMPRESS_MIN = 1024
+OUTPUT_LIMIT = 1024 * 1024
+
+
+class CodecError(ValueError):
+    pass
+
+
+# installed codecs, fastest first
+def available():
+    names = []
+    if zstandard is not None:
+        names.append("zstd")
+    if lz4frame is not None:
+        names.append("lz4")
+    return names + ["zlib", "lzma"]
+
+
+# the first codec the client offered that the server allows, None for no compression
+def choose(offered, allowed):
+    for name in offered:
+        if name in allowed:
+            return name
+    return None
+
+
+def compress(name, data, level=None):
+    if name == "zlib":
+        return zlib.compress(data, 6 if level is None else level)
+    elif name == "lzma":
+        return lzma.compress(data, preset=6 if level is None else level)
+    elif name == "zstd":
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+    elif name == "lz4":
+        return lz4frame.compress(data, compression_level=0 if level is None else level)
+    raise CodecError(f"unknown codec {name}")
+
+
+class Decompressor:
+    def __init__(self, name):
+        self.name = name
+        if name == "zlib":
+            self.stream = zlib.decompressobj()
+        elif name == "lzma":
+            self.stream = lzma.LZMADecompressor()
+        elif name == "zstd":
+            self.stream = zstandard.ZstdDecompressor().decompressobj()
+        elif name == "lz4":
+            self.stream = lz4frame.LZ4FrameDecompressor()
+        else:
+            raise CodecError(f"unknown codec {name}")
+
+    def feed(self, data):
+        try:
+            if self.name == "zlib":
+                piece = self.stream.decompress(data, OUTPUT_LIMIT)
+                while piece:
+                    yield piece
+                    piece = self.stream.decompress(self.stream.unconsumed_tail, OUTPUT_LIMIT)
+            elif self.name == "lzma":
+                piece = self.stream.decompress(data, OUTPUT_LIMIT)
+                while piece:
+                    yield piece
+                    if self.stream.eof or self.stream.needs_input:
+                        break
+                    piece = self.stream.decompress(b"", OUTPUT_LIMIT)
+            else:
+                piece = self.stream.decompress(data)
+                if piece:
+                    yield piece
+        except Exception as e:
+            raise CodecError(f"bad {self.name} data: {e}")
@@ -0,0 +1,70 @@
+"""
+    Process pool for CPU-heavy file work
+    Python 3
+    coding: utf-8
+
+    Parsing a data file for SCS or counting its samples for DTE holds the GIL for as
+    long as it runs, so on a thread it stalls every other client of the process. Work
+    handed to WorkPool runs in separate processes instead.
+
+    The pool is bounded twice: processes caps how much runs at once and max_queued
+    caps how much may wait behind it. submit() raises Busy as soon as both are full,
+    so the server can tell the client to retry rather than let the queue grow with
+    the load. A task that has not started yet is dropped when its future is
+    cancelled; one that is running finishes, but nobody waits for its result.
+"""
+import multiprocessing, threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+class Busy(Exception):
+    pass
+
+
+class WorkPool:
+    def __init__(self, processes, max_queued=64, timeout=30.0):
+        self.processes = processes
+        self.max_queued = max_queued
+        # seconds a client waits for its result before the task is given up
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.executor = None
+        # submitted and not finished yet, running or queued
+        self.pending = 0
+        self.submitted = 0
+        self.rejected = 0
+
+    def start(self):
+        # spawn rather than fork, the server process already runs threads
+        self.executor = ProcessPoolExecutor(max_workers=self.processes,
+                                            mp_context=multiprocessing.get_context("spawn"))
+
+    # same as Executor.submit, but raises Busy when the pool and its queue are full
+    def submit(self, func, *args):
+        with self.lock:
+            if self.pending >= self.processes + self.max_queued:
+                self.rejected += 1
+                raise Busy()
+            self.pending += 1
+            self.submitted += 1
+        try:
+            future = self.executor.submit(func, *args)
+        except BaseException:
+            self.done(None)
+            raise
+        future.add_done_callback(self.done)
+        return future
+
+    def done(self, future):
+        with self.lock:
+            self.pending -= 1
+
+    def counters(self):
+        with self.lock:
+            return {"processes": self.processes, "pending": self.pending,
+                    "submitted": self.submitted, "rejected": self.rejected}
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None